@@ -3,6 +3,7 @@ Inline Audio Player with Waveform Visualization for Music Library
 Uses pygame for audio playback and matplotlib for waveform display
 """
 
+import importlib.util
 import os
 import threading
 import time
@@ -24,12 +25,21 @@ try:
     # Suppress pydub ffmpeg warning
     warnings.filterwarnings("ignore", message="Couldn't find ffprobe or avprobe")
     from pydub import AudioSegment
-    import librosa
+    # librosa takes seconds to import and is only needed for files without a
+    # peaks sidecar, so it is imported on first use
+    if importlib.util.find_spec("librosa") is None:
+        raise ImportError("No module named 'librosa'")
     WAVEFORM_AVAILABLE = True
 except ImportError:
     WAVEFORM_AVAILABLE = False
     print("pydub/librosa not available - waveform visualization disabled")
 
+try:
+    from heartlib.peaks import compute_peaks, load_peaks, peaks_from_file, save_peaks
+    PEAKS_AVAILABLE = True
+except ImportError:
+    PEAKS_AVAILABLE = False
+
 try:
     from matplotlib.figure import Figure
     from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
@@ -42,7 +52,10 @@ except ImportError:
 class InlineAudioPlayer:
     """Inline audio player with waveform visualization and controls"""
     
-    def __init__(self, parent, file_path, theme_bg="#2b2b2b"):
+    def __init__(self, parent, file_path, theme_bg="#2b2b2b", defer_waveform=False):
+        # With defer_waveform the caller loads the peaks off the main thread
+        # and passes them to set_peaks()
+        self.defer_waveform = defer_waveform
         self.parent = parent
         self.file_path = file_path
         self.theme_bg = theme_bg
@@ -52,6 +65,7 @@ class InlineAudioPlayer:
         self.current_position = 0
         self.update_thread = None
         self.stop_update = False
+        self.peaks = None
         
         # Initialize pygame mixer
         if PYGAME_AVAILABLE:
@@ -62,7 +76,8 @@ class InlineAudioPlayer:
                 pass
         
         self.create_player_ui()
-        self.load_audio_info()
+        if not defer_waveform:
+            self.load_audio_info()
     
     def create_player_ui(self):
         """Create the compact player UI with waveform and controls"""
@@ -71,7 +86,7 @@ class InlineAudioPlayer:
         self.player_frame.pack(fill=tk.X, pady=2)
         
         # Waveform display area
-        if MATPLOTLIB_AVAILABLE and WAVEFORM_AVAILABLE:
+        if MATPLOTLIB_AVAILABLE and (WAVEFORM_AVAILABLE or PEAKS_AVAILABLE):
             self.create_waveform_display()
         else:
             # Fallback: simple progress bar
@@ -132,7 +147,8 @@ class InlineAudioPlayer:
         self.position_line = None
         
         # Load and display waveform
-        self.load_waveform()
+        if not self.defer_waveform:
+            self.load_waveform()
     
     def create_simple_progress(self):
         """Fallback: simple progress bar if matplotlib not available"""
@@ -142,33 +158,69 @@ class InlineAudioPlayer:
         self.progress_bar = ttk.Progressbar(progress_frame, mode='determinate', length=600)
         self.progress_bar.pack(fill=tk.X, padx=5)
     
+    def set_peaks(self, peaks, duration=None):
+        """Show waveform peaks loaded in the background (called from main thread)"""
+        self.peaks = peaks
+        if duration:
+            self.duration = duration
+        if peaks is not None and MATPLOTLIB_AVAILABLE and hasattr(self, 'ax'):
+            self.load_waveform()
+        self.update_time_label()
+    
+    def get_peaks(self):
+        """Waveform peaks from the sidecar file, decoding the audio only if there is none"""
+        if self.peaks is not None or not PEAKS_AVAILABLE:
+            return self.peaks
+        self.peaks = load_peaks(self.file_path)
+        if self.peaks is None:
+            try:
+                self.peaks = peaks_from_file(self.file_path)
+            except Exception:
+                # soundfile cannot read this file - decode with librosa instead
+                if not WAVEFORM_AVAILABLE:
+                    raise
+                import librosa
+                y, sr = librosa.load(self.file_path, sr=22050, mono=True)
+                self.peaks = compute_peaks(y, sr)
+                save_peaks(self.file_path, self.peaks)
+        return self.peaks
+    
     def load_waveform(self):
         """Load and display audio waveform"""
-        if not WAVEFORM_AVAILABLE or not MATPLOTLIB_AVAILABLE:
+        if not (WAVEFORM_AVAILABLE or PEAKS_AVAILABLE) or not MATPLOTLIB_AVAILABLE:
             return
         
         try:
-            # Load audio with librosa (faster for waveform)
-            y, sr = librosa.load(self.file_path, sr=22050, mono=True)
-            
-            # Downsample for display (show ~1000 points)
-            hop_length = max(1, len(y) // 1000)
-            y_display = y[::hop_length]
-            
-            # Time axis
-            time_display = np.arange(len(y_display)) * hop_length / sr
+            peaks = self.get_peaks()
+            if peaks is not None:
+                # Min/max envelope, ~1000 points
+                time_display, y_min, y_max = peaks.envelope(1000)
+                duration = peaks.duration
+            else:
+                # Load audio with librosa (faster for waveform)
+                import librosa
+                y, sr = librosa.load(self.file_path, sr=22050, mono=True)
+                
+                # Downsample for display (show ~1000 points)
+                hop_length = max(1, len(y) // 1000)
+                y_max = y[::hop_length]
+                y_min = np.zeros_like(y_max)
+                
+                # Time axis
+                time_display = np.arange(len(y_max)) * hop_length / sr
+                duration = len(y) / sr
             
             # Plot waveform
             self.ax.clear()
-            self.ax.fill_between(time_display, y_display, alpha=0.6, color='#4a9eff')
-            self.ax.plot(time_display, y_display, color='#2e7dd1', linewidth=0.5)
-            self.ax.set_xlim(0, len(y) / sr)
+            self.ax.fill_between(time_display, y_min, y_max, alpha=0.6, color='#4a9eff')
+            self.ax.plot(time_display, y_max, color='#2e7dd1', linewidth=0.5)
+            self.ax.set_xlim(0, duration)
             self.ax.set_ylim(-1, 1)
             self.ax.set_xlabel('Time (s)', color='#888888', fontsize=8)
             self.ax.set_ylabel('Amplitude', color='#888888', fontsize=8)
             
             # Store duration
-            self.duration = len(y) / sr
+            self.duration = duration
             
             # Initial position line
             self.position_line = self.ax.axvline(x=0, color='#ff4444', linewidth=2, alpha=0.8)
@@ -184,8 +236,15 @@ class InlineAudioPlayer:
             return
         
         try:
+            # The peaks sidecar already knows the duration
+            if self.duration == 0 and PEAKS_AVAILABLE:
+                try:
+                    self.duration = self.get_peaks().duration
+                except Exception:
+                    pass
+            
             # Get duration using pydub if available
-            if WAVEFORM_AVAILABLE:
+            if self.duration == 0 and WAVEFORM_AVAILABLE:
                 try:
                     audio = AudioSegment.from_mp3(self.file_path)
                     self.duration = len(audio) / 1000.0  # Convert to seconds
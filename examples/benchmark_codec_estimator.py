@@ -0,0 +1,70 @@
+from heartlib.heartcodec.models.transformer import LlamaTransformer
+import argparse
+import time
+import torch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--dtype", type=str, default="bfloat16")
+    parser.add_argument("--window_length", type=int, default=744)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--num_attention_heads", type=int, default=24)
+    parser.add_argument("--attention_head_dim", type=int, default=64)
+    parser.add_argument("--num_layers", type=int, default=24)
+    parser.add_argument("--num_layers_2", type=int, default=6)
+    parser.add_argument("--fuse_projections", action="store_true")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=10)
+    return parser.parse_args()
+
+
+def _sync(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+
+    # Randomly initialised estimator with the HeartCodec-oss geometry, so no
+    # checkpoint is needed to measure it.
+    estimator = (
+        LlamaTransformer(
+            num_attention_heads=args.num_attention_heads,
+            attention_head_dim=args.attention_head_dim,
+            in_channels=1024,
+            out_channels=256,
+            num_layers=args.num_layers,
+            num_layers_2=args.num_layers_2,
+            norm_type="ada_norm_single",
+        )
+        .to(device=device, dtype=dtype)
+        .eval()
+    )
+    if args.fuse_projections:
+        estimator.fuse_projections()
+    hidden_states = torch.randn(
+        args.batch_size, args.window_length, 1024, device=device, dtype=dtype
+    )
+    timestep = torch.rand(args.batch_size, device=device, dtype=dtype)
+
+    with torch.inference_mode():
+        for _ in range(args.warmup):
+            estimator(hidden_states, timestep=timestep)
+        _sync(device)
+        start = time.perf_counter()
+        for _ in range(args.iters):
+            estimator(hidden_states, timestep=timestep)
+        _sync(device)
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"estimator forward: {elapsed / args.iters * 1000:.2f} ms/iter "
+        f"(layers={args.num_layers}+{args.num_layers_2}, "
+        f"window={args.window_length}, batch={args.batch_size}, {args.dtype}, "
+        f"fused={args.fuse_projections})"
+    )
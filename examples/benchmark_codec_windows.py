@@ -0,0 +1,78 @@
+from heartlib.heartcodec.modeling_heartcodec import HeartCodec
+from heartlib.heartcodec.configuration_heartcodec import HeartCodecConfig
+import argparse
+import time
+import torch
+import torch.nn as nn
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--dtype", type=str, default="bfloat16")
+    parser.add_argument("--audio_length_s", type=float, default=240.0)
+    parser.add_argument("--num_steps", type=int, default=10)
+    parser.add_argument("--guidance_scale", type=float, default=1.25)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--iters", type=int, default=5)
+    return parser.parse_args()
+
+
+class _NullEstimator(nn.Module):
+    # Stands in for the DiT so that only the per-window work around it is timed.
+    def __init__(self, out_channels: int):
+        super().__init__()
+        self.out_channels = out_channels
+
+    def forward(self, hidden_states, timestep=None):
+        return hidden_states[..., : self.out_channels]
+
+
+def _sync(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+
+    config = HeartCodecConfig(num_layers=0, num_layers_2=0)
+    codec = HeartCodec(config).to(device=device, dtype=dtype).eval()
+    codec.flow_matching.estimator = _NullEstimator(config.out_channels)
+    # skip the waveform decoder as well, returning silence of the right length
+    upsample = config.num_samples * int(torch.tensor(config.upsample_factors).prod())
+    codec.scalar_model.decode = lambda x: torch.zeros(
+        x.shape[0], 1, x.shape[-1] * upsample, device=x.device, dtype=x.dtype
+    )
+
+    codes = torch.randint(
+        0,
+        config.codebook_size,
+        (config.num_quantizers, int(args.audio_length_s * 12.5)),
+        device=device,
+    )
+
+    def _run():
+        codec.detokenize(
+            codes,
+            num_steps=args.num_steps,
+            guidance_scale=args.guidance_scale,
+            disable_progress=True,
+        )
+
+    for _ in range(args.warmup):
+        _run()
+    _sync(device)
+    start = time.perf_counter()
+    for _ in range(args.iters):
+        _run()
+    _sync(device)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"detokenize overhead outside estimator and decoder: "
+        f"{elapsed / args.iters * 1000:.2f} ms/song "
+        f"({args.audio_length_s:.0f} s, {args.num_steps} steps, {args.dtype})"
+    )
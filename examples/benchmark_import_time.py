@@ -0,0 +1,126 @@
+"""
+Import-time report and budget check.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each module, subtracts what the interpreter imports at startup anyway, and
+prints the slowest top-level imports. Exits with status 1 if a module takes
+longer than its budget or pulls in one of the --forbid packages, so it can
+be run as a check:
+
+    python examples/benchmark_import_time.py
+    python examples/benchmark_import_time.py --module gui_app=1500 --forbid torch
+
+tests/test_import_time.py enforces the budgets with the same parser.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# `import time: self [us] | cumulative | imported package`, with the package
+# indented two spaces per nesting level
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "heartlib=150",
+    "heartlib.library=150",
+    "heartlib.batch_queue=400",
+]
+DEFAULT_FORBID = "torch,torchaudio,torchtune,transformers,tokenizers,vector_quantize_pytorch"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--module",
+        action="append",
+        default=None,
+        help="module to import, optionally with a budget in ms: heartlib=150",
+    )
+    parser.add_argument("--forbid", type=str, default=DEFAULT_FORBID)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    return parser.parse_args()
+
+
+def parse_importtime(stderr: str):
+    """[(module, self_us, cumulative_us, depth)] in the order reported."""
+    rows = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def run_importtime(code: str):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_REPO_ROOT, os.path.join(_REPO_ROOT, "src"), env.get("PYTHONPATH", "")]
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=_REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def measure(module: str, startup: set, repeat: int):
+    """
+    Fastest of `repeat` runs: (total ms, top-level rows, modules imported),
+    leaving out the modules the interpreter imports at startup.
+    """
+    best = None
+    for _ in range(repeat):
+        rows = [row for row in run_importtime(f"import {module}") if row[0] not in startup]
+        total_ms = sum(row[2] for row in rows if row[3] == 0) / 1000
+        if best is None or total_ms < best[0]:
+            best = (total_ms, rows)
+    total_ms, rows = best
+    return total_ms, [row for row in rows if row[3] <= 1], {row[0] for row in rows}
+
+
+def main():
+    args = parse_args()
+    forbid = [name.strip() for name in args.forbid.split(",") if name.strip()]
+    startup = {row[0] for row in run_importtime("pass")}
+
+    failures = []
+    for spec in args.module or DEFAULT_MODULES:
+        module, _, budget = spec.partition("=")
+        budget_ms = float(budget) if budget else None
+        total_ms, rows, imported = measure(module, startup, args.repeat)
+
+        budget_text = f" (budget {budget_ms:.0f} ms)" if budget_ms is not None else ""
+        print(f"{module}: {total_ms:.1f} ms{budget_text}, {len(imported)} modules")
+        for name, _, cumulative_us, depth in sorted(rows, key=lambda r: -r[2])[: args.top]:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {'  ' * depth}{name}")
+
+        if budget_ms is not None and total_ms > budget_ms:
+            failures.append(f"{module} took {total_ms:.1f} ms, over its {budget_ms:.0f} ms budget")
+        pulled_in = sorted(
+            name for name in forbid if any(m == name or m.startswith(name + ".") for m in imported)
+        )
+        if pulled_in:
+            failures.append(f"{module} imports {', '.join(pulled_in)}")
+
+    if failures:
+        print("\nFAILED")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+from heartlib import HeartTranscriptorPipeline
+from heartlib.pipelines.batch_transcription import BatchTranscriber, list_audio_files
+import argparse
+import json
+import torch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--music_dir", type=str, default="./output")
+    parser.add_argument("--output", type=str, default="./transcripts.jsonl")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--dtype", type=str, default="float16")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--decode_workers", type=int, default=2)
+    parser.add_argument("--silence_db", type=float, default=-40.0)
+    parser.add_argument("--max_segment_s", type=float, default=30.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pipe = HeartTranscriptorPipeline.from_pretrained(
+        args.model_path,
+        device=torch.device(args.device),
+        dtype=getattr(torch, args.dtype),
+    )
+    transcriber = BatchTranscriber(
+        pipe,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers,
+        max_segment_s=args.max_segment_s,
+        silence_db=args.silence_db,
+        max_new_tokens=256,
+        num_beams=2,
+        task="transcribe",
+        compression_ratio_threshold=1.8,
+        temperature=(0.0, 0.1, 0.2, 0.4),
+        logprob_threshold=-1.0,
+        no_speech_threshold=0.4,
+    )
+    paths = list_audio_files(args.music_dir)
+    print(f"Transcribing {len(paths)} songs from {args.music_dir}")
+    with open(args.output, "w", encoding="utf-8") as fp:
+        for song in transcriber.transcribe_files(paths):
+            fp.write(json.dumps(song.to_dict(), ensure_ascii=False) + "\n")
+            fp.flush()
+            status = (
+                f"error: {song.error}"
+                if song.error
+                else f"{len(song.segments)} segments"
+            )
+            print(f"{song.path}: {status}")
+    print(transcriber.report())
@@ -0,0 +1,81 @@
+from heartlib import HeartMuLaGenPipeline, HeartTranscriptorPipeline
+from heartlib.jobs import seed_everything
+from heartlib.library import GenerationLibrary
+from heartlib.verification import GenerateAndVerify, LyricsVerifier
+import argparse
+import os
+from pathlib import Path
+import torch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--version", type=str, default="3B")
+    parser.add_argument("--lyrics", type=str, default="./assets/lyrics.txt")
+    parser.add_argument("--tags", type=str, default="./assets/tags.txt")
+    parser.add_argument("--output_dir", type=str, default="./output")
+    parser.add_argument("--library", type=str, default="./generation_library.db")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+
+    parser.add_argument("--max_audio_length_ms", type=int, default=30_000)
+    parser.add_argument("--topk", type=int, default=50)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--cfg_scale", type=float, default=1.5)
+    parser.add_argument("--transcriptor_device", type=str, default="cuda")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pipe = HeartMuLaGenPipeline.from_pretrained(
+        args.model_path,
+        device=torch.device("cuda"),
+        dtype=torch.bfloat16,
+        version=args.version,
+    )
+    transcriptor = HeartTranscriptorPipeline.from_pretrained(
+        args.model_path,
+        device=torch.device(args.transcriptor_device),
+        dtype=torch.float16,
+    )
+    verifier = LyricsVerifier(
+        transcriptor,
+        max_new_tokens=256,
+        num_beams=2,
+        task="transcribe",
+        compression_ratio_threshold=1.8,
+        temperature=(0.0, 0.1, 0.2, 0.4),
+        logprob_threshold=-1.0,
+        no_speech_threshold=0.4,
+    )
+    library = GenerationLibrary(args.library, legacy_json=None)
+    run = GenerateAndVerify(pipe, verifier, library=library)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    inputs = {"lyrics": Path(args.lyrics), "tags": Path(args.tags)}
+    checks = []
+    for seed in args.seeds:
+        seed_everything(seed)
+        save_path = os.path.join(args.output_dir, f"verify_seed{seed}.mp3")
+        with torch.no_grad():
+            # the previous song is transcribed while this one generates
+            entry, check = run(
+                inputs,
+                save_path=save_path,
+                max_audio_length_ms=args.max_audio_length_ms,
+                topk=args.topk,
+                temperature=args.temperature,
+                cfg_scale=args.cfg_scale,
+                settings={"seed": seed},
+            )
+        checks.append((entry, check))
+
+    for entry, check in checks:
+        result = check.result()
+        print(
+            f"{entry['filename']}: WER {result['wer']:.1%} "
+            f"({result['word_errors']}/{result['lyrics_words']} words)"
+        )
+    run.shutdown()
+    library.close()
@@ -0,0 +1,106 @@
+"""
+End-to-end check of the headless job server without a model.
+
+Starts `heartlib.serve` on a free local port with a stub pipeline that
+"generates" one silent 80 ms frame at a time, then uses JobClient to submit
+jobs, poll them, cancel a running and a queued job, and send malformed
+requests. Exits with status 1 if the server does not behave as expected:
+
+    python examples/run_job_server_stub.py
+"""
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from heartlib.audio_writer import write_audio
+from heartlib.jobs import CANCELLED, DONE, QUEUED, RUNNING, JobRunner
+from heartlib.serve import JobClient, make_server
+
+ITEM = {"tags": "piano,happy", "lyrics": "[Verse]\nla la la"}
+
+
+class StubPipeline:
+    """Stands in for HeartMuLaGenPipeline: one sleep per 80 ms frame."""
+
+    def __init__(self, frame_delay: float):
+        self.frame_delay = frame_delay
+
+    def __call__(self, inputs, max_audio_length_ms, save_path, cancel_token, **kwargs):
+        for _ in range(max_audio_length_ms // 80):
+            cancel_token.raise_if_cancelled()
+            time.sleep(self.frame_delay)
+        write_audio(save_path, np.zeros((48000, 2), dtype=np.float32), 48000)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frame_delay", type=float, default=0.01)
+    parser.add_argument("--max_finished", type=int, default=2)
+    return parser.parse_args()
+
+
+def check(condition: bool, message: str):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def wait_for(client: JobClient, job_id: str, status: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while client.status(job_id)["status"] != status:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output_folder = tempfile.mkdtemp(prefix="heartlib-serve-")
+    runner = JobRunner(
+        StubPipeline(args.frame_delay), output_folder, max_finished=args.max_finished
+    )
+    runner.start()
+    server = make_server(runner, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = JobClient(f"http://127.0.0.1:{server.server_address[1]}")
+
+    # submit and poll to completion
+    job = client.submit(dict(ITEM, filename="short", max_audio_length_ms=800))
+    check(job["status"] in (QUEUED, RUNNING), f"submitted job {job['id']}")
+    done = client.wait(job["id"], poll_interval=0.02, timeout=10)
+    check(done["status"] == DONE, f"job finished with a file at {done['save_path']}")
+
+    # cancel a running job, and one queued behind it
+    running = client.submit(dict(ITEM, filename="long", max_audio_length_ms=60_000))
+    queued = client.submit(dict(ITEM, filename="queued"))
+    check(wait_for(client, running["id"], RUNNING), "long job started")
+    check(client.cancel(queued["id"])["status"] == CANCELLED, "queued job cancelled")
+    client.cancel(running["id"])
+    stopped = client.wait(running["id"], poll_interval=0.02, timeout=10)
+    check(stopped["status"] == CANCELLED, "running job stopped at its next frame")
+
+    # malformed jobs are rejected with 400, not a dropped connection
+    for bad in ({"topk": None}, {"seed": [1]}, ["not", "a", "job"]):
+        try:
+            client.submit(dict(ITEM, **bad) if isinstance(bad, dict) else bad)
+        except RuntimeError as e:
+            check("(400)" in str(e), f"rejected {bad!r}: {e}")
+        else:
+            check(False, f"accepted {bad!r}")
+
+    # only the most recently finished jobs are kept
+    listed = client.jobs()
+    check(
+        len(listed) == args.max_finished,
+        f"{len(listed)} finished jobs kept (max_finished={args.max_finished})",
+    )
+
+    server.shutdown()
+    server.server_close()
+    runner.stop()
@@ -1,5 +1,6 @@
 from heartlib import HeartMuLaGenPipeline
 import argparse
+from pathlib import Path
 import torch
 
 
@@ -10,32 +11,47 @@ def parse_args():
     parser.add_argument("--lyrics", type=str, default="./assets/lyrics.txt")
     parser.add_argument("--tags", type=str, default="./assets/tags.txt")
     parser.add_argument("--save_path", type=str, default="./assets/output.mp3")
+    parser.add_argument("--ref_audio", type=str, default=None)
+    parser.add_argument("--reference_cache_dir", type=str, default="./cache/muq")
 
     parser.add_argument("--max_audio_length_ms", type=int, default=30_000)
     parser.add_argument("--topk", type=int, default=50)
     parser.add_argument("--temperature", type=float, default=1.0)
     parser.add_argument("--cfg_scale", type=float, default=1.5)
+    parser.add_argument("--decode_chunk_size", type=int, default=None)
+    parser.add_argument("--save_frames", action="store_true")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
+    muq_mulan = None
+    if args.ref_audio is not None:
+        from heartlib.reference_audio import MuQMuLanEmbedder
+
+        muq_mulan = MuQMuLanEmbedder.from_pretrained(device=torch.device("cuda"))
     pipe = HeartMuLaGenPipeline.from_pretrained(
         args.model_path,
         device=torch.device("cuda"),
         dtype=torch.bfloat16,
         version=args.version,
+        muq_mulan=muq_mulan,
+        reference_cache_dir=args.reference_cache_dir,
     )
     with torch.no_grad():
         pipe(
             {
-                "lyrics": args.lyrics,
-                "tags": args.tags,
+                # Path values are read from disk; plain strings are the text itself
+                "lyrics": Path(args.lyrics),
+                "tags": Path(args.tags),
+                "ref_audio": args.ref_audio,
             },
             max_audio_length_ms=args.max_audio_length_ms,
             save_path=args.save_path,
             topk=args.topk,
             temperature=args.temperature,
             cfg_scale=args.cfg_scale,
+            decode_chunk_size=args.decode_chunk_size,
+            save_frames=args.save_frames,
         )
     print(f"Generated music saved to {args.save_path}")
@@ -0,0 +1,38 @@
+from heartlib import HeartMuLaGenPipeline
+import argparse
+import torch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--version", type=str, default="3B")
+    parser.add_argument("--frames", type=str, default="./assets/output.frames.npy")
+    parser.add_argument("--save_path", type=str, default="./assets/render.mp3")
+    parser.add_argument("--num_steps", type=int, default=10)
+    parser.add_argument("--guidance_scale", type=float, default=1.25)
+    parser.add_argument("--duration", type=float, default=29.76)
+    parser.add_argument("--decode_chunk_size", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pipe = HeartMuLaGenPipeline.from_pretrained(
+        args.model_path,
+        device=torch.device("cuda"),
+        dtype=torch.bfloat16,
+        version=args.version,
+        # only HeartCodec is needed, so HeartMuLa is never loaded
+        lazy_load=True,
+    )
+    with torch.no_grad():
+        pipe.render(
+            args.frames,
+            save_path=args.save_path,
+            num_steps=args.num_steps,
+            guidance_scale=args.guidance_scale,
+            duration=args.duration,
+            decode_chunk_size=args.decode_chunk_size,
+        )
+    print(f"Rendered {args.frames} to {args.save_path}")
@@ -6,8 +6,12 @@ from datetime import datetime
 import threading
 import json
 from pathlib import Path
-import torch
-from heartlib import HeartMuLaGenPipeline
+# torch and the heartlib pipelines take seconds to import; they are imported
+# where they are first needed, so the window shows right away
+from heartlib.cancellation import CancellationToken, GenerationCancelled
+from heartlib.batch_queue import BatchQueue, BatchWorker, PENDING
+from heartlib.library import GenerationLibrary
+from library_worker import LibraryMetadataWorker
 from PIL import Image, ImageTk
 
 # Try to import inline audio player
@@ -18,13 +22,9 @@ except ImportError:
     AUDIO_PLAYER_AVAILABLE = False
     print("Audio player not available - using system default player")
 
-try:
-    from transformers import BitsAndBytesConfig
-    BITSANDBYTES_AVAILABLE = True
-except ImportError:
-    BITSANDBYTES_AVAILABLE = False
-    BitsAndBytesConfig = None
 
+# Library cards materialized at a time (4 rows of 3)
+LIBRARY_PAGE_SIZE = 12
 
 THEMES = {
     "Dark Blue/Grey": {
@@ -186,9 +186,10 @@ class HeartMuLaGUI:
         self.root.title("HeartMuLa Music Generator")
         self.root.geometry("1200x950")
         
-        self.batch_queue = []
+        self.batch_queue = BatchQueue("batch_queue.jsonl")
         self.pipe = None
         self.is_generating = False
+        self.cancel_token = None
         self.current_theme = "Dark Blue/Grey"
         
         self.available_tags = [
@@ -201,7 +202,8 @@ class HeartMuLaGUI:
         ]
         
         self.setup_ui()
-        self.check_cuda_on_startup()
+        # Importing torch for the check is slow; do it off the main loop
+        threading.Thread(target=self.check_cuda_on_startup, daemon=True).start()
         self.load_config()
         self.apply_theme(self.current_theme)
         
@@ -235,7 +237,10 @@ class HeartMuLaGUI:
         notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
         
         # Initialize generation history (will load after log_text is created)
-        self.generation_history = []
+        self.library = None
+        self.library_page = 0
+        self.library_cards = []  # (entry id, card) for the page on screen
+        self.library_worker = None  # loads card metadata off the main loop
         
         self.setup_generation_tab(generation_frame)
         self.setup_batch_tab(batch_frame)
@@ -258,10 +263,16 @@ class HeartMuLaGUI:
         self.status_bar.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
         
         # Load generation history after all UI elements are created
+        # Missing files are detected per card as they are shown
         self.load_generation_history()
-        self.cleanup_deleted_files()
         self.populate_library()
         
+        # Restore the batch queue left by a previous session
+        self.refresh_batch_tree()
+        pending = len(self.batch_queue.items(PENDING))
+        if pending:
+            self.log(f"Batch queue restored: {pending} item(s) pending")
+        
     def setup_generation_tab(self, parent):
         parent.columnconfigure(0, weight=1)
         parent.columnconfigure(1, weight=0)
@@ -455,6 +466,9 @@ class HeartMuLaGUI:
         
         ttk.Button(buttons_frame, text="Clear Form", command=self.clear_form).grid(row=0, column=2, padx=5)
         
+        self.stop_btn = ttk.Button(buttons_frame, text="Stop", command=self.stop_generation, state='disabled')
+        self.stop_btn.grid(row=0, column=3, padx=5)
+        
     def update_audio_length_label(self, value=None):
         """Update the audio length label when slider changes"""
         seconds = self.audio_length_seconds.get()
@@ -472,9 +486,23 @@ class HeartMuLaGUI:
         header_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
         
         ttk.Label(header_frame, text="🎵 Music Library", font=('TkDefaultFont', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+        
+        # Search by filename, tags or lyrics
+        self.library_search_var = tk.StringVar()
+        search_entry = ttk.Entry(header_frame, textvariable=self.library_search_var, width=25)
+        search_entry.pack(side=tk.LEFT, padx=(10, 2))
+        search_entry.bind("<Return>", lambda e: self.search_library())
+        ttk.Button(header_frame, text="🔍", command=self.search_library, width=3).pack(side=tk.LEFT, padx=2)
+        
         ttk.Button(header_frame, text="🔄 Refresh", command=self.refresh_library, width=10).pack(side=tk.RIGHT, padx=2)
         ttk.Button(header_frame, text="🗑️ Clear", command=self.clear_library_history, width=8).pack(side=tk.RIGHT, padx=2)
         
+        # Page navigation; only the cards of the current page exist
+        ttk.Button(header_frame, text="▶", command=lambda: self.change_library_page(1), width=3).pack(side=tk.RIGHT, padx=2)
+        self.library_page_label = ttk.Label(header_frame, text="")
+        self.library_page_label.pack(side=tk.RIGHT, padx=2)
+        ttk.Button(header_frame, text="◀", command=lambda: self.change_library_page(-1), width=3).pack(side=tk.RIGHT, padx=2)
+        
         # Scrollable library content
         library_canvas = tk.Canvas(parent, bg=THEMES[self.current_theme]["bg"], highlightthickness=0)
         library_scrollbar = ttk.Scrollbar(parent, orient="vertical", command=library_canvas.yview)
@@ -506,16 +534,18 @@ class HeartMuLaGUI:
         list_frame.columnconfigure(0, weight=1)
         list_frame.rowconfigure(0, weight=1)
         
-        self.batch_tree = ttk.Treeview(list_frame, columns=("Tags", "Length", "Filename"), show="tree headings", height=15)
+        self.batch_tree = ttk.Treeview(list_frame, columns=("Tags", "Length", "Filename", "Status"), show="tree headings", height=15)
         self.batch_tree.heading("#0", text="ID")
         self.batch_tree.heading("Tags", text="Tags")
         self.batch_tree.heading("Length", text="Length (s)")
         self.batch_tree.heading("Filename", text="Filename")
+        self.batch_tree.heading("Status", text="Status")
         
         self.batch_tree.column("#0", width=50)
         self.batch_tree.column("Tags", width=300)
         self.batch_tree.column("Length", width=100)
         self.batch_tree.column("Filename", width=200)
+        self.batch_tree.column("Status", width=80)
         
         scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.batch_tree.yview)
         self.batch_tree.configure(yscrollcommand=scrollbar.set)
@@ -530,11 +560,15 @@ class HeartMuLaGUI:
         self.start_batch_btn.grid(row=0, column=0, padx=5)
         
         ttk.Button(buttons_frame, text="Remove Selected", command=self.remove_from_batch).grid(row=0, column=1, padx=5)
-        ttk.Button(buttons_frame, text="Clear All", command=self.clear_batch).grid(row=0, column=2, padx=5)
+        ttk.Button(buttons_frame, text="Retry Failed", command=self.retry_failed_batch).grid(row=0, column=2, padx=5)
+        ttk.Button(buttons_frame, text="Clear All", command=self.clear_batch).grid(row=0, column=3, padx=5)
+        
+        self.stop_batch_btn = ttk.Button(buttons_frame, text="Stop", command=self.stop_generation, state='disabled')
+        self.stop_batch_btn.grid(row=0, column=4, padx=5)
         
         self.batch_progress = ttk.Progressbar(buttons_frame, mode='determinate')
-        self.batch_progress.grid(row=0, column=3, padx=20, sticky=(tk.W, tk.E))
-        buttons_frame.columnconfigure(3, weight=1)
+        self.batch_progress.grid(row=0, column=5, padx=20, sticky=(tk.W, tk.E))
+        buttons_frame.columnconfigure(5, weight=1)
         
     def setup_settings_tab(self, parent):
         row = 0
@@ -853,7 +887,9 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
     
     def check_cuda_on_startup(self):
         """Check CUDA availability on startup and warn user if not available"""
+        # Runs on a background thread; Tk calls are posted back with root.after
         try:
+            import torch
             cuda_available = torch.cuda.is_available()
             torch_version = torch.__version__
             
@@ -870,8 +906,8 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 print(f"Total VRAM: {total_vram:.2f} GB")
                 print("="*60 + "\n")
                 
-                self.log(f"✓ CUDA available - GPU: {torch.cuda.get_device_name(0)}")
-                self.log(f"✓ VRAM: {total_vram:.2f} GB")
+                self.root.after(0, self.log, f"✓ CUDA available - GPU: {torch.cuda.get_device_name(0)}")
+                self.root.after(0, self.log, f"✓ VRAM: {total_vram:.2f} GB")
             else:
                 print("="*60)
                 print("\n⚠ WARNING: CUDA NOT AVAILABLE!")
@@ -885,12 +921,12 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 print("- Change Device to 'cpu'")
                 print("="*60 + "\n")
                 
-                self.log("⚠ WARNING: CUDA NOT AVAILABLE!")
-                self.log("PyTorch not compiled with CUDA support")
-                self.log("Run fix_cuda_issue.bat to fix, or use CPU mode (slow)")
+                self.root.after(0, self.log, "⚠ WARNING: CUDA NOT AVAILABLE!")
+                self.root.after(0, self.log, "PyTorch not compiled with CUDA support")
+                self.root.after(0, self.log, "Run fix_cuda_issue.bat to fix, or use CPU mode (slow)")
                 
                 # Show warning dialog
-                self.root.after(1000, lambda: messagebox.showwarning(
+                self.root.after(0, lambda: messagebox.showwarning(
                     "CUDA Not Available",
                     "PyTorch is not compiled with CUDA support!\n\n"
                     "GPU acceleration will NOT work.\n\n"
@@ -902,7 +938,7 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 ))
         except Exception as e:
             print(f"Error checking CUDA: {e}")
-            self.log(f"Error checking CUDA: {e}")
+            self.root.after(0, self.log, f"Error checking CUDA: {e}")
     
     def load_model(self):
         if self.is_generating:
@@ -910,7 +946,9 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
             return
         
         def load_thread():
+            import torch
             try:
+                from heartlib import HeartMuLaGenPipeline
                 self.log("Loading model... This may take a few minutes.")
                 self.update_status("Loading model...")
                 self.load_model_btn.config(state='disabled')
@@ -1034,12 +1072,16 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
             messagebox.showwarning("No Lyrics", "Please enter lyrics.")
             return
         
+        self.cancel_token = CancellationToken()
+        
         def generate_thread():
+            import torch
             self.is_generating = True
             start_time = datetime.now()  # Track start time
             try:
                 self.generate_btn.config(state='disabled')
                 self.add_batch_btn.config(state='disabled')
+                self.stop_btn.config(state='normal')
                 
                 output_folder = Path(self.output_folder_var.get())
                 output_folder.mkdir(parents=True, exist_ok=True)
@@ -1104,6 +1146,7 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                         topk=topk,
                         temperature=temperature,
                         cfg_scale=cfg_scale,
+                        cancel_token=self.cancel_token,
                     )
                 
                 # Step 3: Audio Decoding
@@ -1133,6 +1176,9 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 
                 messagebox.showinfo("Success", f"Music generated successfully!\n{save_path}\n\nGenerated in {minutes} min {seconds} sec")
                 
+            except GenerationCancelled:
+                self.log("Generation stopped")
+                self.update_status("Generation stopped")
             except Exception as e:
                 self.log(f"Error during generation: {str(e)}")
                 self.update_status("Generation failed")
@@ -1141,6 +1187,7 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 self.is_generating = False
                 self.generate_btn.config(state='normal')
                 self.add_batch_btn.config(state='normal')
+                self.stop_btn.config(state='disabled')
         
         threading.Thread(target=generate_thread, daemon=True).start()
     
@@ -1169,33 +1216,67 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
             "filename": self.filename_var.get()
         }
         
-        self.batch_queue.append(batch_item)
+        try:
+            self.batch_queue.add(batch_item)
+        except ValueError as e:
+            messagebox.showwarning("Invalid Item", str(e))
+            return
         
+        self.refresh_batch_tree()
         item_id = len(self.batch_queue)
-        length_s = batch_item["max_audio_length_ms"] / 1000
-        self.batch_tree.insert("", tk.END, text=str(item_id), 
-                               values=(batch_item["tags"], f"{length_s:.1f}", batch_item["filename"]))
         
         self.log(f"Added to batch queue (#{item_id}): {batch_item['filename']}")
         messagebox.showinfo("Added", f"Added to batch queue (#{item_id})")
     
+    def refresh_batch_tree(self):
+        """Rebuild the batch list from the on-disk queue"""
+        for item in self.batch_tree.get_children():
+            self.batch_tree.delete(item)
+        for idx, entry in enumerate(self.batch_queue.items(), 1):
+            batch_item = entry["item"]
+            length_s = batch_item["max_audio_length_ms"] / 1000
+            self.batch_tree.insert("", tk.END, iid=entry["id"], text=str(idx),
+                                   values=(batch_item["tags"], f"{length_s:.1f}", batch_item["filename"], entry["state"]))
+    
     def remove_from_batch(self):
+        if self.is_generating:
+            messagebox.showwarning("Busy", "Cannot change the batch queue while generating.")
+            return
+        
         selected = self.batch_tree.selection()
         if not selected:
             messagebox.showwarning("No Selection", "Please select an item to remove.")
             return
         
         for item in selected:
-            idx = int(self.batch_tree.item(item, "text")) - 1
-            self.batch_tree.delete(item)
+            self.batch_queue.remove(item)
+        self.refresh_batch_tree()
         
         self.log("Removed selected items from batch queue")
     
+    def retry_failed_batch(self):
+        """Requeue the selected failed items, or every failed item if none is selected"""
+        if self.is_generating:
+            messagebox.showwarning("Busy", "Cannot change the batch queue while generating.")
+            return
+        
+        selected = self.batch_tree.selection()
+        count = self.batch_queue.retry_failed(list(selected) if selected else None)
+        if count == 0:
+            messagebox.showinfo("Nothing to Retry", "There are no failed items to retry.")
+            return
+        self.refresh_batch_tree()
+        
+        self.log(f"Requeued {count} failed batch items")
+    
     def clear_batch(self):
+        if self.is_generating:
+            messagebox.showwarning("Busy", "Cannot change the batch queue while generating.")
+            return
+        
         if messagebox.askyesno("Clear Batch", "Are you sure you want to clear the entire batch queue?"):
             self.batch_queue.clear()
-            for item in self.batch_tree.get_children():
-                self.batch_tree.delete(item)
+            self.refresh_batch_tree()
             self.log("Batch queue cleared")
     
     def start_batch_processing(self):
@@ -1207,10 +1288,12 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
             messagebox.showwarning("Busy", "Already generating music. Please wait.")
             return
         
-        if not self.batch_queue:
-            messagebox.showwarning("Empty Queue", "Batch queue is empty. Add items first.")
+        if not self.batch_queue.items(PENDING):
+            messagebox.showwarning("Empty Queue", "No pending items in the batch queue. Add items first, or use Retry Failed to requeue failed ones.")
             return
         
+        self.cancel_token = CancellationToken()
+        
         def batch_thread():
             self.is_generating = True
             batch_start_time = datetime.now()  # Track batch start time
@@ -1218,57 +1301,39 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 self.start_batch_btn.config(state='disabled')
                 self.generate_btn.config(state='disabled')
                 self.add_batch_btn.config(state='disabled')
+                self.stop_batch_btn.config(state='normal')
                 
-                total = len(self.batch_queue)
+                total = len(self.batch_queue.items(PENDING))
                 self.batch_progress['maximum'] = total
                 self.batch_progress['value'] = 0
+                progress = {"index": 0}
                 
-                output_folder = Path(self.output_folder_var.get())
-                output_folder.mkdir(parents=True, exist_ok=True)
+                def on_event(event, entry):
+                    item = entry["item"]
+                    if event == "start":
+                        progress["index"] += 1
+                        self.log(f"Processing batch item {progress['index']}/{total}: {item['filename']}")
+                        self.update_status(f"Processing batch {progress['index']}/{total}")
+                        self.log(f"  Generating {item['max_audio_length_ms'] // 80} frames...")
+                    elif event == "done":
+                        elapsed = entry["elapsed"]
+                        self.log(f"Completed: {entry['save_path']} (generated in {int(elapsed // 60)} min {int(elapsed % 60)} sec)")
+                        self.batch_progress['value'] = progress["index"]
+                    elif event == "failed":
+                        self.log(f"Failed: {item['filename']}: {entry['error']}")
+                        self.batch_progress['value'] = progress["index"]
+                    self.root.after(0, self.refresh_batch_tree)
                 
-                for idx, item in enumerate(self.batch_queue, 1):
-                    item_start_time = datetime.now()  # Track item start time
-                    self.log(f"Processing batch item {idx}/{total}: {item['filename']}")
-                    self.update_status(f"Processing batch {idx}/{total}")
-                    
-                    filename = item['filename']
-                    if self.timestamp_var.get():
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"{filename}_{timestamp}"
-                    
-                    save_path = output_folder / f"{filename}.mp3"
-                    
-                    # Step 1: Prompt Processing
-                    self.log(f"  Step 1/3: Processing prompt...")
-                    
-                    # Step 2: Frame Generation
-                    max_frames = item["max_audio_length_ms"] // 80
-                    self.log(f"  Step 2/3: Generating {max_frames} frames...")
-                    
-                    with torch.no_grad():
-                        self.pipe(
-                            {
-                                "lyrics": item["lyrics"],
-                                "tags": item["tags"],
-                            },
-                            max_audio_length_ms=item["max_audio_length_ms"],
-                            save_path=str(save_path),
-                            topk=item["topk"],
-                            temperature=item["temperature"],
-                            cfg_scale=item["cfg_scale"],
-                        )
-                    
-                    # Step 3: Audio Decoding
-                    self.log(f"  Step 3/3: Decoding audio...")
-                    
-                    # Calculate item generation time
-                    item_end_time = datetime.now()
-                    item_elapsed = item_end_time - item_start_time
-                    item_minutes = int(item_elapsed.total_seconds() // 60)
-                    item_seconds = int(item_elapsed.total_seconds() % 60)
-                    
-                    self.log(f"Completed: {save_path} (generated in {item_minutes} min {item_seconds} sec)")
-                    self.batch_progress['value'] = idx
+                worker = BatchWorker(
+                    self.pipe,
+                    self.batch_queue,
+                    self.output_folder_var.get(),
+                    timestamp=self.timestamp_var.get(),
+                    on_event=on_event,
+                )
+                counts = worker.run(cancel_token=self.cancel_token)
+                if self.cancel_token.cancelled:
+                    raise GenerationCancelled("batch processing stopped")
                 
                 # Calculate total batch time
                 batch_end_time = datetime.now()
@@ -1276,13 +1341,18 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 batch_minutes = int(batch_elapsed.total_seconds() // 60)
                 batch_seconds = int(batch_elapsed.total_seconds() % 60)
                 
-                self.log(f"Batch processing complete! Generated {total} files.")
+                self.log(f"Batch processing complete! Generated {counts['done']} files, {counts['failed']} failed.")
                 self.log(f"Total batch time: {batch_minutes} min {batch_seconds} sec")
                 self.update_status("Batch processing complete")
-                messagebox.showinfo("Complete", f"Batch processing complete!\nGenerated {total} files.\n\nTotal time: {batch_minutes} min {batch_seconds} sec")
+                messagebox.showinfo("Complete", f"Batch processing complete!\nGenerated {counts['done']} files, {counts['failed']} failed.\n\nTotal time: {batch_minutes} min {batch_seconds} sec")
                 
-                self.clear_batch()
+                # Failed items stay queued so they can be inspected, retried or removed
+                self.batch_queue.clear_finished()
+                self.root.after(0, self.refresh_batch_tree)
                 
+            except GenerationCancelled:
+                self.log("Batch processing stopped")
+                self.update_status("Batch processing stopped")
             except Exception as e:
                 self.log(f"Error during batch processing: {str(e)}")
                 self.update_status("Batch processing failed")
@@ -1292,10 +1362,17 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
                 self.start_batch_btn.config(state='normal')
                 self.generate_btn.config(state='normal')
                 self.add_batch_btn.config(state='normal')
+                self.stop_batch_btn.config(state='disabled')
                 self.batch_progress['value'] = 0
         
         threading.Thread(target=batch_thread, daemon=True).start()
     
+    def stop_generation(self):
+        """Stop the running generation at its next frame or decoding step"""
+        if self.is_generating and self.cancel_token is not None:
+            self.cancel_token.cancel()
+            self.log("Stopping generation...")
+    
     def randomize_seed(self):
         """Generate a random seed"""
         import random
@@ -1561,77 +1638,70 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
     
     # Music Library Methods
     def load_generation_history(self):
-        """Load generation history from JSON file"""
-        history_file = "generation_history.json"
+        """Open the library database, importing generation_history.json once"""
         try:
-            if os.path.exists(history_file):
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    self.generation_history = json.load(f)
-                self.log(f"Loaded {len(self.generation_history)} items from history")
-            else:
-                self.generation_history = []
+            if self.library is None:
+                migrating = os.path.exists("generation_history.json")
+                self.library = GenerationLibrary("generation_library.db")
+                self.library_worker = LibraryMetadataWorker(self.root, self.library)
+                if migrating:
+                    self.log("Imported generation_history.json into the library database")
+            self.log(f"Loaded {self.library.count()} items from history")
         except Exception as e:
             self.log(f"Error loading history: {e}")
-            self.generation_history = []
     
     def cleanup_deleted_files(self):
         """Remove library entries for files that no longer exist"""
-        if not self.generation_history:
-            return
-        
-        initial_count = len(self.generation_history)
-        removed_count = 0
-        
-        # Filter out entries where the file no longer exists
-        valid_entries = []
-        for entry in self.generation_history:
-            file_path = entry.get('file_path', '')
-            if file_path and os.path.exists(file_path):
-                valid_entries.append(entry)
-            else:
-                removed_count += 1
-        
-        # Update history if any files were removed
-        if removed_count > 0:
-            self.generation_history = valid_entries
-            try:
-                history_file = "generation_history.json"
-                with open(history_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.generation_history, f, indent=2, ensure_ascii=False)
+        try:
+            removed_count = self.library.prune_missing()
+            if removed_count > 0:
                 self.log(f"Cleaned up {removed_count} deleted file(s) from library")
-            except Exception as e:
-                self.log(f"Error saving cleaned history: {e}")
+        except Exception as e:
+            self.log(f"Error cleaning up library: {e}")
     
     def save_generation_to_history(self, file_path, settings):
         """Save a generation to history"""
-        history_file = "generation_history.json"
         try:
-            history_entry = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "file_path": str(file_path),
-                "filename": os.path.basename(file_path),
-                "settings": settings
-            }
-            
-            self.generation_history.insert(0, history_entry)
-            
-            with open(history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.generation_history, f, indent=2, ensure_ascii=False)
+            history_entry = self.library.add(str(file_path), settings)
             
             if hasattr(self, 'library_scrollable'):
-                self.populate_library()
+                # Called from generation threads; Tk widgets belong to the main loop
+                self.root.after(0, lambda: self.add_library_card(history_entry))
                 
         except Exception as e:
             self.log(f"Error saving to history: {e}")
     
+    def library_query(self):
+        """Current library search, as keyword arguments for the store"""
+        search = self.library_search_var.get().strip() if hasattr(self, 'library_search_var') else ""
+        return {"search": search or None}
+    
+    def update_library_page_label(self, total):
+        pages = max(1, (total + LIBRARY_PAGE_SIZE - 1) // LIBRARY_PAGE_SIZE)
+        self.library_page_label.config(text=f"Page {self.library_page + 1}/{pages} ({total} songs)")
+    
     def populate_library(self):
-        """Populate the library with all generated songs in 3-column grid"""
+        """Show the current page of the library in a 3-column grid"""
         for widget in self.library_scrollable.winfo_children():
             widget.destroy()
+        self.library_cards = []
+        
+        if self.library is None:
+            return
         
-        if not self.generation_history:
+        query = self.library_query()
+        total = self.library.count(**query)
+        last_page = max(0, (total - 1) // LIBRARY_PAGE_SIZE)
+        self.library_page = min(self.library_page, last_page)
+        self.update_library_page_label(total)
+        
+        if total == 0:
             empty_frame = ttk.Frame(self.library_scrollable)
             empty_frame.pack(fill=tk.BOTH, expand=True, pady=50)
+            if query["search"]:
+                ttk.Label(empty_frame, text="🔍 No songs match your search", 
+                         font=('TkDefaultFont', 14)).pack(pady=10)
+                return
             ttk.Label(empty_frame, text="🎵 No songs in library yet", 
                      font=('TkDefaultFont', 14)).pack(pady=10)
             ttk.Label(empty_frame, text="Generate some music to see it here!", 
@@ -1643,10 +1713,47 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
         self.library_scrollable.columnconfigure(1, weight=1, uniform="card")
         self.library_scrollable.columnconfigure(2, weight=1, uniform="card")
         
-        for idx, entry in enumerate(self.generation_history):
+        entries = self.library.page(self.library_page * LIBRARY_PAGE_SIZE, LIBRARY_PAGE_SIZE, **query)
+        for idx, entry in enumerate(entries):
             row = idx // 3
             col = idx % 3
-            self.create_library_card(entry, idx, row, col)
+            card = self.create_library_card(entry, idx, row, col)
+            self.library_cards.append((entry['id'], card))
+        self.library_canvas.yview_moveto(0)
+    
+    def add_library_card(self, entry):
+        """Show a new entry without rebuilding the page"""
+        total = self.library.count(**self.library_query())
+        if self.library_page != 0 or self.library_query()["search"] or not self.library_cards:
+            # The new entry is not on this page, or the page is the empty placeholder
+            if not self.library_cards:
+                self.populate_library()
+            else:
+                self.update_library_page_label(total)
+            return
+        
+        card = self.create_library_card(entry, 0, 0, 0)
+        self.library_cards.insert(0, (entry['id'], card))
+        if len(self.library_cards) > LIBRARY_PAGE_SIZE:
+            _, last_card = self.library_cards.pop()
+            last_card.destroy()
+        for idx, (_, card) in enumerate(self.library_cards):
+            card.grid_configure(row=idx // 3, column=idx % 3)
+        self.update_library_page_label(total)
+    
+    def change_library_page(self, step):
+        if self.library is None:
+            return
+        total = self.library.count(**self.library_query())
+        last_page = max(0, (total - 1) // LIBRARY_PAGE_SIZE)
+        page = min(max(self.library_page + step, 0), last_page)
+        if page != self.library_page:
+            self.library_page = page
+            self.populate_library()
+    
+    def search_library(self):
+        self.library_page = 0
+        self.populate_library()
     
     def create_library_card(self, entry, idx, row, col):
         """Create a compact card widget for a library entry in grid layout"""
@@ -1676,9 +1783,10 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
         tags_label.grid(row=row_idx, column=1, sticky=tk.W, padx=2, pady=1)
         
         row_idx += 1
-        duration_sec = settings.get('max_length_ms', 0) / 1000
+        duration_sec = entry.get('duration_s') or settings.get('max_length_ms', 0) / 1000
         ttk.Label(settings_grid, text="Duration:", font=('TkDefaultFont', 8, 'bold')).grid(row=row_idx, column=0, sticky=tk.W, padx=2, pady=1)
-        ttk.Label(settings_grid, text=f"{duration_sec:.0f}s", font=('TkDefaultFont', 8)).grid(row=row_idx, column=1, sticky=tk.W, padx=2, pady=1)
+        duration_label = ttk.Label(settings_grid, text=self.format_card_duration(duration_sec, settings.get('loudness_db')), font=('TkDefaultFont', 8))
+        duration_label.grid(row=row_idx, column=1, sticky=tk.W, padx=2, pady=1)
         
         row_idx += 1
         ttk.Label(settings_grid, text="Seed:", font=('TkDefaultFont', 8, 'bold')).grid(row=row_idx, column=0, sticky=tk.W, padx=2, pady=1)
@@ -1695,10 +1803,16 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
             ttk.Label(settings_grid, text="Lyrics:", font=('TkDefaultFont', 8, 'bold')).grid(row=row_idx, column=0, sticky=tk.W, padx=2, pady=1)
             ttk.Label(settings_grid, text=lyrics_preview, foreground="gray", wraplength=200, font=('TkDefaultFont', 7)).grid(row=row_idx, column=1, sticky=tk.W, padx=2, pady=1)
         
-        # Inline audio player with waveform
-        if os.path.exists(entry['file_path']) and AUDIO_PLAYER_AVAILABLE:
+        # Drawn from the stored state; the metadata worker checks the file
+        # on disk and the card is rebuilt if that turned out to be stale
+        file_exists = not entry['missing']
+        
+        # Inline audio player with waveform, filled in by the metadata worker
+        player = None
+        if file_exists and AUDIO_PLAYER_AVAILABLE:
             try:
-                player = InlineAudioPlayer(card, entry['file_path'], THEMES[self.current_theme]["bg"])
+                player = InlineAudioPlayer(card, entry['file_path'], THEMES[self.current_theme]["bg"],
+                                           defer_waveform=self.library_worker is not None)
             except Exception as e:
                 # Fallback to simple button if player fails
                 ttk.Label(card, text=f"⚠️ Player error: {str(e)}", foreground="orange").pack(pady=5)
@@ -1714,7 +1828,7 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
         button_frame = ttk.Frame(card)
         button_frame.pack(fill=tk.X, pady=(3, 0))
         
-        if os.path.exists(entry['file_path']):
+        if file_exists:
             # Additional utility buttons with colors and tooltips
             if not AUDIO_PLAYER_AVAILABLE:
                 # Fallback play button if inline player not available
@@ -1746,9 +1860,44 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
         
         delete_btn = tk.Button(button_frame, text="🗑️", width=3, bg="#F44336", fg="white",
                               relief=tk.RAISED, cursor="hand2",
-                              command=lambda i=idx: self.remove_from_library(i))
+                              command=lambda i=entry['id']: self.remove_from_library(i))
         delete_btn.pack(side=tk.RIGHT, padx=1)
         self.create_tooltip(delete_btn, "Remove from library")
+        
+        if self.library_worker is not None:
+            request = self.library_worker.request(
+                entry, lambda result: self.apply_card_metadata(card, entry, player, duration_label, result))
+            # Paging, searching or deleting destroys the card; drop its request with it
+            card.bind("<Destroy>", lambda e: request.cancel() if e.widget is card else None)
+        return card
+    
+    @staticmethod
+    def format_card_duration(duration_sec, loudness_db=None):
+        text = f"{int(duration_sec // 60)}:{int(duration_sec % 60):02d}"
+        if loudness_db is not None:
+            text += f"  ({loudness_db:.1f} dBFS)"
+        return text
+    
+    def apply_card_metadata(self, card, entry, player, duration_label, result):
+        """Show a card's duration, loudness and waveform once the worker has them"""
+        if result["exists"] == entry['missing']:
+            # The file appeared or disappeared since it was last seen
+            entry['missing'] = not result["exists"]
+            self.replace_library_card(card, entry)
+            return
+        if result["duration"] is not None:
+            duration_label.config(text=self.format_card_duration(result["duration"], result["loudness_db"]))
+        if player is not None:
+            player.set_peaks(result["peaks"], result["duration"])
+    
+    def replace_library_card(self, card, entry):
+        for idx, (entry_id, shown) in enumerate(self.library_cards):
+            if shown is card:
+                grid = card.grid_info()
+                card.destroy()
+                new_card = self.create_library_card(entry, idx, int(grid['row']), int(grid['column']))
+                self.library_cards[idx] = (entry_id, new_card)
+                return
     
     def play_audio(self, file_path):
         """Play audio file using system default player"""
@@ -1863,13 +2012,12 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
         widget.bind('<Enter>', on_enter)
         widget.bind('<Leave>', on_leave)
     
-    def remove_from_library(self, idx):
+    def remove_from_library(self, entry_id):
         """Remove entry from library"""
         try:
             if messagebox.askyesno("Confirm", "Remove this entry from library?\n(The file will not be deleted)"):
-                entry = self.generation_history.pop(idx)
-                with open("generation_history.json", 'w', encoding='utf-8') as f:
-                    json.dump(self.generation_history, f, indent=2, ensure_ascii=False)
+                entry = self.library.get(entry_id)
+                self.library.remove(entry_id)
                 self.log(f"Removed from library: {entry['filename']}")
                 self.populate_library()
         except Exception as e:
@@ -1886,10 +2034,8 @@ See LICENSE and LICENSE-ORIGINAL files for details."""
     def clear_library_history(self):
         """Clear all library history"""
         if messagebox.askyesno("Confirm", "Clear entire library history?\n(Generated files will not be deleted)"):
-            self.generation_history = []
             try:
-                if os.path.exists("generation_history.json"):
-                    os.remove("generation_history.json")
+                self.library.clear()
                 self.populate_library()
                 self.log("Library history cleared")
             except Exception as e:
@@ -1901,6 +2047,8 @@ def main():
     root = tk.Tk()
     app = HeartMuLaGUI(root)
     root.mainloop()
+    if app.library_worker is not None:
+        app.library_worker.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+"""
+Background metadata loading for the Music Library tab.
+
+Each library card needs the song's duration, loudness and waveform peaks.
+Reading them means stat-ing and possibly decoding the audio file, which must
+not happen on the Tk main loop. LibraryMetadataWorker does that work on a
+small thread pool and hands each result back to Tk with root.after().
+
+    request = worker.request(entry, lambda result: update_card(card, result))
+    ...
+    request.cancel()  # card destroyed before the result arrived
+"""
+
+import importlib.util
+import os
+import threading
+import tkinter as tk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from heartlib.peaks import compute_peaks, peaks_from_file, save_peaks
+    PEAKS_AVAILABLE = True
+except ImportError:
+    PEAKS_AVAILABLE = False
+
+# imported on first use, see audio_player
+LIBROSA_AVAILABLE = importlib.util.find_spec("librosa") is not None
+
+
+class MetadataRequest:
+    """Handle of one card's pending metadata load"""
+
+    def __init__(self, entry, callback):
+        self.entry = entry
+        self.callback = callback
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Drop the request; its callback will not be called"""
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+def load_metadata(entry, library=None):
+    """
+    Stat and measure one library entry (runs on a worker thread).
+
+    Returns a dict with "exists" and, for existing files, "duration",
+    "loudness_db" and "peaks" (a heartlib.peaks.Peaks, or None). New
+    findings are written back to `library`.
+    """
+    file_path = entry['file_path']
+    exists = bool(file_path) and os.path.exists(file_path)
+    result = {"exists": exists, "duration": None, "loudness_db": None, "peaks": None}
+    if exists and PEAKS_AVAILABLE:
+        try:
+            peaks = peaks_from_file(file_path)
+        except Exception:
+            # soundfile cannot read this file - decode with librosa instead
+            peaks = None
+            if LIBROSA_AVAILABLE:
+                try:
+                    import librosa
+                    y, sr = librosa.load(file_path, sr=22050, mono=True)
+                    peaks = compute_peaks(y, sr)
+                    save_peaks(file_path, peaks)
+                except Exception as e:
+                    result["error"] = str(e)
+        if peaks is not None:
+            result.update(duration=peaks.duration, loudness_db=peaks.rms_db, peaks=peaks)
+
+    if library is not None:
+        fields = {}
+        if exists == entry['missing']:
+            fields['missing'] = not exists
+        if result["duration"] is not None and entry.get('duration_s') is None:
+            fields['duration_s'] = result["duration"]
+        if result["loudness_db"] is not None and 'loudness_db' not in entry['settings']:
+            fields['loudness_db'] = round(result["loudness_db"], 2)
+        if fields:
+            library.update(entry['id'], **fields)
+    return result
+
+
+class LibraryMetadataWorker:
+    """
+    Loads library card metadata on `max_workers` threads.
+
+    Callbacks run on the Tk main loop via root.after(). At most `max_pending`
+    requests wait for a thread; past that the oldest waiting request is
+    dropped, since its card has most likely been scrolled or paged away.
+    """
+
+    def __init__(self, root, library=None, max_workers=2, max_pending=48):
+        self.root = root
+        self.library = library
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="library-metadata")
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def request(self, entry, callback):
+        """Load `entry`'s metadata and call `callback(result)` on the Tk thread"""
+        request = MetadataRequest(entry, callback)
+        with self._lock:
+            if self._closed:
+                request.cancel()
+                return request
+            while len(self._pending) >= self.max_pending:
+                self._pending.popleft().cancel()
+            self._pending.append(request)
+            request.future = self._executor.submit(self._run, request)
+        return request
+
+    def _run(self, request):
+        with self._lock:
+            try:
+                self._pending.remove(request)
+            except ValueError:
+                pass
+        if request.cancelled:
+            return
+        try:
+            result = load_metadata(request.entry, self.library)
+        except Exception as e:
+            result = {"exists": True, "duration": None, "loudness_db": None,
+                      "peaks": None, "error": str(e)}
+        if request.cancelled:
+            return
+        try:
+            self.root.after(0, self._deliver, request, result)
+        except (RuntimeError, tk.TclError):
+            # Tk has shut down
+            pass
+
+    @staticmethod
+    def _deliver(request, result):
+        # The card may have been destroyed while the result was queued
+        if not request.cancelled:
+            request.callback(result)
+
+    def shutdown(self):
+        """Drop waiting requests and stop the threads"""
+        with self._lock:
+            self._closed = True
+            while self._pending:
+                self._pending.popleft().cancel()
+        self._executor.shutdown(wait=False)
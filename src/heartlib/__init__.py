@@ -1,7 +1,37 @@
-from .pipelines.music_generation import HeartMuLaGenPipeline
-from .pipelines.lyrics_transcription import HeartTranscriptorPipeline
+"""
+The pipelines are imported on first attribute access, so `import heartlib`
+(or any of its light submodules, such as heartlib.library) does not pull in
+torch, transformers, torchtune and the codec dependencies.
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pipelines.music_generation import HeartMuLaGenPipeline
+    from .pipelines.lyrics_transcription import HeartTranscriptorPipeline
+
+# attribute -> module that defines it
+_LAZY_ATTRIBUTES = {
+    "HeartMuLaGenPipeline": ".pipelines.music_generation",
+    "HeartTranscriptorPipeline": ".pipelines.lyrics_transcription",
+}
 
 __all__ = [
     "HeartMuLaGenPipeline",
     "HeartTranscriptorPipeline"
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    # cache it, so later lookups do not come back here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
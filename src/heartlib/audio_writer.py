@@ -0,0 +1,104 @@
+"""
+Audio output: format selection, device-to-host staging and a background
+encoder pool.
+
+The pipeline hands decoded waveforms to `AudioWriterPool.submit`, which
+returns a Future right away and encodes in a worker process, so the next
+generation does not wait for MP3/OGG encoding.
+"""
+
+import os
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from .peaks import compute_peaks, save_peaks
+
+# soundfile format per file extension
+AUDIO_FORMATS = {
+    ".wav": "WAV",
+    ".flac": "FLAC",
+    ".ogg": "OGG",
+    ".mp3": "MP3",
+}
+
+
+def audio_format(path: str) -> str:
+    """The soundfile format for `path`, from its extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in AUDIO_FORMATS:
+        raise ValueError(
+            f"Unsupported audio extension {ext!r} for {path}; "
+            f"use one of {sorted(AUDIO_FORMATS)}"
+        )
+    return AUDIO_FORMATS[ext]
+
+
+def write_audio(
+    path: str, audio: np.ndarray, sample_rate: int, peaks: bool = True
+) -> str:
+    """
+    Encode `audio` [num_samples, channels] to `path`. The file is written
+    under a temporary name and moved into place, so readers never see a
+    partial file. With `peaks`, the waveform peaks sidecar is written from
+    the same samples. Returns `path`.
+    """
+    import soundfile as sf
+
+    tmp_path = f"{path}.part"
+    sf.write(tmp_path, audio, sample_rate, format=audio_format(path))
+    os.replace(tmp_path, path)
+    if peaks:
+        save_peaks(path, compute_peaks(audio, sample_rate))
+    return path
+
+
+class HostStaging:
+    """
+    Copies waveforms off the GPU through pinned host memory. Other devices
+    are copied with a plain .cpu(); CPU tensors are not copied.
+    """
+
+    def to_numpy(self, wav: torch.Tensor) -> np.ndarray:
+        """
+        `wav` as a float32 array the caller owns. A CPU float32 `wav` is
+        shared, not copied, so it should not be modified afterwards.
+        """
+        if wav.device.type != "cuda":
+            return wav.detach().to("cpu", torch.float32).numpy()
+        # a fresh pinned tensor per call: the array is a view of it, so it
+        # must not be a buffer the next call would overwrite
+        host = torch.empty(wav.shape, dtype=torch.float32, pin_memory=True)
+        host.copy_(wav, non_blocking=True)
+        torch.cuda.current_stream(wav.device).synchronize()
+        return host.numpy()
+
+
+class AudioWriterPool:
+    """
+    Encodes audio files in background worker processes (threads with
+    use_processes=False). `submit` returns a Future resolving to the path.
+    """
+
+    def __init__(self, max_workers: int = 1, use_processes: bool = True):
+        if use_processes:
+            self._executor = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=mp.get_context("spawn")
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, path: str, audio: np.ndarray, sample_rate: int) -> Future:
+        audio_format(path)
+        return self._executor.submit(write_audio, path, audio, sample_rate)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,336 @@
+"""
+Crash-safe batch queue.
+
+The queue lives in an append-only JSONL journal. Every change (an item added,
+removed or moving between states) is one line, flushed and fsynced before the
+call returns, so a crash loses at most the line being written. Loading
+replays the journal; a torn last line is cut off and items that were running
+when the process died go back to pending.
+
+    queue = BatchQueue("batch_queue.jsonl")
+    queue.add({"tags": "piano,happy", "lyrics": "...", "filename": "song"})
+    BatchWorker(pipe, queue, "./output").run()
+
+Run the queue without the GUI with
+`python -m heartlib.batch_queue --queue batch_queue.jsonl --model_path ./ckpt`.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .cancellation import CancellationToken, GenerationCancelled
+from .jobs import RUNNING, DONE, FAILED, normalize_job, run_job
+
+PENDING = "pending"
+
+# Rewrite the journal once it holds this many more lines than live items.
+_COMPACT_SLACK = 1000
+
+
+def output_path(item: Dict[str, Any], output_folder: str, timestamp: bool) -> str:
+    """Where a batch item is written, optionally with a timestamp suffix."""
+    filename = item["filename"]
+    if timestamp:
+        filename = f"{filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    return os.path.join(output_folder, f"{filename}.mp3")
+
+
+class BatchQueue:
+    """Ordered batch items with per-item state, persisted to a JSONL journal."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._lines = 0
+        self._load()
+        self._fp = open(self.path, "a", encoding="utf-8")
+        if self._lines > len(self._items) + _COMPACT_SLACK:
+            self.compact()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        # byte offset just past the last complete record
+        valid_end = 0
+        with open(self.path, "rb") as fp:
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    # torn by a crash mid-write; the record was never acked
+                    break
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    break
+                valid_end += len(line)
+                self._lines += 1
+                self._apply(record)
+        if os.path.getsize(self.path) > valid_end:
+            # drop the torn fragment so new records start on a line of their own
+            with open(self.path, "r+b") as fp:
+                fp.truncate(valid_end)
+                fp.flush()
+                os.fsync(fp.fileno())
+        for entry in self._items.values():
+            if entry["state"] == RUNNING:
+                entry["state"] = PENDING
+
+    def _apply(self, record: Dict[str, Any]):
+        op = record["op"]
+        if op == "add":
+            self._items[record["id"]] = {
+                "id": record["id"],
+                "item": record["item"],
+                "state": PENDING,
+                "save_path": None,
+                "error": None,
+            }
+        elif op == "state":
+            entry = self._items.get(record["id"])
+            if entry is not None:
+                entry["state"] = record["state"]
+                entry["save_path"] = record.get("save_path", entry["save_path"])
+                entry["error"] = record.get("error")
+        elif op == "remove":
+            self._items.pop(record["id"], None)
+        elif op == "clear":
+            self._items.clear()
+
+    def _append(self, record: Dict[str, Any]):
+        self._fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._lines += 1
+        self._apply(record)
+
+    def add(self, item: Dict[str, Any]) -> str:
+        """Validate and append an item; returns its id."""
+        record = {"op": "add", "id": uuid.uuid4().hex[:12], "item": normalize_job(item)}
+        with self._lock:
+            self._append(record)
+        return record["id"]
+
+    def remove(self, item_id: str):
+        with self._lock:
+            if item_id in self._items:
+                self._append({"op": "remove", "id": item_id})
+
+    def clear(self):
+        with self._lock:
+            self._append({"op": "clear"})
+
+    def clear_finished(self):
+        """Drop the items that are done."""
+        with self._lock:
+            for item_id in [i for i, e in self._items.items() if e["state"] == DONE]:
+                self._append({"op": "remove", "id": item_id})
+
+    def retry_failed(self, item_ids: Optional[List[str]] = None) -> int:
+        """
+        Put failed items (all of them, or those among `item_ids`) back to
+        pending, dropping their error. Returns how many were requeued.
+        """
+        with self._lock:
+            failed = [
+                item_id
+                for item_id, entry in self._items.items()
+                if entry["state"] == FAILED
+                and (item_ids is None or item_id in item_ids)
+            ]
+            for item_id in failed:
+                self._append({"op": "state", "id": item_id, "state": PENDING})
+        return len(failed)
+
+    def set_state(
+        self,
+        item_id: str,
+        state: str,
+        save_path: Optional[str] = None,
+        error: Optional[str] = None,
+    ):
+        record = {"op": "state", "id": item_id, "state": state}
+        if save_path is not None:
+            record["save_path"] = save_path
+        if error is not None:
+            record["error"] = error
+        with self._lock:
+            self._append(record)
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._items.get(item_id)
+            return None if entry is None else dict(entry)
+
+    def items(self, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Items in insertion order, optionally only those in `state`."""
+        with self._lock:
+            return [
+                dict(entry)
+                for entry in self._items.values()
+                if state is None or entry["state"] == state
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def compact(self):
+        """Rewrite the journal with one line per live item."""
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fp:
+                for entry in self._items.values():
+                    fp.write(
+                        json.dumps(
+                            {"op": "add", "id": entry["id"], "item": entry["item"]},
+                            ensure_ascii=False,
+                        )
+                        + "\n"
+                    )
+                    if entry["state"] != PENDING:
+                        state = {
+                            "op": "state",
+                            "id": entry["id"],
+                            "state": entry["state"],
+                        }
+                        if entry["save_path"] is not None:
+                            state["save_path"] = entry["save_path"]
+                        if entry["error"] is not None:
+                            state["error"] = entry["error"]
+                        fp.write(json.dumps(state, ensure_ascii=False) + "\n")
+                fp.flush()
+                os.fsync(fp.fileno())
+            self._fp.close()
+            os.replace(tmp_path, self.path)
+            self._fp = open(self.path, "a", encoding="utf-8")
+            self._lines = sum(
+                1 if entry["state"] == PENDING else 2 for entry in self._items.values()
+            )
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+class BatchWorker:
+    """
+    Runs the pending items of a BatchQueue, in order, on one pipeline.
+
+    Progress is reported through `on_event(event, entry)` with event one of
+    "start", "done", "failed" and "cancelled"; it is called from the thread
+    running `run`. A failed item is recorded and the batch moves on. A
+    cancelled item goes back to pending and the run stops.
+    """
+
+    def __init__(
+        self,
+        pipe,
+        queue: BatchQueue,
+        output_folder: str,
+        timestamp: bool = False,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    ):
+        self.pipe = pipe
+        self.queue = queue
+        self.output_folder = output_folder
+        self.timestamp = timestamp
+        self.on_event = on_event
+
+    def _emit(self, event: str, entry: Dict[str, Any]):
+        if self.on_event is not None:
+            self.on_event(event, entry)
+
+    def run(self, cancel_token: Optional[CancellationToken] = None) -> Dict[str, int]:
+        """Process pending items until none are left. Returns per-state counts."""
+        os.makedirs(self.output_folder, exist_ok=True)
+        counts = {DONE: 0, FAILED: 0}
+        while True:
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            pending = self.queue.items(PENDING)
+            if not pending:
+                break
+            entry = pending[0]
+            save_path = output_path(entry["item"], self.output_folder, self.timestamp)
+            self.queue.set_state(entry["id"], RUNNING, save_path=save_path)
+            entry.update(state=RUNNING, save_path=save_path)
+            self._emit("start", entry)
+            start = time.perf_counter()
+            try:
+                entry["seed"] = run_job(
+                    self.pipe, entry["item"], save_path, cancel_token=cancel_token
+                )
+            except GenerationCancelled:
+                self.queue.set_state(entry["id"], PENDING)
+                entry["state"] = PENDING
+                self._emit("cancelled", entry)
+                break
+            except Exception as e:
+                traceback.print_exc()
+                self.queue.set_state(entry["id"], FAILED, error=str(e))
+                entry.update(state=FAILED, error=str(e))
+                counts[FAILED] += 1
+                self._emit("failed", entry)
+                continue
+            self.queue.set_state(entry["id"], DONE)
+            entry.update(state=DONE, elapsed=time.perf_counter() - start)
+            counts[DONE] += 1
+            self._emit("done", entry)
+        return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queue", type=str, default="batch_queue.jsonl")
+    parser.add_argument("--model_path", type=str, default="./ckpt")
+    parser.add_argument("--version", type=str, default="3B")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--dtype", type=str, default="bfloat16")
+    parser.add_argument("--lazy_load", action="store_true")
+    parser.add_argument("--output_folder", type=str, default="./output")
+    parser.add_argument("--timestamp", action="store_true")
+    parser.add_argument("--retry_failed", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    import torch
+    from .pipelines.music_generation import HeartMuLaGenPipeline
+
+    args = parse_args()
+    queue = BatchQueue(args.queue)
+    if args.retry_failed:
+        for entry in queue.items(FAILED):
+            queue.set_state(entry["id"], PENDING)
+    print(f"{len(queue.items(PENDING))} pending of {len(queue)} items in {args.queue}")
+    pipe = HeartMuLaGenPipeline.from_pretrained(
+        args.model_path,
+        device=torch.device(args.device),
+        dtype=getattr(torch, args.dtype),
+        version=args.version,
+        lazy_load=args.lazy_load,
+    )
+
+    def _report(event: str, entry: Dict[str, Any]):
+        print(f"[{event}] {entry['item']['filename']} -> {entry['save_path']}")
+
+    worker = BatchWorker(
+        pipe, queue, args.output_folder, timestamp=args.timestamp, on_event=_report
+    )
+    # an interrupted item is left running in the journal and reruns next time
+    try:
+        counts = worker.run()
+    finally:
+        queue.close()
+    print(f"done: {counts[DONE]}, failed: {counts[FAILED]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import threading
+from typing import Optional
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a generation when its CancellationToken was cancelled."""
+
+
+class GenerationPreempted(GenerationCancelled):
+    """
+    Raised when a generation is asked to yield, either through
+    CancellationToken.preempt or because its frame budget ran out. If the
+    pipeline was given a checkpoint_path, the state needed to resume is saved
+    there before this is raised.
+    """
+
+    def __init__(self, message: str, checkpoint_path: Optional[str] = None):
+        super().__init__(message)
+        self.checkpoint_path = checkpoint_path
+
+
+class CancellationToken:
+    """
+    Thread-safe flag polled by the generation loops. `cancel()` drops the job,
+    `preempt()` asks it to checkpoint (if it can) and stop.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._preempt = False
+
+    def cancel(self):
+        self._event.set()
+
+    def preempt(self):
+        self._preempt = True
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def preempted(self) -> bool:
+        return self._event.is_set() and self._preempt
+
+    def raise_if_cancelled(self):
+        if not self._event.is_set():
+            return
+        if self._preempt:
+            raise GenerationPreempted("generation was preempted")
+        raise GenerationCancelled("generation was cancelled")
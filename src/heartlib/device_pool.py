@@ -0,0 +1,411 @@
+"""
+Multi-device batch executor.
+
+Runs one HeartMuLaGenPipeline per device, each in its own worker process, and
+drains a BatchQueue across them. Pending items are handed out longest
+`max_audio_length_ms` first, one at a time to whichever worker just became
+free, so the long songs do not all end up at the tail of one worker. Each
+worker holds at most one item, so a worker that dies takes exactly that item
+down with it and the rest are handed to the survivors.
+
+Devices may repeat: `["cpu"] * 4` runs four CPU workers, each with an equal
+share of the CPU threads, which is how scaling is measured without GPUs. On
+Linux the CPU workers are spread over the NUMA nodes and each is pinned to
+its own slice of one node's CPUs, so its threads and memory stay local.
+
+    python -m heartlib.device_pool --devices cuda:0,cuda:1 --model_path ./ckpt
+    python -m heartlib.device_pool --devices cpu,cpu --dtype float32
+"""
+
+import argparse
+import functools
+import glob
+import multiprocessing as mp
+import os
+import queue as queue_lib
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .batch_queue import BatchQueue, PENDING, output_path
+from .jobs import RUNNING, DONE, FAILED, run_job
+
+
+def load_pipeline(
+    device: str, model_path: str, version: str, dtype: str, lazy_load: bool = False
+):
+    """Default pipe_factory: load the pipeline from `model_path` onto `device`."""
+    import torch
+    from .pipelines.music_generation import HeartMuLaGenPipeline
+
+    return HeartMuLaGenPipeline.from_pretrained(
+        model_path,
+        device=torch.device(device),
+        dtype=getattr(torch, dtype),
+        version=version,
+        lazy_load=lazy_load,
+    )
+
+
+def _parse_cpulist(text: str) -> Set[int]:
+    """CPUs of a sysfs cpulist such as "0-3,8-11"."""
+    cpus = set()
+    for part in text.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _numa_nodes() -> List[List[int]]:
+    """
+    The CPUs of each NUMA node that this process may run on, or [] where
+    the topology or sched_setaffinity is not available (e.g. not Linux).
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    paths = glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")
+    for path in sorted(paths, key=lambda p: int(p.split("node")[-1].split("/")[0])):
+        try:
+            with open(path) as fp:
+                cpus = sorted(_parse_cpulist(fp.read()) & allowed)
+        except (OSError, ValueError):
+            return []
+        if cpus:
+            nodes.append(cpus)
+    return nodes
+
+
+def _cpu_affinities(num_workers: int) -> List[Optional[List[int]]]:
+    """
+    CPUs to pin each of `num_workers` CPU workers to: workers go round-robin
+    over the NUMA nodes and split their node's CPUs evenly. None for every
+    worker when the topology is unknown or a node has more workers than CPUs.
+    """
+    nodes = _numa_nodes()
+    if not nodes:
+        return [None] * num_workers
+    on_node = [list(range(i, num_workers, len(nodes))) for i in range(len(nodes))]
+    affinities: List[Optional[List[int]]] = [None] * num_workers
+    for cpus, workers in zip(nodes, on_node):
+        if len(workers) > len(cpus):
+            return [None] * num_workers
+        for k, worker in enumerate(workers):
+            share = len(cpus) // len(workers)
+            affinities[worker] = cpus[k * share : (k + 1) * share]
+    return affinities
+
+
+def _worker_main(
+    worker_id: int,
+    device: str,
+    num_threads: Optional[int],
+    cpus: Optional[List[int]],
+    pipe_factory: Callable[[str], Any],
+    tasks: "mp.Queue",
+    results: "mp.Queue",
+):
+    # pin before torch starts its thread pools, so they inherit the mask
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    import torch
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    try:
+        pipe = pipe_factory(device)
+    except Exception:
+        results.put(("dead", worker_id, traceback.format_exc()))
+        return
+    results.put(("ready", worker_id, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        item_id, item, output_folder, timestamp = task
+        save_path = output_path(item, output_folder, timestamp)
+        results.put(("start", worker_id, (item_id, save_path)))
+        start = time.perf_counter()
+        try:
+            seed = run_job(pipe, item, save_path)
+        except Exception as e:
+            traceback.print_exc()
+            results.put(("failed", worker_id, (item_id, str(e))))
+            continue
+        results.put(("done", worker_id, (item_id, seed, time.perf_counter() - start)))
+
+
+class DevicePoolExecutor:
+    """
+    One pipeline worker process per entry of `devices`, kept warm between
+    `run` calls. `pipe_factory(device)` builds each worker's pipeline inside
+    its process and must be picklable; `load_pipeline` bound with
+    functools.partial is the usual choice.
+    """
+
+    def __init__(
+        self,
+        devices: List[str],
+        pipe_factory: Callable[[str], Any],
+        output_folder: str,
+        timestamp: bool = False,
+    ):
+        if not devices:
+            raise ValueError("devices must not be empty")
+        self.devices = list(devices)
+        self.pipe_factory = pipe_factory
+        self.output_folder = output_folder
+        self.timestamp = timestamp
+        self._ctx = mp.get_context("spawn")
+        self._results = None
+        # per worker: its process, its task queue and whether it is usable
+        self._procs: List[Optional[mp.Process]] = []
+        self._tasks: List[Optional["mp.Queue"]] = []
+        self._alive: List[bool] = []
+
+    def start(self):
+        """Start the workers, or respawn those that have exited since."""
+        if self._results is None:
+            self._results = self._ctx.Queue()
+            self._procs = [None] * len(self.devices)
+            self._tasks = [None] * len(self.devices)
+            self._alive = [False] * len(self.devices)
+        num_cpu = sum(device == "cpu" for device in self.devices)
+        cpu_threads = max(1, (os.cpu_count() or 1) // num_cpu) if num_cpu else None
+        affinities = iter(_cpu_affinities(num_cpu))
+        cpu_sets = [
+            next(affinities) if device == "cpu" else None for device in self.devices
+        ]
+        # a pinned worker runs one thread per CPU it is pinned to
+        num_threads = [
+            len(cpus) if cpus is not None else cpu_threads if device == "cpu" else None
+            for device, cpus in zip(self.devices, cpu_sets)
+        ]
+        spawned = []
+        for worker_id, device in enumerate(self.devices):
+            proc = self._procs[worker_id]
+            if proc is not None and proc.is_alive():
+                continue
+            self._tasks[worker_id] = self._ctx.Queue()
+            proc = self._ctx.Process(
+                target=_worker_main,
+                args=(
+                    worker_id,
+                    device,
+                    num_threads[worker_id],
+                    cpu_sets[worker_id],
+                    self.pipe_factory,
+                    self._tasks[worker_id],
+                    self._results,
+                ),
+                daemon=True,
+            )
+            proc.start()
+            self._procs[worker_id] = proc
+            self._alive[worker_id] = True
+            spawned.append(worker_id)
+        waiting = set(spawned)
+        while waiting:
+            try:
+                event, worker_id, payload = self._results.get(timeout=1.0)
+            except queue_lib.Empty:
+                for worker_id in list(waiting):
+                    if not self._procs[worker_id].is_alive():
+                        self._alive[worker_id] = False
+                        waiting.discard(worker_id)
+                continue
+            if event == "ready":
+                waiting.discard(worker_id)
+            elif event == "dead":
+                self._alive[worker_id] = False
+                waiting.discard(worker_id)
+                print(
+                    f"Worker on {self.devices[worker_id]} failed to start:\n{payload}"
+                )
+        if not any(self._alive):
+            self.shutdown()
+            raise RuntimeError("no device worker could load the pipeline")
+
+    def shutdown(self):
+        for worker_id, proc in enumerate(self._procs):
+            if proc is not None and proc.is_alive():
+                self._tasks[worker_id].put(None)
+        for proc in self._procs:
+            if proc is None:
+                continue
+            proc.join(timeout=30)
+            if proc.is_alive():
+                proc.terminate()
+        self._results = None
+        self._procs = []
+        self._tasks = []
+        self._alive = []
+
+    def run(
+        self,
+        batch_queue: BatchQueue,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Process every pending item of `batch_queue` and record the results in
+        it. `on_event` is called as in BatchWorker, with the entry's
+        "device" set. Returns per-state counts plus per-device busy seconds.
+        If every worker dies, the items not yet handed out stay pending.
+        """
+        self.start()
+        os.makedirs(self.output_folder, exist_ok=True)
+        pending = sorted(
+            batch_queue.items(PENDING),
+            key=lambda e: e["item"]["max_audio_length_ms"],
+            reverse=True,
+        )
+        entries = {entry["id"]: entry for entry in pending}
+        # worker id -> id of the item it was handed and has not finished
+        assigned: Dict[int, str] = {}
+
+        def _dispatch(worker_id: int):
+            if not pending or not self._alive[worker_id]:
+                return
+            entry = pending.pop(0)
+            assigned[worker_id] = entry["id"]
+            self._tasks[worker_id].put(
+                (entry["id"], entry["item"], self.output_folder, self.timestamp)
+            )
+
+        for worker_id in range(len(self.devices)):
+            _dispatch(worker_id)
+
+        counts = {DONE: 0, FAILED: 0}
+        busy = [0.0] * len(self.devices)
+        start = time.perf_counter()
+        while assigned:
+            # checked every iteration, as a steady stream of events from the
+            # other workers would otherwise keep a dead one from being seen
+            self._reap(assigned)
+            try:
+                event, worker_id, payload = self._results.get(timeout=1.0)
+            except queue_lib.Empty:
+                continue
+            if event == "exited":
+                # A worker that died mid-item (e.g. out of memory) takes the
+                # item down with it; record it as failed so the run can
+                # finish. The worker is respawned by the next start().
+                pid, exitcode = payload
+                if self._procs[worker_id].pid != pid:
+                    continue  # queued in an earlier run, for a replaced worker
+                item_id = assigned.pop(worker_id, None)
+                if item_id is None:
+                    continue  # it finished its item before dying
+                error = f"worker on {self.devices[worker_id]} exited ({exitcode})"
+                batch_queue.set_state(item_id, FAILED, error=error)
+                entries[item_id].update(state=FAILED, error=error)
+                counts[FAILED] += 1
+                self._emit(on_event, "failed", entries[item_id])
+                continue
+            # events from a worker already reaped for this item are stale
+            item_id = payload[0]
+            if assigned.get(worker_id) != item_id:
+                continue
+            device = self.devices[worker_id]
+            entry = entries[item_id]
+            if event == "start":
+                _, save_path = payload
+                batch_queue.set_state(item_id, RUNNING, save_path=save_path)
+                entry.update(state=RUNNING, save_path=save_path, device=device)
+                self._emit(on_event, "start", entry)
+            elif event == "done":
+                _, seed, elapsed = payload
+                del assigned[worker_id]
+                _dispatch(worker_id)
+                busy[worker_id] += elapsed
+                batch_queue.set_state(item_id, DONE)
+                entry.update(state=DONE, seed=seed, elapsed=elapsed)
+                counts[DONE] += 1
+                self._emit(on_event, "done", entry)
+            elif event == "failed":
+                _, error = payload
+                del assigned[worker_id]
+                _dispatch(worker_id)
+                batch_queue.set_state(item_id, FAILED, error=error)
+                entry.update(state=FAILED, error=error)
+                counts[FAILED] += 1
+                self._emit(on_event, "failed", entry)
+        wall = time.perf_counter() - start
+        return {
+            **counts,
+            "wall_seconds": wall,
+            "busy_seconds": dict(zip(self._worker_names(), busy)),
+        }
+
+    def _worker_names(self) -> List[str]:
+        return [f"{device}#{i}" for i, device in enumerate(self.devices)]
+
+    def _reap(self, assigned: Dict[int, str]):
+        # The events a worker sent before it died are already in the results
+        # queue, so an "exited" event queued behind them is handled after
+        # them: an item the worker finished is not failed as well.
+        for worker_id, proc in enumerate(self._procs):
+            if not self._alive[worker_id] or proc.is_alive():
+                continue
+            self._alive[worker_id] = False
+            if worker_id in assigned:
+                self._results.put(("exited", worker_id, (proc.pid, proc.exitcode)))
+
+    @staticmethod
+    def _emit(on_event, event: str, entry: Dict[str, Any]):
+        if on_event is not None:
+            on_event(event, entry)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queue", type=str, default="batch_queue.jsonl")
+    parser.add_argument("--devices", type=str, default="cuda:0")
+    parser.add_argument("--model_path", type=str, default="./ckpt")
+    parser.add_argument("--version", type=str, default="3B")
+    parser.add_argument("--dtype", type=str, default="bfloat16")
+    parser.add_argument("--lazy_load", action="store_true")
+    parser.add_argument("--output_folder", type=str, default="./output")
+    parser.add_argument("--timestamp", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    devices = [device.strip() for device in args.devices.split(",") if device.strip()]
+    batch_queue = BatchQueue(args.queue)
+    pending = batch_queue.items(PENDING)
+    audio_s = sum(entry["item"]["max_audio_length_ms"] for entry in pending) / 1000
+    print(f"{len(pending)} pending items ({audio_s:.0f} s of audio) on {devices}")
+
+    def _report(event: str, entry: Dict[str, Any]):
+        print(f"[{event}] {entry['device']}: {entry['item']['filename']}")
+
+    executor = DevicePoolExecutor(
+        devices,
+        functools.partial(
+            load_pipeline,
+            model_path=args.model_path,
+            version=args.version,
+            dtype=args.dtype,
+            lazy_load=args.lazy_load,
+        ),
+        args.output_folder,
+        timestamp=args.timestamp,
+    )
+    try:
+        stats = executor.run(batch_queue, on_event=_report)
+    finally:
+        executor.shutdown()
+        batch_queue.close()
+    wall = stats["wall_seconds"]
+    print(f"done: {stats[DONE]}, failed: {stats[FAILED]}, wall: {wall:.1f} s")
+    print(f"throughput: {audio_s / wall:.3f} s of requested audio per second")
+    for name, seconds in stats["busy_seconds"].items():
+        print(f"  {name}: busy {seconds:.1f} s ({seconds / wall:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,9 @@ import numpy as np
 class HeartCodec(PreTrainedModel):
     config_class = HeartCodecConfig
 
+    # seconds of audio decoded per window
+    window_duration = 29.76
+
     def __init__(
         self,
         config: HeartCodecConfig,
@@ -54,25 +57,42 @@ class HeartCodec(PreTrainedModel):
 
         self.sample_rate = config.sample_rate
 
+    def fuse_projections(self):
+        """
+        Pack the flow-matching estimator's q/k/v and gate/up projections into
+        single GEMMs. Call once after loading, for inference only.
+        """
+        self.flow_matching.estimator.fuse_projections()
+        return self
+
+    @staticmethod
+    def window_frames(duration: float = window_duration):
+        """(window, hop) in frames; consecutive windows overlap by the rest."""
+        min_samples = int(duration * 12.5)
+        return min_samples, min_samples // 93 * 80
+
     @torch.inference_mode()
     def detokenize(
         self,
         codes,
-        duration=29.76,
+        duration=window_duration,
         num_steps=10,
         disable_progress=False,
         guidance_scale=1.25,
+        decode_chunk_size=None,
+        cancel_token=None,
+        generator=None,
     ):
         codes = codes.unsqueeze(0).to(self.device)
-        first_latent = torch.randn(
-            codes.shape[0], int(duration * 25), 256, dtype=self.dtype
+        # the first window has no in-context latents
+        first_latent = torch.empty(
+            codes.shape[0], 0, self.flow_matching.latent_dim, dtype=self.dtype
         ).to(
             self.device
-        )  # B, T, 64
+        )  # B, 0, 256
         first_latent_length = 0
         first_latent_codes_length = 0
-        min_samples = int(duration * 12.5)
-        hop_samples = min_samples // 93 * 80
+        min_samples, hop_samples = self.window_frames(duration)
         ovlp_samples = min_samples - hop_samples
         ovlp_frames = ovlp_samples * 2
         codes_len = codes.shape[-1]  #
@@ -96,6 +116,16 @@ class HeartCodec(PreTrainedModel):
             codes = codes[:, :, 0:len_codes]
         latent_length = int(duration * 25)
         latent_list = []
+        # every window has the same geometry, lay it out once for the song
+        plan = self.flow_matching.plan_windows(
+            batch_size=codes.shape[0],
+            num_frames=min_samples * 2,
+            latent_length=latent_length,
+            num_steps=num_steps,
+            guidance_scale=guidance_scale,
+            device=self.device,
+            dtype=self.dtype,
+        )
 
         for sinx in range(0, codes.shape[-1] - hop_samples + 1, hop_samples):
             codes_input = []
@@ -111,24 +141,14 @@ class HeartCodec(PreTrainedModel):
                     num_steps=num_steps,
                     disable_progress=disable_progress,
                     scenario="other_seg",
+                    plan=plan,
+                    cancel_token=cancel_token,
+                    generator=generator,
                 )
                 latent_list.append(latents)
             else:
                 true_latent = latent_list[-1][:, -ovlp_frames:, :]
-                len_add_to_latent = latent_length - true_latent.shape[1]  #
                 incontext_length = true_latent.shape[1]
-                true_latent = torch.cat(
-                    [
-                        true_latent,
-                        torch.randn(
-                            true_latent.shape[0],
-                            len_add_to_latent,
-                            true_latent.shape[-1],
-                            dtype=self.dtype,
-                        ).to(self.device),
-                    ],
-                    1,
-                )
                 latents = self.flow_matching.inference_codes(
                     codes_input,
                     true_latent,
@@ -138,6 +158,9 @@ class HeartCodec(PreTrainedModel):
                     num_steps=num_steps,
                     disable_progress=disable_progress,
                     scenario="other_seg",
+                    plan=plan,
+                    cancel_token=cancel_token,
+                    generator=generator,
                 )
                 latent_list.append(latents)
 
@@ -147,8 +170,13 @@ class HeartCodec(PreTrainedModel):
         hop_samples = min_samples // 93 * 80
         ovlp_samples = min_samples - hop_samples
 
+        # windows are overlap-added into one buffer allocated at the final
+        # length; whatever lies past target_len is never written
         output = None
+        end = 0
         for i in range(len(latent_list)):
+            if output is not None and end - ovlp_samples >= target_len:
+                break
             latent = latent_list[i]
             bsz, t, f = latent.shape
 
@@ -158,26 +186,38 @@ class HeartCodec(PreTrainedModel):
             latent = latent.reshape(
                 latent.shape[0] * 2, latent.shape[2], latent.shape[3]
             )
-            cur_output = (
-                self.scalar_model.decode(latent.transpose(1, 2)).squeeze(0).squeeze(1)
-            )  # 1 512 256
+            if decode_chunk_size is None:
+                cur_output = self.scalar_model.decode(latent.transpose(1, 2))
+            else:
+                # bounded-memory decode, see ScalarModel.decode_chunked
+                cur_output = self.scalar_model.decode_chunked(
+                    latent.transpose(1, 2), chunk_size=decode_chunk_size
+                )
+            cur_output = cur_output.squeeze(0).squeeze(1)  # 1 512 256
 
-            cur_output = cur_output[:, 0:min_samples].detach().cpu()  # B, T
+            # stays on the device; the caller copies the whole song off at once
+            cur_output = cur_output[:, 0:min_samples]  # B, T
             if cur_output.dim() == 3:
                 cur_output = cur_output[0]
 
             if output is None:
-                output = cur_output
+                output = cur_output.new_empty(cur_output.shape[0], target_len)
+                fade_in = torch.linspace(
+                    0, 1, ovlp_samples, dtype=output.dtype, device=output.device
+                )
+                fade_out = 1 - fade_in
+                start, overlap = 0, 0
             else:
-                if ovlp_samples == 0:
-                    output = torch.cat([output, cur_output], -1)
-                else:
-                    ov_win = torch.from_numpy(np.linspace(0, 1, ovlp_samples)[None, :])
-                    ov_win = torch.cat([ov_win, 1 - ov_win], -1)
-                    output[:, -ovlp_samples:] = (
-                        output[:, -ovlp_samples:] * ov_win[:, -ovlp_samples:]
-                        + cur_output[:, 0:ovlp_samples] * ov_win[:, 0:ovlp_samples]
-                    )
-                    output = torch.cat([output, cur_output[:, ovlp_samples:]], -1)
-        output = output[:, 0:target_len]
-        return output
+                start, overlap = end - ovlp_samples, ovlp_samples
+            end = start + cur_output.shape[-1]
+            # cross-fade the overlap with the previous window, then copy
+            k = max(0, min(overlap, target_len - start))
+            if k > 0:
+                region = output[:, start : start + k]
+                region.mul_(fade_out[:k]).addcmul_(cur_output[:, :k], fade_in[:k])
+            n = max(0, min(end, target_len) - start - overlap)
+            if n > 0:
+                output[:, start + overlap : start + overlap + n] = cur_output[
+                    :, overlap : overlap + n
+                ]
+        return output[:, 0 : min(end, target_len)]
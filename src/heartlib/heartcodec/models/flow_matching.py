@@ -1,3 +1,4 @@
+from typing import Optional
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -53,6 +54,29 @@ class FlowMatching(nn.Module):
 
         self.latent_dim = out_channels
 
+    def plan_windows(
+        self,
+        batch_size: int,
+        num_frames: int,
+        latent_length: int,
+        num_steps: int,
+        guidance_scale: float,
+        device: torch.device,
+        dtype: torch.dtype,
+    ) -> "WindowPlan":
+        return WindowPlan(
+            batch_size=batch_size,
+            num_frames=num_frames,
+            latent_length=latent_length,
+            latent_dim=self.latent_dim,
+            cond_dim=self.zero_cond_embedding1.shape[0],
+            num_steps=num_steps,
+            guidance_scale=guidance_scale,
+            zero_cond=self.zero_cond_embedding1,
+            device=device,
+            dtype=dtype,
+        )
+
     @torch.no_grad()
     def inference_codes(
         self,
@@ -64,6 +88,9 @@ class FlowMatching(nn.Module):
         num_steps=20,
         disable_progress=True,
         scenario="start_seg",
+        plan: Optional["WindowPlan"] = None,
+        cancel_token=None,
+        generator: Optional[torch.Generator] = None,
     ):
         device = true_latents.device
         dtype = true_latents.dtype
@@ -82,95 +109,152 @@ class FlowMatching(nn.Module):
         ).permute(0, 2, 1)
 
         num_frames = quantized_feature_emb.shape[1]  #
-        latents = torch.randn(
-            (batch_size, num_frames, self.latent_dim), device=device, dtype=dtype
-        )
-        latent_masks = torch.zeros(
-            latents.shape[0], latents.shape[1], dtype=torch.int64, device=latents.device
-        )
-        latent_masks[:, 0:latent_length] = 2
-        if scenario == "other_seg":
-            latent_masks[:, 0:incontext_length] = 1
-
-        quantized_feature_emb = (latent_masks > 0.5).unsqueeze(
-            -1
-        ) * quantized_feature_emb + (latent_masks < 0.5).unsqueeze(
-            -1
-        ) * self.zero_cond_embedding1.unsqueeze(
-            0
-        )
-
-        incontext_latents = (
-            true_latents
-            * ((latent_masks > 0.5) * (latent_masks < 1.5)).unsqueeze(-1).float()
-        )
-        incontext_length = ((latent_masks > 0.5) * (latent_masks < 1.5)).sum(-1)[0]
+        if plan is None:
+            plan = self.plan_windows(
+                batch_size,
+                num_frames,
+                latent_length,
+                num_steps,
+                guidance_scale,
+                device,
+                dtype,
+            )
+        if scenario != "other_seg":
+            incontext_length = 0
+        incontext_length = min(incontext_length, plan.latent_length)
 
-        additional_model_input = torch.cat([quantized_feature_emb], 1)
-        temperature = 1.0
-        t_span = torch.linspace(
-            0, 1, num_steps + 1, device=quantized_feature_emb.device
+        plan.fill(
+            quantized_feature_emb,
+            true_latents[:, :incontext_length],
+            generator=generator,
         )
         latents = self.solve_euler(
-            latents * temperature,
-            incontext_latents.to(dtype),
-            incontext_length,
-            t_span,
-            additional_model_input,
-            guidance_scale,
+            plan, incontext_length, disable_progress, cancel_token=cancel_token
         )
 
-        latents[:, 0:incontext_length, :] = incontext_latents[
-            :, 0:incontext_length, :
-        ]  # B, T, dim
+        latents[:, 0:incontext_length, :] = true_latents[:, 0:incontext_length, :]
         return latents
 
-    def solve_euler(self, x, incontext_x, incontext_length, t_span, mu, guidance_scale):
+    def solve_euler(
+        self,
+        plan: "WindowPlan",
+        incontext_length,
+        disable_progress=True,
+        cancel_token=None,
+    ):
         """
         Fixed euler solver for ODEs.
         Args:
-            x (torch.Tensor): random noise
-            t_span (torch.Tensor): n_timesteps interpolated
-                shape: (n_timesteps + 1,)
-            mu (torch.Tensor): output of encoder
-                shape: (batch_size, n_feats, mel_timesteps)
+            plan (WindowPlan): filled window plan, holding the noise, the
+                estimator input with its conditioning and the step schedule
+            incontext_length (int): number of leading frames taken from the
+                previous window
+            cancel_token (CancellationToken): checked before every step
         """
-        t, _, dt = t_span[0], t_span[-1], t_span[1] - t_span[0]
-        noise = x.clone()
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
-        for step in tqdm(range(1, len(t_span))):
+        noise = plan.noise
+        x = plan.x
+        x.copy_(noise)
+        for t, dt, timestep in tqdm(plan.steps, disable=disable_progress):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             x[:, 0:incontext_length, :] = (1 - (1 - 1e-6) * t) * noise[
                 :, 0:incontext_length, :
-            ] + t * incontext_x[:, 0:incontext_length, :]
-            if guidance_scale > 1.0:
-                dphi_dt = self.estimator(
-                    torch.cat(
-                        [
-                            torch.cat([x, x], 0),
-                            torch.cat([incontext_x, incontext_x], 0),
-                            torch.cat([torch.zeros_like(mu), mu], 0),
-                        ],
-                        2,
-                    ),
-                    timestep=t.unsqueeze(-1).repeat(2),
-                )
+            ] + t * plan.incontext_x[:, 0:incontext_length, :]
+            for x_slot in plan.x_slots:
+                x_slot.copy_(x)
+            dphi_dt = self.estimator(plan.model_input, timestep=timestep)
+            if plan.guidance_scale > 1.0:
                 dphi_dt_uncond, dhpi_dt_cond = dphi_dt.chunk(2, 0)
-                dphi_dt = dphi_dt_uncond + guidance_scale * (
+                dphi_dt = dphi_dt_uncond + plan.guidance_scale * (
                     dhpi_dt_cond - dphi_dt_uncond
                 )
-            else:
-                dphi_dt = self.estimator(
-                    torch.cat([x, incontext_x, mu], 2), timestep=t.unsqueeze(-1)
-                )
+            x.add_(dt * dphi_dt)
+
+        return x.clone()
+
 
-            x = x + dt * dphi_dt
+class WindowPlan:
+    """
+    Buffers and schedule shared by every window of a song.
+
+    All windows decoded by HeartCodec.detokenize have the same geometry, so
+    the estimator input, the noise, the conditioning blend and the Euler step
+    schedule are laid out once here. Each window then only fills its codes
+    conditioning and in-context latents into the preallocated slices.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        num_frames: int,
+        latent_length: int,
+        latent_dim: int,
+        cond_dim: int,
+        num_steps: int,
+        guidance_scale: float,
+        zero_cond: torch.Tensor,
+        device: torch.device,
+        dtype: torch.dtype,
+    ):
+        self.batch_size = batch_size
+        self.num_frames = num_frames
+        self.latent_length = min(latent_length, num_frames)
+        self.guidance_scale = guidance_scale
+
+        # estimator input is [x, incontext_x, mu] along channels; with CFG
+        # the first half of the batch is the unconditional branch whose mu
+        # stays zero.
+        num_branches = 2 if guidance_scale > 1.0 else 1
+        self.model_input = torch.zeros(
+            num_branches * batch_size,
+            num_frames,
+            2 * latent_dim + cond_dim,
+            device=device,
+            dtype=dtype,
+        )
+        branches = [
+            self.model_input[i * batch_size : (i + 1) * batch_size]
+            for i in range(num_branches)
+        ]
+        self.x_slots = [branch[..., :latent_dim] for branch in branches]
+        self.incontext_slots = [
+            branch[..., latent_dim : 2 * latent_dim] for branch in branches
+        ]
+        self.incontext_x = self.incontext_slots[0]
+        self.mu = branches[-1][..., 2 * latent_dim :]
+        # frames past latent_length are conditioned on the learned zero_cond
+        self.mu[:, self.latent_length :] = zero_cond.to(dtype)
+
+        self.noise = torch.empty(
+            batch_size, num_frames, latent_dim, device=device, dtype=dtype
+        )
+        self.x = torch.empty_like(self.noise)
+
+        t_span = torch.linspace(0, 1, num_steps + 1, device=device)
+        t, dt = t_span[0], t_span[1] - t_span[0]
+        self.steps = []
+        for step in range(1, len(t_span)):
+            timestep = t.unsqueeze(-1).repeat(num_branches * batch_size)
+            self.steps.append((t, dt, timestep))
             t = t + dt
-            sol.append(x)
             if step < len(t_span) - 1:
                 dt = t_span[step + 1] - t
 
-        result = sol[-1]
-
-        return result
+    def fill(
+        self,
+        cond: torch.Tensor,
+        incontext_latents: torch.Tensor,
+        generator: Optional[torch.Generator] = None,
+    ):
+        """
+        Load one window: its codes conditioning [B, T, cond_dim], the
+        in-context latents carried over from the previous window
+        [B, incontext_length, latent_dim], and fresh noise drawn from
+        `generator` (the default generator if None).
+        """
+        self.mu[:, : self.latent_length] = cond[:, : self.latent_length]
+        incontext_length = incontext_latents.shape[1]
+        for slot in self.incontext_slots:
+            slot[:, :incontext_length] = incontext_latents
+            slot[:, incontext_length:] = 0
+        self.noise.normal_(generator=generator)
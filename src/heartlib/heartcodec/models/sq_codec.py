@@ -4,6 +4,7 @@ import torch.nn.functional as F
 import numpy as np
 from torch.nn.utils.parametrizations import weight_norm
 from torch.nn.utils import remove_weight_norm
+from torch.nn.utils import parametrize
 from torch.autograd.function import InplaceFunction
 
 
@@ -11,6 +12,22 @@ def get_padding(kernel_size, dilation=1):
     return int((kernel_size * dilation - dilation) / 2)
 
 
+def _stream_context(module, x, context):
+    """Prepend the trailing `context` samples of the previous chunk to `x`.
+
+    The first chunk sees zeros, which is what the one-shot causal padding
+    would have produced.
+    """
+    if context == 0:
+        return x
+    prev = module.stream_state
+    if prev is None:
+        prev = x.new_zeros(x.shape[0], x.shape[1], context)
+    x = torch.cat([prev, x], dim=-1)
+    module.stream_state = x[..., -context:].clone()
+    return x
+
+
 # Scripting this brings model speed up 1.4x
 @torch.jit.script
 def snake(x, alpha):
@@ -63,13 +80,17 @@ class Conv1d(nn.Conv1d):
             padding_mode=padding_mode,
             bias=bias,
         )
+        self.streaming = False
+        self.stream_state = None
         if w_init_gain is not None:
             torch.nn.init.xavier_uniform_(
                 self.weight, gain=torch.nn.init.calculate_gain(w_init_gain)
             )
 
     def forward(self, x):
-        if self.causal:
+        if self.causal and self.streaming:
+            x = _stream_context(self, x, self.left_padding)
+        elif self.causal:
             x = F.pad(x.unsqueeze(2), (self.left_padding, 0, 0, 0)).squeeze(2)
 
         return super(Conv1d, self).forward(x)
@@ -111,8 +132,17 @@ class ConvTranspose1d(nn.ConvTranspose1d):
         )
         self.causal = causal
         self.stride = stride
+        self.streaming = False
+        self.stream_state = None
 
     def forward(self, x):
+        if self.causal and self.streaming:
+            # With kernel_size == 2 * stride every output frame depends on the
+            # current and the previous input frame only, so carrying the last
+            # input frame is enough; its own (incomplete) outputs are dropped.
+            x = _stream_context(self, x, 1)
+            x = super(ConvTranspose1d, self).forward(x)
+            return x[:, :, self.stride : -self.stride]
         x = super(ConvTranspose1d, self).forward(x)
         if self.causal:
             x = x[:, :, : -self.stride]
@@ -399,6 +429,7 @@ class ScalarModel(nn.Module):
     ):
         super(ScalarModel, self).__init__()
         # self.args = args
+        self.causal = causal
         self.encoder = []
         self.decoder = []
         self.vq = round_func9()  # using 9
@@ -537,3 +568,45 @@ class ScalarModel(nn.Module):
         for i, layer in enumerate(self.decoder):
             x = layer(x)
         return x
+
+    def _set_streaming(self, streaming: bool):
+        for module in self.decoder.modules():
+            if isinstance(module, (Conv1d, ConvTranspose1d)):
+                module.streaming = streaming
+                module.stream_state = None
+
+    @torch.no_grad()
+    def decode_chunked(self, x, chunk_size=64):
+        """
+        Decode `x` in chunks of `chunk_size` latent frames so that peak
+        activation memory no longer grows with the input length.
+
+        Every causal conv of the decoder carries its left context from one
+        chunk to the next. The look-ahead conv at the head of the decoder is
+        not causal, so it is fed each chunk together with its neighbouring
+        frames instead. The result matches `decode` up to floating point
+        rounding of the conv kernels.
+        """
+        if not self.causal:
+            raise ValueError("decode_chunked requires a causal ScalarModel.")
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, but got {chunk_size}")
+        x = self.vq.apply(x)
+        head = self.decoder[0]
+        halo = head.padding[0]
+        total = x.shape[-1]
+        outputs = []
+        self._set_streaming(True)
+        try:
+            with parametrize.cached():
+                for start in range(0, total, chunk_size):
+                    end = min(start + chunk_size, total)
+                    lo = max(start - halo, 0)
+                    hi = min(end + halo, total)
+                    h = head(x[..., lo:hi])[..., start - lo : end - lo]
+                    for layer in self.decoder[1:]:
+                        h = layer(h)
+                    outputs.append(h)
+        finally:
+            self._set_streaming(False)
+        return torch.cat(outputs, dim=-1)
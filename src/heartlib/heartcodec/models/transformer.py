@@ -18,37 +18,85 @@ class RMSNorm(nn.Module):
 
 
 class RotaryEmbedding(nn.Module):
-    def __init__(self, dim: int, base: int = 10000):
+    def __init__(self, dim: int, base: int = 10000, max_seq_len: int = 1024):
         super().__init__()
         self.dim = dim
         self.base = base
-        self._cache = {}
-
-    def get_sin_cos(self, seq_len: int, device, dtype):
-        key = (seq_len, device, dtype)
-        cached = self._cache.get(key, None)
-        if cached is not None and cached[0].device == device:
-            return cached
-        inv_freq = 1.0 / (
-            self.base
-            ** (torch.arange(0, self.dim, 2, device=device, dtype=dtype) / self.dim)
+        self.max_seq_len = max_seq_len
+        # A plain attribute rather than a buffer so that casting the model to
+        # half precision leaves the table in fp32.
+        self._freqs_cis = None
+
+    def get_freqs_cis(self, seq_len: int, device) -> torch.Tensor:
+        freqs_cis = self._freqs_cis
+        if (
+            freqs_cis is None
+            or freqs_cis.device != device
+            or freqs_cis.shape[0] < seq_len
+        ):
+            inv_freq = 1.0 / (
+                self.base
+                ** (
+                    torch.arange(0, self.dim, 2, device=device, dtype=torch.float32)
+                    / self.dim
+                )
+            )
+            t = torch.arange(
+                max(seq_len, self.max_seq_len), device=device, dtype=torch.float32
+            )
+            freqs = torch.outer(t, inv_freq)
+            freqs_cis = torch.polar(torch.ones_like(freqs), freqs)
+            self._freqs_cis = freqs_cis
+        return freqs_cis[:seq_len]
+
+    def _rotate(self, x: torch.Tensor, freqs_cis: torch.Tensor) -> torch.Tensor:
+        # Rotate adjacent channel pairs as complex numbers, in fp32.
+        head, tail = x[..., : self.dim], x[..., self.dim :]
+        head = torch.view_as_complex(
+            head.float().reshape(*head.shape[:-1], self.dim // 2, 2)
         )
-        t = torch.arange(seq_len, device=device, dtype=dtype)
-        freqs = torch.einsum("i,j->ij", t, inv_freq)
-        sin = freqs.sin()
-        cos = freqs.cos()
-        self._cache[key] = (sin, cos)
-        return sin, cos
-
-    def apply_rotary(
-        self, x: torch.Tensor, sin: torch.Tensor, cos: torch.Tensor
-    ) -> torch.Tensor:
-        x1, x2 = x[..., : self.dim // 2], x[..., self.dim // 2 : self.dim]
-        # Interleave sin/cos across pairs
-        x_rot = torch.stack((-x2, x1), dim=-1).reshape_as(x[..., : self.dim])
-        return (x[..., : self.dim] * cos.unsqueeze(-1)).reshape_as(
-            x[..., : self.dim]
-        ) + (x_rot * sin.unsqueeze(-1)).reshape_as(x[..., : self.dim])
+        head = torch.view_as_real(head * freqs_cis).flatten(-2).type_as(x)
+        if tail.shape[-1] == 0:
+            return head
+        return torch.cat([head, tail], dim=-1)
+
+    def forward(
+        self, q: torch.Tensor, k: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Apply RoPE to the first `dim` channels of q and k, [b, h, t, head_dim].
+        """
+        if q.shape == k.shape:
+            q, k = self.forward_stacked(torch.stack((q, k))).unbind(0)
+            return q, k
+        freqs_cis = self.get_freqs_cis(k.shape[-2], k.device)
+        return self._rotate(q, freqs_cis), self._rotate(k, freqs_cis)
+
+    def forward_stacked(self, qk: torch.Tensor) -> torch.Tensor:
+        """
+        Apply RoPE to q and k stacked along the first dim, [2, b, h, t, head_dim].
+        """
+        return self._rotate(qk, self.get_freqs_cis(qk.shape[-2], qk.device))
+
+
+def _fuse_linears(linears) -> Optional[nn.Linear]:
+    """
+    Pack linears sharing the same input into one, with their output features
+    concatenated in order. Returns None for anything but plain nn.Linear
+    (e.g. quantized layers), which are left alone.
+    """
+    if any(type(linear) is not nn.Linear for linear in linears):
+        return None
+    has_bias = linears[0].bias is not None
+    weight = torch.cat([linear.weight for linear in linears], dim=0)
+    fused = nn.Linear(
+        weight.shape[1], weight.shape[0], bias=has_bias, device="meta"
+    )
+    fused.weight = nn.Parameter(weight)
+    if has_bias:
+        bias = torch.cat([linear.bias for linear in linears], dim=0)
+        fused.bias = nn.Parameter(bias)
+    return fused
 
 
 class LlamaAttention(nn.Module):
@@ -76,9 +124,24 @@ class LlamaAttention(nn.Module):
         self.o_proj = nn.Linear(self.inner_dim, dim, bias=bias)
         self.dropout = dropout
         self.rope_dim = rope_dim if rope_dim is not None else head_dim
-        self.rope = RotaryEmbedding(self.rope_dim)
+        self.rope = RotaryEmbedding(min(self.rope_dim, head_dim))
         self.use_sdpa = use_sdpa
         self._has_sdpa = hasattr(F, "scaled_dot_product_attention")
+        self.qkv_proj = None
+
+    @torch.no_grad()
+    def fuse_projections(self):
+        """
+        Pack q_proj/k_proj/v_proj into a single qkv_proj GEMM. This is an
+        inference-time transform: the state dict no longer matches checkpoints.
+        """
+        if self.cross_attention_dim is not None or self.qkv_proj is not None:
+            return
+        qkv_proj = _fuse_linears([self.q_proj, self.k_proj, self.v_proj])
+        if qkv_proj is None:
+            return
+        self.qkv_proj = qkv_proj
+        del self.q_proj, self.k_proj, self.v_proj
 
     def _shape(self, x: torch.Tensor, b: int, t: int) -> torch.Tensor:
         return x.view(b, t, self.n_heads, self.head_dim).transpose(1, 2)
@@ -90,38 +153,28 @@ class LlamaAttention(nn.Module):
         attention_mask: Optional[torch.Tensor] = None,
     ) -> torch.Tensor:
         b, t, c = x.shape
-        q = self._shape(self.q_proj(x), b, t)
-        if encoder_hidden_states is None:
-            k = self._shape(self.k_proj(x), b, t)
-            v = self._shape(self.v_proj(x), b, t)
+        if self.qkv_proj is not None:
+            # [3, b, n_heads, t, head_dim]
+            qkv = (
+                self.qkv_proj(x)
+                .view(b, t, 3, self.n_heads, self.head_dim)
+                .permute(2, 0, 3, 1, 4)
+            )
+            # RoPE on first rope_dim of head_dim
+            q, k = self.rope.forward_stacked(qkv[:2]).unbind(0)
+            v = qkv[2]
         else:
-            bt, tk, ck = encoder_hidden_states.shape
-            k = self._shape(self.k_proj(encoder_hidden_states), b, tk)
-            v = self._shape(self.v_proj(encoder_hidden_states), b, tk)
-
-        # RoPE on first rope_dim of head_dim
-        rope_dim = min(self.rope_dim, self.head_dim)
-        seq_len_for_rope = k.shape[-2]
-        sin, cos = self.rope.get_sin_cos(
-            seq_len_for_rope, device=x.device, dtype=x.dtype
-        )
-
-        def apply_rope_vec(tensor):
-            head = tensor[..., :rope_dim]
-            tail = tensor[..., rope_dim:]
-            b, h, tt, _ = head.shape
-            head = head.view(b, h, tt, rope_dim // 2, 2)
-            sin_ = sin.view(1, 1, tt, rope_dim // 2, 1)
-            cos_ = cos.view(1, 1, tt, rope_dim // 2, 1)
-            x1 = head[..., 0:1]
-            x2 = head[..., 1:2]
-            rot = torch.cat(
-                [x1 * cos_ - x2 * sin_, x1 * sin_ + x2 * cos_], dim=-1
-            ).view(b, h, tt, rope_dim)
-            return torch.cat([rot, tail], dim=-1)
-
-        q = apply_rope_vec(q)
-        k = apply_rope_vec(k)
+            q = self._shape(self.q_proj(x), b, t)
+            if encoder_hidden_states is None:
+                k = self._shape(self.k_proj(x), b, t)
+                v = self._shape(self.v_proj(x), b, t)
+            else:
+                bt, tk, ck = encoder_hidden_states.shape
+                k = self._shape(self.k_proj(encoder_hidden_states), b, tk)
+                v = self._shape(self.v_proj(encoder_hidden_states), b, tk)
+
+            # RoPE on first rope_dim of head_dim
+            q, k = self.rope(q, k)
 
         # Prefer PyTorch SDPA (can enable FlashAttention kernel on supported GPUs)
         if self.use_sdpa and self._has_sdpa:
@@ -180,9 +233,28 @@ class LlamaMLP(nn.Module):
         self.up = nn.Linear(dim, hidden_dim, bias=False)
         self.down = nn.Linear(hidden_dim, dim, bias=False)
         self.dropout = dropout
+        self.gate_up = None
+
+    @torch.no_grad()
+    def fuse_projections(self):
+        """
+        Pack gate/up into a single gate_up GEMM. This is an inference-time
+        transform: the state dict no longer matches checkpoints.
+        """
+        if self.gate_up is not None:
+            return
+        gate_up = _fuse_linears([self.gate, self.up])
+        if gate_up is None:
+            return
+        self.gate_up = gate_up
+        del self.gate, self.up
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = F.silu(self.gate(x)) * self.up(x)
+        if self.gate_up is not None:
+            gate, up = self.gate_up(x).chunk(2, dim=-1)
+        else:
+            gate, up = self.gate(x), self.up(x)
+        x = F.silu(gate) * up
         x = F.dropout(x, p=self.dropout, training=self.training)
         return self.down(x)
 
@@ -228,6 +300,10 @@ class LlamaTransformerBlock(nn.Module):
         if self.use_ada_layer_norm_single:
             self.scale_shift_table = nn.Parameter(torch.randn(6, dim) / dim**0.5)
 
+    def fuse_projections(self):
+        self.attn.fuse_projections()
+        self.mlp.fuse_projections()
+
     def forward(
         self,
         x: torch.Tensor,
@@ -351,6 +427,16 @@ class LlamaTransformer(nn.Module):
         self.adaln_single = AdaLayerNormSingleFlow(inner_dim)
         self.adaln_single_2 = AdaLayerNormSingleFlow(inner_dim_2)
 
+    def fuse_projections(self):
+        """
+        Merge the q/k/v and gate/up projections of every block, including the
+        wider transformer_blocks_2, into single GEMMs for inference.
+        """
+        for blk in self.transformer_blocks:
+            blk.fuse_projections()
+        for blk in self.transformer_blocks_2:
+            blk.fuse_projections()
+
     def forward(
         self,
         hidden_states: torch.Tensor,
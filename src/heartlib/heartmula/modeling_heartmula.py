@@ -1,3 +1,4 @@
+from typing import List, Optional
 import torch
 import torch.nn as nn
 from .configuration_heartmula import HeartMuLaConfig
@@ -6,6 +7,7 @@ import torch
 import torch.nn as nn
 import torchtune
 from torchtune.models import llama3_2
+from torchtune.modules.kv_cache import KVCache
 
 
 def llama3_2_3B() -> torchtune.modules.transformer.TransformerDecoder:
@@ -98,12 +100,27 @@ def _index_causal_mask(mask: torch.Tensor, input_pos: torch.Tensor):
 
 def _multinomial_sample_one_no_sync(
     probs,
+    generators=None,
 ):  # Does multinomial sampling without a cuda synchronization
-    q = torch.empty_like(probs).exponential_(1)
+    if generators is None:
+        q = torch.empty_like(probs).exponential_(1)
+    else:
+        # one random stream per row
+        q = torch.stack(
+            [
+                torch.empty_like(row).exponential_(1, generator=generator)
+                for row, generator in zip(probs, generators)
+            ]
+        )
     return torch.argmax(probs / q, dim=-1, keepdim=True).to(dtype=torch.int)
 
 
-def sample_topk(logits: torch.Tensor, topk: int, temperature: float):
+def sample_topk(
+    logits: torch.Tensor,
+    topk: int,
+    temperature: float,
+    generators: Optional[List[torch.Generator]] = None,
+):
     logits = logits / temperature
 
     filter_value: float = -float("Inf")
@@ -112,7 +129,7 @@ def sample_topk(logits: torch.Tensor, topk: int, temperature: float):
     scores_processed = torch.nn.functional.log_softmax(scores_processed, dim=-1)
     probs = torch.nn.functional.softmax(scores_processed, dim=-1)
 
-    sample_token = _multinomial_sample_one_no_sync(probs)
+    sample_token = _multinomial_sample_one_no_sync(probs, generators)
     return sample_token
 
 
@@ -168,6 +185,14 @@ class HeartMuLa(PreTrainedModel):
                 dtype,
                 decoder_max_seq_len=self.config.audio_num_codebooks,
             )
+        # torchtune keeps caches that are already set up, whatever their
+        # batch size, so resize them here
+        for module in self.modules():
+            if isinstance(module, KVCache) and module.batch_size != max_batch_size:
+                shape = (max_batch_size, *module.k_cache.shape[1:])
+                module.k_cache = module.k_cache.new_zeros(shape)
+                module.v_cache = module.v_cache.new_zeros(shape)
+                module.batch_size = max_batch_size
 
         self.register_buffer(
             "backbone_causal_mask",
@@ -178,40 +203,84 @@ class HeartMuLa(PreTrainedModel):
             _create_causal_mask(self.config.audio_num_codebooks, device),
         )
 
-    def generate_frame(
+    def _uncond_mask(self, b: int, cfg_scale: float, device) -> Optional[torch.Tensor]:
+        """Under CFG the second half of the batch is the unconditional branch."""
+        if cfg_scale > 1.0 and b > 1:
+            actual_B = b // 2
+            return torch.cat(
+                [
+                    torch.zeros(actual_B, dtype=torch.bool, device=device),
+                    torch.ones(actual_B, dtype=torch.bool, device=device),
+                ]
+            )
+        return None
+
+    def _embed(
         self,
         tokens: torch.Tensor,
         tokens_mask: torch.Tensor,
+        cfg_scale: float,
+        audio: bool,
+    ) -> torch.Tensor:
+        """
+        Backbone input [B, S, dim] for prompt text (audio=False), where only
+        the text column is masked in, or for audio frames (audio=True),
+        where only the codebook columns are.
+        """
+        if audio:
+            return self._embed_frames(tokens[:, :, :-1], tokens_mask[:, :, :-1])
+        return self._embed_text(tokens, tokens_mask, cfg_scale)
+
+    def _embed_text(
+        self, tokens: torch.Tensor, tokens_mask: torch.Tensor, cfg_scale: float
+    ) -> torch.Tensor:
+        B = tokens.size(0)
+        text_embeds = self.text_embeddings(tokens[:, :, -1])
+        uncond_mask = self._uncond_mask(B, cfg_scale, tokens.device)
+        if uncond_mask is not None:
+            uncond_text_embed = self.unconditional_text_embedding(
+                torch.zeros(1, device=tokens.device, dtype=torch.long)
+            )
+            mask_expanded = uncond_mask.view(B, 1, 1).expand_as(text_embeds)
+            text_embeds = torch.where(mask_expanded, uncond_text_embed, text_embeds)
+        return text_embeds * tokens_mask[:, :, -1:]
+
+    def _embed_frames(
+        self, frames: torch.Tensor, frames_mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """
+        Sum of the codebook embeddings of frames [B, S, audio_num_codebooks],
+        optionally masked. Accumulated in float32 like the sum over a
+        [B, S, 9, dim] stack of every column would be, so results match it.
+        """
+        audio_tokens = frames + (
+            self.config.audio_vocab_size
+            * torch.arange(self.config.audio_num_codebooks, device=frames.device)
+        )
+        audio_embeds = self.audio_embeddings(audio_tokens)  # [B, S, 8, dim]
+        if frames_mask is not None:
+            audio_embeds = audio_embeds * frames_mask.unsqueeze(-1)
+        return audio_embeds.sum(dim=2, dtype=torch.float32).to(audio_embeds.dtype)
+
+    def _backbone_hidden(
+        self,
+        h: torch.Tensor,
         input_pos: torch.Tensor,
-        temperature: float,
-        topk: int,
         cfg_scale: float,
         continuous_segments: torch.Tensor = None,
         starts=None,
     ) -> torch.Tensor:
-        b, s, _ = tokens.size()
+        b = h.size(0)
 
         assert self.backbone.caches_are_enabled(), "backbone caches are not enabled"
         curr_backbone_mask = _index_causal_mask(self.backbone_causal_mask, input_pos)
 
-        uncond_mask = None
-        if cfg_scale > 1.0 and b > 1:
-            actual_B = b // 2
-            uncond_mask = torch.cat(
-                [
-                    torch.zeros(actual_B, dtype=torch.bool, device=tokens.device),
-                    torch.ones(actual_B, dtype=torch.bool, device=tokens.device),
-                ]
-            )
-
-        embeds = self._embed_tokens(tokens, uncond_mask=uncond_mask)
-        masked_embeds = embeds * tokens_mask.unsqueeze(-1)
-        h = masked_embeds.sum(dim=2, dtype=embeds.dtype)  # merge
         if continuous_segments is not None:
             continuous_segments = self.muq_linear(continuous_segments)
+            uncond_mask = self._uncond_mask(b, cfg_scale, h.device)
             if uncond_mask is not None:
                 uncond_embed = self.unconditional_text_embedding(
-                    torch.zeros(1, device=tokens.device, dtype=torch.long)
+                    torch.zeros(1, device=h.device, dtype=torch.long)
                 )
                 mask_expanded = uncond_mask.view(b, 1).expand_as(continuous_segments)
                 continuous_segments = torch.where(
@@ -219,7 +288,106 @@ class HeartMuLa(PreTrainedModel):
                 )
             batch_indices = torch.arange(h.shape[0], device=h.device)
             h[batch_indices, starts] = continuous_segments
-        h = self.backbone(h, input_pos=input_pos, mask=curr_backbone_mask)
+        return self.backbone(h, input_pos=input_pos, mask=curr_backbone_mask)
+
+    def prefill(
+        self,
+        tokens: torch.Tensor,
+        tokens_mask: torch.Tensor,
+        input_pos: torch.Tensor,
+        cfg_scale: float,
+        continuous_segments: torch.Tensor = None,
+        starts=None,
+        *,
+        audio: bool,
+    ):
+        """
+        Run tokens through the backbone to fill its KV cache without sampling,
+        e.g. all but the last prompt position. `audio` as in generate_frame.
+        """
+        self._backbone_hidden(
+            self._embed(tokens, tokens_mask, cfg_scale, audio),
+            input_pos,
+            cfg_scale,
+            continuous_segments=continuous_segments,
+            starts=starts,
+        )
+
+    def prefill_frames(
+        self,
+        frames: torch.Tensor,
+        input_pos: torch.Tensor,
+        cfg_scale: float,
+        chunk_size: Optional[int] = None,
+        prompt_tokens: Optional[torch.Tensor] = None,
+        prompt_tokens_mask: Optional[torch.Tensor] = None,
+        prompt_pos: Optional[torch.Tensor] = None,
+        continuous_segments: torch.Tensor = None,
+        starts=None,
+    ) -> torch.Tensor:
+        """
+        Fill the backbone's KV cache with S frames of audio history, frames
+        [b, S, audio_num_codebooks] at input_pos [b, S], in forwards of at
+        most chunk_size frames (all at once by default) to bound activation
+        memory. The prompt, when given, goes into the first forward ahead of
+        the frames. Returns the codebook-0 logits of the last position.
+        """
+        s = frames.size(1)
+        chunk_size = chunk_size or max(s, 1)
+        h = None
+        for chunk_start in range(0, max(s, 1), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            chunk_h = self._embed_frames(frames[:, chunk])
+            chunk_pos = input_pos[:, chunk]
+            segments = None
+            if chunk_start == 0 and prompt_tokens is not None:
+                prompt_h = self._embed_text(
+                    prompt_tokens, prompt_tokens_mask, cfg_scale
+                )
+                chunk_h = torch.cat([prompt_h, chunk_h.to(prompt_h.dtype)], dim=1)
+                chunk_pos = torch.cat([prompt_pos, chunk_pos], dim=1)
+                segments = continuous_segments
+            h = self._backbone_hidden(
+                chunk_h,
+                chunk_pos,
+                cfg_scale,
+                continuous_segments=segments,
+                starts=starts,
+            )
+        return self.codebook0_head(h[:, -1, :])
+
+    def generate_frame(
+        self,
+        tokens: torch.Tensor,
+        tokens_mask: torch.Tensor,
+        input_pos: torch.Tensor,
+        temperature: float,
+        topk: int,
+        cfg_scale: float,
+        continuous_segments: torch.Tensor = None,
+        starts=None,
+        generators: Optional[List[torch.Generator]] = None,
+        return_c0_logits: bool = False,
+        *,
+        audio: bool,
+    ) -> torch.Tensor:
+        """
+        Sample the next frame. `tokens` are prompt text, or with `audio` the
+        previous frame(s); only the codebook columns of audio tokens and only
+        the text column of prompt tokens are embedded. `audio` has no default
+        because a wrong guess embeds the wrong columns without any error. `generators` gives each
+        sampled row (each conditional row under CFG) its own random stream;
+        with `return_c0_logits`, the (guided) codebook-0 logits the first
+        codebook was sampled from are returned as well.
+        """
+        b = tokens.size(0)
+        h = self._backbone_hidden(
+            self._embed(tokens, tokens_mask, cfg_scale, audio),
+            input_pos,
+            cfg_scale,
+            continuous_segments=continuous_segments,
+            starts=starts,
+        )
         last_h = h[:, -1, :]  # the last frame
         c0_logits = self.codebook0_head(last_h)  # only predict the audio part
 
@@ -228,12 +396,13 @@ class HeartMuLa(PreTrainedModel):
             cond_logits = c0_logits[:actual_B, :]
             uncond_logits = c0_logits[actual_B:, :]
             guided_logits = uncond_logits + (cond_logits - uncond_logits) * cfg_scale
-            c0_sample = sample_topk(guided_logits, topk, temperature)
+            c0_sample = sample_topk(guided_logits, topk, temperature, generators)
             c0_sample = c0_sample.repeat(
                 2, 1
             )  # repeat to both branches to keep alignment
         else:
-            c0_sample = sample_topk(c0_logits, topk, temperature)
+            guided_logits = c0_logits
+            c0_sample = sample_topk(c0_logits, topk, temperature, generators)
 
         c0_embed = self._embed_audio(0, c0_sample)
 
@@ -245,7 +414,7 @@ class HeartMuLa(PreTrainedModel):
             .unsqueeze(0)
             .repeat(curr_h.size(0), 1)
         )
-        curr_h = curr_h.to(embeds.dtype)
+        curr_h = curr_h.to(c0_embed.dtype)
         for i in range(1, self.config.audio_num_codebooks):
             curr_decoder_mask = _index_causal_mask(self.decoder_causal_mask, curr_pos)
             decoder_h = self.decoder(
@@ -258,21 +427,35 @@ class HeartMuLa(PreTrainedModel):
                 uncond_ci = ci_logits[actual_B:, :]
                 guided_ci = uncond_ci + (cond_ci - uncond_ci) * cfg_scale
 
-                ci_sample = sample_topk(guided_ci, topk, temperature)
+                ci_sample = sample_topk(guided_ci, topk, temperature, generators)
                 ci_sample = ci_sample.repeat(2, 1)
             else:
-                ci_sample = sample_topk(ci_logits, topk, temperature)
+                ci_sample = sample_topk(ci_logits, topk, temperature, generators)
             ci_embed = self._embed_audio(i, ci_sample)
             curr_h = ci_embed
             curr_sample = torch.cat([curr_sample, ci_sample], dim=1)
             curr_pos = curr_pos[:, -1:] + 1
 
+        if return_c0_logits:
+            return curr_sample, guided_logits
         return curr_sample
 
     def reset_caches(self):
         self.backbone.reset_caches()
         self.decoder.reset_caches()
 
+    def select_cache_rows(self, index: torch.Tensor):
+        """
+        Rebuild the KV caches from rows `index` of the current ones, e.g.
+        `torch.arange(b).repeat_interleave(n)` forks a prefilled batch of b
+        rows into n copies of each. The cache position is kept.
+        """
+        for module in self.modules():
+            if isinstance(module, KVCache):
+                module.k_cache = module.k_cache.index_select(0, index)
+                module.v_cache = module.v_cache.index_select(0, index)
+                module.batch_size = len(index)
+
     def _embed_local_audio(self, tokens):
         """the token from 0-30"""
         audio_tokens = tokens + (
@@ -286,31 +469,3 @@ class HeartMuLa(PreTrainedModel):
 
     def _embed_audio(self, codebook: int, tokens: torch.Tensor) -> torch.Tensor:
         return self.audio_embeddings(tokens + codebook * self.config.audio_vocab_size)
-
-    def _embed_tokens(
-        self, tokens: torch.Tensor, uncond_mask: torch.Tensor | None
-    ) -> torch.Tensor:
-        B, S, _ = tokens.size()
-        text_embeds = self.text_embeddings(tokens[:, :, -1])
-
-        if uncond_mask is not None:
-            uncond_text_embed = self.unconditional_text_embedding(
-                torch.zeros(1, device=tokens.device, dtype=torch.long)
-            )
-            mask_expanded = uncond_mask.view(B, 1, 1).expand_as(text_embeds)
-            text_embeds = torch.where(
-                mask_expanded,
-                uncond_text_embed,
-                text_embeds,
-            )
-
-        text_embeds = text_embeds.unsqueeze(-2)
-
-        audio_tokens = tokens[:, :, :-1] + (
-            self.config.audio_vocab_size
-            * torch.arange(self.config.audio_num_codebooks, device=tokens.device)
-        )
-        audio_embeds = self.audio_embeddings(audio_tokens.view(-1)).reshape(
-            tokens.size(0), tokens.size(1), self.config.audio_num_codebooks, -1
-        )
-        return torch.cat([audio_embeds, text_embeds], dim=-2)
@@ -0,0 +1,271 @@
+import math
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .cancellation import CancellationToken, GenerationCancelled
+
+
+# Same fields as the GUI's batch_item dicts, plus the seed of a single
+# generation. tags and lyrics have no default.
+JOB_DEFAULTS: Dict[str, Any] = {
+    "max_audio_length_ms": 120_000,
+    "topk": 50,
+    "temperature": 1.0,
+    "cfg_scale": 1.5,
+    "filename": "output",
+    "seed": -1,
+}
+
+_NUMERIC_FIELDS = {
+    "max_audio_length_ms": int,
+    "topk": int,
+    "temperature": float,
+    "cfg_scale": float,
+    "seed": int,
+}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def normalize_job(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill in defaults and validate a job dict, with the same rules the GUI
+    applies before queueing. Raises ValueError on bad input.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("job must be a JSON object")
+    unknown = set(item) - set(JOB_DEFAULTS) - {"tags", "lyrics"}
+    if unknown:
+        raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+    for key in ("tags", "lyrics"):
+        if not isinstance(item.get(key), str) or not item[key].strip():
+            raise ValueError(f"{key} must be a non-empty string")
+
+    job = dict(JOB_DEFAULTS)
+    job.update(item)
+    for key, kind in _NUMERIC_FIELDS.items():
+        try:
+            job[key] = kind(job[key])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"{key} must be a number, got {job[key]!r}")
+        if not math.isfinite(job[key]):
+            raise ValueError(f"{key} must be finite")
+    if not isinstance(job["filename"], str):
+        raise ValueError("filename must be a string")
+
+    if job["max_audio_length_ms"] <= 0:
+        raise ValueError("Max audio length must be positive")
+    if job["topk"] <= 0:
+        raise ValueError("Top-K must be positive")
+    if job["temperature"] <= 0:
+        raise ValueError("Temperature must be positive")
+    if job["cfg_scale"] < 1.0:
+        raise ValueError("CFG scale must be >= 1.0")
+    if not job["filename"] or os.path.basename(job["filename"]) != job["filename"]:
+        raise ValueError("filename must be a plain file name")
+    return job
+
+
+def seed_everything(seed: int) -> int:
+    """Seed numpy and torch like the GUI does. -1 picks a random seed."""
+    if seed == -1:
+        seed = random.randint(0, 2147483647)
+    # torch is imported here rather than at the top so that the queue and
+    # job bookkeeping can be imported without it
+    import torch
+
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+    return seed
+
+
+def run_job(pipe, item: Dict[str, Any], save_path: str, **kwargs) -> int:
+    """
+    Run one normalized job through `pipe` and write it to `save_path`.
+    Extra kwargs are passed on to the pipeline. Returns the seed used.
+    """
+    import torch
+
+    seed = seed_everything(item["seed"])
+    with torch.no_grad():
+        pipe(
+            {
+                "lyrics": item["lyrics"],
+                "tags": item["tags"],
+            },
+            max_audio_length_ms=item["max_audio_length_ms"],
+            save_path=save_path,
+            topk=item["topk"],
+            temperature=item["temperature"],
+            cfg_scale=item["cfg_scale"],
+            **kwargs,
+        )
+    return seed
+
+
+@dataclass
+class Job:
+    id: str
+    item: Dict[str, Any]
+    status: str = QUEUED
+    save_path: Optional[str] = None
+    seed: Optional[int] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class JobRunner:
+    """
+    Runs jobs one at a time on a warm pipeline from a background thread.
+
+    Jobs are submitted as GUI-style batch_item dicts and can be polled and
+    cancelled by id. A queued job that is cancelled is never started; a
+    running one stops at its next frame or ODE step. Only the
+    `max_finished` most recently finished jobs are kept for polling.
+    """
+
+    def __init__(self, pipe, output_folder: str, max_finished: int = 1000):
+        self.pipe = pipe
+        self.output_folder = output_folder
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = {}
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.output_folder, exist_ok=True)
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """Stop after the running job; queued jobs stay queued."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+        self._thread = None
+
+    def submit(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        job = Job(id=uuid.uuid4().hex[:12], item=normalize_job(item))
+        with self._lock:
+            self._jobs[job.id] = job
+            snapshot = job.to_dict()
+        self._queue.put(job.id)
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.to_dict()
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                snapshot = job.to_dict()
+                self._prune()
+                return snapshot
+            elif job.status == RUNNING:
+                job.cancel_requested = True
+                self._tokens[job_id].cancel()
+            return job.to_dict()
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(job.status == QUEUED for job in self._jobs.values())
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_finished. Holds _lock."""
+        finished = [
+            job
+            for job in self._jobs.values()
+            if job.status in (DONE, FAILED, CANCELLED)
+        ]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[: len(finished) - self.max_finished]:
+            del self._jobs[job.id]
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                # cancelled while queued, and possibly pruned since
+                if job is None or job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._tokens[job_id] = CancellationToken()
+                job.save_path = os.path.join(
+                    self.output_folder, f"{job.item['filename']}_{job.id}.mp3"
+                )
+            self._run(job)
+
+    def _run(self, job: Job):
+        try:
+            seed = run_job(
+                self.pipe,
+                job.item,
+                job.save_path,
+                cancel_token=self._tokens[job.id],
+            )
+        except GenerationCancelled:
+            with self._lock:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                del self._tokens[job.id]
+                self._prune()
+            return
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                job.status = FAILED
+                job.error = str(e)
+                job.finished_at = time.time()
+                del self._tokens[job.id]
+                self._prune()
+            return
+        with self._lock:
+            job.seed = seed
+            job.status = DONE
+            job.finished_at = time.time()
+            del self._tokens[job.id]
+            self._prune()
@@ -0,0 +1,302 @@
+"""
+Generation library.
+
+Every finished song is recorded in a SQLite database (WAL mode) with its
+generation settings, so adding an entry is a single indexed insert instead of
+a rewrite of the whole history, and the library can be searched and paged
+without loading it. A legacy generation_history.json is imported on first
+use and kept as generation_history.json.bak.
+
+Entries are dicts shaped like the old JSON history items, plus an "id":
+
+    {"id": 3, "timestamp": "2025-01-01 12:00:00", "file_path": "...",
+     "filename": "...", "settings": {...}, "duration_s": None, "missing": False}
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    tags TEXT,
+    lyrics TEXT,
+    seed INTEGER,
+    max_length_ms INTEGER,
+    topk INTEGER,
+    temperature REAL,
+    cfg_scale REAL,
+    duration_s REAL,
+    missing INTEGER NOT NULL DEFAULT 0,
+    settings TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp);
+CREATE INDEX IF NOT EXISTS entries_seed ON entries (seed);
+CREATE INDEX IF NOT EXISTS entries_file_path ON entries (file_path);
+-- tags are only matched with a leading %, which no index can serve
+DROP INDEX IF EXISTS entries_tags;
+-- legacy JSON files already imported, by content hash
+CREATE TABLE IF NOT EXISTS imports (
+    digest TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+"""
+
+# settings keys that get their own column
+_SETTING_COLUMNS = (
+    "tags",
+    "lyrics",
+    "seed",
+    "max_length_ms",
+    "topk",
+    "temperature",
+    "cfg_scale",
+)
+
+
+def _escape_like(text: str) -> str:
+    """Escape LIKE wildcards in `text`, for use with ESCAPE '\\'."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class GenerationLibrary:
+    """
+    SQLite store of generated songs. Safe to share between the Tk thread and
+    generation threads.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "generation_library.db",
+        legacy_json: Optional[str] = "generation_history.json",
+    ):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+        if legacy_json is not None and os.path.exists(legacy_json):
+            self.migrate_json(legacy_json)
+
+    def migrate_json(self, json_path: str) -> int:
+        """
+        Import a generation_history.json (newest entry first) and rename it
+        to .bak. The import is recorded in the same transaction as the
+        entries, so a file whose rename was interrupted is not imported
+        twice. Returns the number of entries imported.
+        """
+        with open(json_path, "rb") as fp:
+            raw = fp.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        history = json.loads(raw.decode("utf-8"))
+        with self._lock, self._conn:
+            done = self._conn.execute(
+                "SELECT 1 FROM imports WHERE digest = ?", (digest,)
+            ).fetchone()
+            if done is None:
+                for entry in reversed(history):
+                    self._insert(
+                        entry.get("file_path", ""),
+                        entry.get("settings") or {},
+                        entry.get("timestamp"),
+                        entry.get("filename"),
+                    )
+                self._conn.execute(
+                    "INSERT INTO imports (digest, source, timestamp) VALUES (?, ?, ?)",
+                    (
+                        digest,
+                        os.path.abspath(json_path),
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    ),
+                )
+        os.replace(json_path, json_path + ".bak")
+        return 0 if done is not None else len(history)
+
+    def _insert(
+        self,
+        file_path: str,
+        settings: Dict[str, Any],
+        timestamp: Optional[str],
+        filename: Optional[str],
+    ) -> int:
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if filename is None:
+            filename = os.path.basename(file_path)
+        columns = [settings.get(key) for key in _SETTING_COLUMNS]
+        cursor = self._conn.execute(
+            "INSERT INTO entries (timestamp, file_path, filename, "
+            + ", ".join(_SETTING_COLUMNS)
+            + ", settings) VALUES (?, ?, ?, "
+            + ", ".join("?" * len(_SETTING_COLUMNS))
+            + ", ?)",
+            [timestamp, file_path, filename, *columns, json.dumps(settings)],
+        )
+        return cursor.lastrowid
+
+    def add(
+        self,
+        file_path: str,
+        settings: Dict[str, Any],
+        timestamp: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Record a generated song and return its entry."""
+        with self._lock, self._conn:
+            entry_id = self._insert(str(file_path), settings, timestamp, None)
+        return self.get(entry_id)
+
+    @staticmethod
+    def _entry(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "timestamp": row["timestamp"],
+            "file_path": row["file_path"],
+            "filename": row["filename"],
+            "settings": json.loads(row["settings"]),
+            "duration_s": row["duration_s"],
+            "missing": bool(row["missing"]),
+        }
+
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+        return None if row is None else self._entry(row)
+
+    @staticmethod
+    def _where(
+        search: Optional[str] = None,
+        tags: Optional[str] = None,
+        seed: Optional[int] = None,
+        min_duration: Optional[float] = None,
+        max_duration: Optional[float] = None,
+        temperature: Optional[float] = None,
+        topk: Optional[int] = None,
+        cfg_scale: Optional[float] = None,
+    ) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if search:
+            clauses.append(
+                "(filename LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\'"
+                " OR lyrics LIKE ? ESCAPE '\\')"
+            )
+            params += [f"%{_escape_like(search)}%"] * 3
+        if tags:
+            for tag in tags.split(","):
+                if tag.strip():
+                    clauses.append("(',' || tags || ',') LIKE ? ESCAPE '\\'")
+                    params.append(f"%,{_escape_like(tag.strip())},%")
+        # entries whose duration is not known yet never match a range
+        if min_duration is not None:
+            clauses.append("duration_s >= ?")
+            params.append(min_duration)
+        if max_duration is not None:
+            clauses.append("duration_s <= ?")
+            params.append(max_duration)
+        for column, value in (
+            ("seed", seed),
+            ("temperature", temperature),
+            ("topk", topk),
+            ("cfg_scale", cfg_scale),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def page(self, offset: int = 0, limit: int = 50, **filters) -> List[Dict[str, Any]]:
+        """
+        Entries newest first, filtered by keyword: `search` matches filename,
+        tags or lyrics; `tags` is a comma-separated list that must all be
+        present; `min_duration`/`max_duration` bound duration_s in seconds;
+        `seed`, `temperature`, `topk` and `cfg_scale` must equal the setting.
+        """
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM entries{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                [*params, limit, offset],
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def count(self, **filters) -> int:
+        """Number of entries matching the filters of page()."""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM entries{where}", params
+            ).fetchone()[0]
+
+    def update(self, entry_id: int, **fields):
+        """Set duration_s, missing or extra settings keys of an entry."""
+        with self._lock, self._conn:
+            if "duration_s" in fields:
+                self._conn.execute(
+                    "UPDATE entries SET duration_s = ? WHERE id = ?",
+                    (fields.pop("duration_s"), entry_id),
+                )
+            if "missing" in fields:
+                self._conn.execute(
+                    "UPDATE entries SET missing = ? WHERE id = ?",
+                    (int(fields.pop("missing")), entry_id),
+                )
+            if fields:
+                row = self._conn.execute(
+                    "SELECT settings FROM entries WHERE id = ?", (entry_id,)
+                ).fetchone()
+                if row is not None:
+                    settings = json.loads(row["settings"])
+                    settings.update(fields)
+                    self._conn.execute(
+                        "UPDATE entries SET settings = ? WHERE id = ?",
+                        (json.dumps(settings), entry_id),
+                    )
+
+    def check_exists(self, entry: Dict[str, Any]) -> bool:
+        """
+        Stat one entry's file, recording the result. Meant to be called for
+        the entries being shown rather than for the whole library.
+        """
+        exists = bool(entry["file_path"]) and os.path.exists(entry["file_path"])
+        if exists == entry["missing"]:
+            self.update(entry["id"], missing=not exists)
+            entry["missing"] = not exists
+        return exists
+
+    def prune_missing(self) -> int:
+        """Stat every entry and delete those whose file is gone."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, file_path FROM entries").fetchall()
+        gone = [
+            (row["id"],)
+            for row in rows
+            if not row["file_path"] or not os.path.exists(row["file_path"])
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entries WHERE id = ?", gone)
+        return len(gone)
+
+    def remove(self, entry_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
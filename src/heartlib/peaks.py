@@ -0,0 +1,140 @@
+"""
+Waveform peaks sidecar files.
+
+A song's min/max envelope is computed once, at several zoom levels, and
+saved next to it as `<song>.peaks.npz`. Drawing a waveform then reads a few
+tens of kilobytes instead of decoding the whole file.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# samples per peak of each zoom level, finest first
+PEAK_LEVELS = (256, 1024, 4096)
+
+_SCALE = 127.0
+
+
+def peaks_path(audio_path: str) -> str:
+    return f"{audio_path}.peaks.npz"
+
+
+@dataclass
+class Peaks:
+    sample_rate: int
+    num_samples: int
+    # samples per peak -> (mins, maxs), int8 scaled by 127
+    levels: Dict[int, Tuple[np.ndarray, np.ndarray]]
+    # RMS level of the whole song in dBFS
+    rms_db: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return self.num_samples / self.sample_rate
+
+    def envelope(
+        self, max_points: int = 1000
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (times, mins, maxs) with at most `max_points` points, in seconds and
+        [-1, 1], from the finest level that is coarse enough.
+        """
+        for spp in sorted(self.levels):
+            mins, maxs = self.levels[spp]
+            if len(mins) <= max_points or spp == max(self.levels):
+                break
+        group = max(1, -(-len(mins) // max_points))
+        if group > 1:
+            pad = -len(mins) % group
+            mins = np.pad(mins, (0, pad), mode="edge").reshape(-1, group).min(axis=1)
+            maxs = np.pad(maxs, (0, pad), mode="edge").reshape(-1, group).max(axis=1)
+        spp = spp * group
+        times = (np.arange(len(mins)) * spp + spp / 2) / self.sample_rate
+        return times, mins / _SCALE, maxs / _SCALE
+
+
+def compute_peaks(
+    audio: np.ndarray, sample_rate: int, levels: Tuple[int, ...] = PEAK_LEVELS
+) -> Peaks:
+    """Min/max envelopes of `audio` ([num_samples] or [num_samples, channels])."""
+    audio = np.asarray(audio, dtype=np.float32)
+    rms = (
+        float(np.sqrt(np.mean(np.square(audio, dtype=np.float64))))
+        if audio.size
+        else 0.0
+    )
+    rms_db = 20.0 * np.log10(max(rms, 1e-10))
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    num_samples = len(audio)
+    out = {}
+    for spp in levels:
+        pad = -num_samples % spp
+        if pad:
+            # pad with the last sample so it does not widen the last bin
+            edge = audio[-1] if num_samples else 0.0
+            blocks = np.concatenate([audio, np.full(pad, edge, dtype=np.float32)])
+        else:
+            blocks = audio
+        blocks = np.clip(blocks, -1.0, 1.0).reshape(-1, spp)
+        out[spp] = (
+            np.round(blocks.min(axis=1) * _SCALE).astype(np.int8),
+            np.round(blocks.max(axis=1) * _SCALE).astype(np.int8),
+        )
+    return Peaks(
+        sample_rate=sample_rate, num_samples=num_samples, levels=out, rms_db=rms_db
+    )
+
+
+def save_peaks(audio_path: str, peaks: Peaks) -> str:
+    path = peaks_path(audio_path)
+    arrays = {
+        "sample_rate": np.int64(peaks.sample_rate),
+        "num_samples": np.int64(peaks.num_samples),
+    }
+    if peaks.rms_db is not None:
+        arrays["rms_db"] = np.float32(peaks.rms_db)
+    for spp, (mins, maxs) in peaks.levels.items():
+        arrays[f"min_{spp}"] = mins
+        arrays[f"max_{spp}"] = maxs
+    tmp_path = f"{path}.part.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_peaks(audio_path: str) -> Optional[Peaks]:
+    """The sidecar of `audio_path`, or None if it is missing or older than the audio."""
+    path = peaks_path(audio_path)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(audio_path):
+            return None
+        with np.load(path) as data:
+            levels = {
+                int(key[4:]): (data[key], data[f"max_{key[4:]}"])
+                for key in data.files
+                if key.startswith("min_")
+            }
+            return Peaks(
+                sample_rate=int(data["sample_rate"]),
+                num_samples=int(data["num_samples"]),
+                levels=levels,
+                rms_db=float(data["rms_db"]) if "rms_db" in data.files else None,
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def peaks_from_file(audio_path: str) -> Peaks:
+    """Load the sidecar, or decode `audio_path` once and write it."""
+    peaks = load_peaks(audio_path)
+    if peaks is None:
+        import soundfile as sf
+
+        audio, sample_rate = sf.read(audio_path, dtype="float32", always_2d=True)
+        peaks = compute_peaks(audio, sample_rate)
+        save_peaks(audio_path, peaks)
+    return peaks
@@ -0,0 +1,192 @@
+"""
+Two-stage pipelined execution.
+
+HeartMuLaGenPipeline.__call__ runs frame generation (HeartMuLa) and decoding
+(HeartCodec) back to back, so with the two models on different devices each
+device idles while the other works. PipelinedExecutor runs the stages on two
+threads joined by a bounded hand-off queue: as soon as job N's frames are
+handed to the decode stage, job N+1's frame generation starts.
+
+    executor = PipelinedExecutor(pipe)
+    futures = [executor.submit(normalize_job(item), path) for item, path in work]
+    seeds = [f.result() for f in futures]
+    print(executor.report())
+    executor.shutdown()
+
+Each job decodes with the RNG state it would have had in a serial run, so a
+seeded job gives the same audio either way.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+
+import torch
+
+from .jobs import seed_everything
+
+
+class _StageClock:
+    # Busy and blocked time of one stage, for utilization reporting.
+    def __init__(self):
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.jobs = 0
+
+
+class PipelinedExecutor:
+    """
+    Overlaps the frame stage of one job with the decode stage of the previous
+    one. At most `max_pending` jobs' frames wait between the stages; when the
+    decode stage falls behind, frame generation blocks instead of piling up
+    frames. The pipeline must be loaded with lazy_load=False, since lazy
+    loading unloads one model while the other stage may be using it.
+    """
+
+    def __init__(self, pipe, max_pending: int = 1):
+        if pipe.lazy_load:
+            raise ValueError("PipelinedExecutor needs a pipeline with lazy_load=False")
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.pipe = pipe
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._handoff: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_pending)
+        self._frames_clock = _StageClock()
+        self._decode_clock = _StageClock()
+        self._started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._frames_worker, daemon=True),
+            threading.Thread(target=self._decode_worker, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item: Dict[str, Any], save_path: str, **kwargs) -> Future:
+        """
+        Queue a normalized job (see jobs.normalize_job). Extra kwargs go to
+        the pipeline, as in run_job. The future resolves to the seed used.
+        """
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = time.perf_counter()
+        future: Future = Future()
+        self._jobs.put((item, save_path, kwargs, future))
+        return future
+
+    def shutdown(self, wait: bool = True):
+        """Finish the submitted jobs, then stop both stages."""
+        self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _frames_worker(self):
+        clock = self._frames_clock
+        while True:
+            task = self._jobs.get()
+            if task is None:
+                self._handoff.put(None)
+                return
+            item, save_path, kwargs, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                seed = seed_everything(item["seed"])
+                preprocess_kwargs, forward_kwargs, postprocess_kwargs = (
+                    self.pipe._sanitize_parameters(
+                        max_audio_length_ms=item["max_audio_length_ms"],
+                        save_path=save_path,
+                        topk=item["topk"],
+                        temperature=item["temperature"],
+                        cfg_scale=item["cfg_scale"],
+                        **kwargs,
+                    )
+                )
+                with torch.no_grad():
+                    model_inputs = self.pipe.preprocess(
+                        {"lyrics": item["lyrics"], "tags": item["tags"]},
+                        **preprocess_kwargs,
+                    )
+                    model_outputs = self.pipe._forward(model_inputs, **forward_kwargs)
+                # the codec device's RNG state at this point is what a serial
+                # run would decode with
+                generator = self._fork_codec_generator()
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            finally:
+                clock.busy += time.perf_counter() - start
+            handoff_start = time.perf_counter()
+            self._handoff.put(
+                (model_outputs, postprocess_kwargs, generator, seed, future)
+            )
+            clock.blocked += time.perf_counter() - handoff_start
+            clock.jobs += 1
+
+    def _decode_worker(self):
+        clock = self._decode_clock
+        while True:
+            wait_start = time.perf_counter()
+            task = self._handoff.get()
+            clock.blocked += time.perf_counter() - wait_start
+            if task is None:
+                return
+            model_outputs, postprocess_kwargs, generator, seed, future = task
+            start = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    self.pipe.postprocess(
+                        model_outputs, generator=generator, **postprocess_kwargs
+                    )
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(seed)
+            finally:
+                clock.busy += time.perf_counter() - start
+                clock.jobs += 1
+
+    def _fork_codec_generator(self) -> torch.Generator:
+        device = self.pipe.codec_device
+        generator = torch.Generator(device=device)
+        if device.type == "cuda":
+            generator.set_state(torch.cuda.get_rng_state(device))
+        else:
+            generator.set_state(torch.get_rng_state())
+        return generator
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-stage jobs, busy seconds, blocked seconds and utilization (busy
+        time over wall time since the first submit). For the frame stage,
+        blocked is time spent waiting for room in the hand-off queue; for the
+        decode stage it is time spent waiting for frames.
+        """
+        wall = 0.0
+        if self._started_at is not None:
+            wall = time.perf_counter() - self._started_at
+        stats = {}
+        for name, clock in (
+            ("frames", self._frames_clock),
+            ("decode", self._decode_clock),
+        ):
+            stats[name] = {
+                "jobs": clock.jobs,
+                "busy_seconds": clock.busy,
+                "blocked_seconds": clock.blocked,
+                "utilization": clock.busy / wall if wall > 0 else 0.0,
+            }
+        return stats
+
+    def report(self) -> str:
+        lines = []
+        for name, stage in self.stats().items():
+            lines.append(
+                f"{name}: {stage['jobs']} jobs, busy {stage['busy_seconds']:.1f} s "
+                f"({stage['utilization']:.0%}), blocked {stage['blocked_seconds']:.1f} s"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,355 @@
+"""
+Batched long-form lyrics transcription.
+
+Instead of the generic 30 s strided chunking of the transformers ASR
+pipeline, each song is cut at its quietest points into segments of at most
+30 s (Whisper's window), and segments from many songs are batched together
+sorted by length, so a batch's decoder steps are spent on segments of
+similar duration.
+
+BatchTranscriber.transcribe_files runs a producer/consumer pipeline: decoder
+threads read, resample and segment songs while the model transcribes the
+batches already queued.
+
+    pipe = HeartTranscriptorPipeline.from_pretrained(...)
+    transcriber = BatchTranscriber(pipe, batch_size=16)
+    for song in transcriber.transcribe_files(paths):
+        print(song.path, song.text)
+    print(transcriber.report())
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+# Whisper's input sample rate and window
+SAMPLE_RATE = 16_000
+MAX_SEGMENT_S = 30.0
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+
+
+def load_audio(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode `path` to mono float32 at `sample_rate`."""
+    import soundfile as sf
+
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+    if sr != sample_rate:
+        import torchaudio.functional as AF
+
+        audio = AF.resample(torch.from_numpy(audio), sr, sample_rate).numpy()
+    return audio
+
+
+def split_on_silence(
+    audio: np.ndarray,
+    sample_rate: int = SAMPLE_RATE,
+    max_segment_s: float = MAX_SEGMENT_S,
+    min_segment_s: float = 5.0,
+    silence_db: float = -40.0,
+    floor_db: float = -60.0,
+    frame_ms: float = 25.0,
+) -> List[Tuple[int, int]]:
+    """
+    (start, end) sample ranges covering the non-silent parts of `audio`.
+
+    A frame is silent when its RMS level is more than `silence_db` below the
+    loudest frame or under `floor_db` dBFS. Each segment runs from a
+    non-silent frame to the quietest frame between `min_segment_s` and
+    `max_segment_s` later (the latest one within 3 dB of the quietest, so
+    segments stay long through evenly loud passages), or to the end of the
+    audible part; silence between segments is skipped.
+    """
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    num_frames = -(-len(audio) // frame)
+    if num_frames == 0:
+        return []
+    padded = np.zeros(num_frames * frame, dtype=np.float32)
+    padded[: len(audio)] = audio
+    rms = np.sqrt(np.mean(np.square(padded.reshape(num_frames, frame)), axis=1))
+    level = 20 * np.log10(np.maximum(rms, 1e-10))
+    voiced = np.flatnonzero(level > max(level.max() + silence_db, floor_db))
+    if len(voiced) == 0:
+        return []
+
+    max_frames = max(1, int(max_segment_s * 1000 / frame_ms))
+    min_frames = min(max_frames, max(1, int(min_segment_s * 1000 / frame_ms)))
+    last = voiced[-1] + 1
+    segments = []
+    pos = voiced[0]
+    while pos < last:
+        if last - pos <= max_frames:
+            end = last
+        else:
+            lo, hi = pos + min_frames, pos + max_frames
+            window = level[lo:hi]
+            end = lo + int(np.flatnonzero(window <= window.min() + 3.0)[-1])
+        segments.append((pos * frame, min(end * frame, len(audio))))
+        # skip to the next audible frame
+        following = voiced[np.searchsorted(voiced, end) :]
+        pos = following[0] if len(following) else last
+    return segments
+
+
+@dataclass
+class Segment:
+    song: int
+    index: int
+    start_s: float
+    end_s: float
+    audio: Optional[np.ndarray] = field(repr=False)
+    # log-mel input features, computed on the decoder threads
+    features: Optional[np.ndarray] = field(default=None, repr=False)
+
+
+@dataclass
+class SongTranscript:
+    path: str
+    duration_s: float
+    # [{"start": s, "end": s, "text": ...}] in song order
+    segments: List[Dict[str, Any]]
+    error: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return "\n".join(s["text"] for s in self.segments if s["text"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "duration_s": self.duration_s,
+            "text": self.text,
+            "segments": self.segments,
+            "error": self.error,
+        }
+
+
+def list_audio_files(folder: str) -> List[str]:
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(folder)
+        for name in names
+        if name.lower().endswith(AUDIO_EXTENSIONS)
+    )
+
+
+class BatchTranscriber:
+    """
+    Transcribes songs with a HeartTranscriptorPipeline's Whisper model,
+    `batch_size` segments at a time. Segments wait in a pool of up to
+    `sort_window` before being sorted by length and batched; the decoder
+    threads, which also compute the log-mel features, stay at most
+    `max_queued_segments` ahead of the model.
+    `generate_kwargs` go to the model's generate().
+    """
+
+    def __init__(
+        self,
+        pipe,
+        batch_size: int = 16,
+        sort_window: Optional[int] = None,
+        decode_workers: int = 2,
+        max_queued_segments: int = 128,
+        max_segment_s: float = MAX_SEGMENT_S,
+        silence_db: float = -40.0,
+        **generate_kwargs,
+    ):
+        if max_segment_s > MAX_SEGMENT_S:
+            raise ValueError(f"max_segment_s must be at most {MAX_SEGMENT_S}")
+        self.pipe = pipe
+        self.batch_size = batch_size
+        self.sort_window = sort_window or batch_size * 4
+        self.decode_workers = decode_workers
+        self.max_queued_segments = max_queued_segments
+        self.max_segment_s = max_segment_s
+        self.silence_db = silence_db
+        self.generate_kwargs = generate_kwargs
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "songs": 0,
+            "segments": 0,
+            "batches": 0,
+            "audio_seconds": 0.0,
+            "model_seconds": 0.0,
+            "wall_seconds": 0.0,
+        }
+
+    @property
+    def audio_hours_per_hour(self) -> float:
+        wall = self.stats["wall_seconds"]
+        return self.stats["audio_seconds"] / wall if wall > 0 else 0.0
+
+    def report(self) -> str:
+        s = self.stats
+        return (
+            f"{s['songs']} songs, {s['audio_seconds'] / 3600:.2f} h of audio in "
+            f"{s['wall_seconds']:.1f} s ({s['segments']} segments, {s['batches']} "
+            f"batches, model busy {s['model_seconds']:.1f} s): "
+            f"{self.audio_hours_per_hour:.1f} audio-hours per hour"
+        )
+
+    @torch.no_grad()
+    def transcribe_segments(self, segments: List[Segment]) -> List[str]:
+        """Transcribe one batch of segments."""
+        model = self.pipe.model
+        if any(segment.features is None for segment in segments):
+            self._extract_features(segments)
+        input_features = torch.from_numpy(
+            np.stack([segment.features for segment in segments])
+        ).to(model.device, model.dtype)
+        ids = model.generate(input_features, **self.generate_kwargs)
+        if not torch.is_tensor(ids):
+            ids = ids["sequences"]
+        texts = self.pipe.tokenizer.batch_decode(ids, skip_special_tokens=True)
+        return [text.strip() for text in texts]
+
+    def _extract_features(self, segments: List[Segment]):
+        features = self.pipe.feature_extractor(
+            [segment.audio for segment in segments],
+            sampling_rate=SAMPLE_RATE,
+            return_tensors="np",
+        ).input_features
+        for segment, segment_features in zip(segments, features):
+            segment.features = segment_features
+            # the features are all the model needs
+            segment.audio = None
+
+    def _segment(self, song: int, path: str) -> Tuple[float, List[Segment]]:
+        audio = load_audio(path)
+        ranges = split_on_silence(
+            audio,
+            max_segment_s=self.max_segment_s,
+            silence_db=self.silence_db,
+        )
+        segments = [
+            Segment(song, i, start / SAMPLE_RATE, end / SAMPLE_RATE, audio[start:end])
+            for i, (start, end) in enumerate(ranges)
+        ]
+        if segments:
+            self._extract_features(segments)
+        return len(audio) / SAMPLE_RATE, segments
+
+    def _produce(self, paths: List[str], out: "queue.Queue", stop: threading.Event):
+        # Decode songs on worker threads and queue their segments, in song
+        # order, behind a ("song", ...) header. Only decode_workers songs are
+        # decoded ahead, and the bounded queue keeps them at most
+        # max_queued_segments ahead of the model.
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+            in_flight: "deque" = deque()
+            next_song = 0
+            while in_flight or next_song < len(paths):
+                while next_song < len(paths) and len(in_flight) < self.decode_workers:
+                    in_flight.append(
+                        (
+                            next_song,
+                            pool.submit(self._segment, next_song, paths[next_song]),
+                        )
+                    )
+                    next_song += 1
+                song, future = in_flight.popleft()
+                if stop.is_set():
+                    for _, pending in in_flight:
+                        pending.cancel()
+                    break
+                try:
+                    duration, segments = future.result()
+                except Exception as e:
+                    out.put(("error", song, str(e)))
+                    continue
+                out.put(("song", song, (duration, len(segments))))
+                for segment in segments:
+                    out.put(("segment", song, segment))
+        out.put(None)
+
+    def transcribe_files(self, paths: Iterable[str]) -> Iterator[SongTranscript]:
+        """
+        Transcribe audio files, yielding each song as soon as all of its
+        segments are done (not necessarily in input order). Updates
+        self.stats as it goes.
+        """
+        paths = list(paths)
+        start = time.perf_counter()
+        segments_queue: "queue.Queue" = queue.Queue(maxsize=self.max_queued_segments)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(paths, segments_queue, stop), daemon=True
+        )
+        producer.start()
+
+        songs: Dict[int, SongTranscript] = {}
+        remaining: Dict[int, int] = {}
+        pool: List[Segment] = []
+        produced_all = False
+        try:
+            while not produced_all or pool:
+                # fill the pool, blocking only when there is nothing to run
+                while not produced_all and len(pool) < self.sort_window:
+                    try:
+                        item = segments_queue.get(block=not pool)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        produced_all = True
+                        break
+                    kind, song, payload = item
+                    if kind == "error":
+                        self.stats["songs"] += 1
+                        yield SongTranscript(paths[song], 0.0, [], error=payload)
+                    elif kind == "song":
+                        duration, count = payload
+                        songs[song] = SongTranscript(
+                            paths[song], duration, [None] * count
+                        )
+                        remaining[song] = count
+                        self.stats["audio_seconds"] += duration
+                        if count == 0:
+                            self.stats["songs"] += 1
+                            yield songs.pop(song)
+                    else:
+                        pool.append(payload)
+
+                if not pool:
+                    continue
+                # longest first, so the padded batches shrink as they go
+                pool.sort(key=lambda s: s.end_s - s.start_s, reverse=True)
+                batch, pool = pool[: self.batch_size], pool[self.batch_size :]
+                model_start = time.perf_counter()
+                texts = self.transcribe_segments(batch)
+                self.stats["model_seconds"] += time.perf_counter() - model_start
+                self.stats["batches"] += 1
+                self.stats["segments"] += len(batch)
+                for segment, text in zip(batch, texts):
+                    transcript = songs[segment.song]
+                    transcript.segments[segment.index] = {
+                        "start": round(float(segment.start_s), 2),
+                        "end": round(float(segment.end_s), 2),
+                        "text": text,
+                    }
+                    remaining[segment.song] -= 1
+                    if remaining[segment.song] == 0:
+                        self.stats["songs"] += 1
+                        yield songs.pop(segment.song)
+                self.stats["wall_seconds"] = time.perf_counter() - start
+        finally:
+            stop.set()
+            # unblock the producer if it is waiting for room in the queue
+            while producer.is_alive():
+                try:
+                    segments_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.stats["wall_seconds"] = time.perf_counter() - start
+
+    def transcribe_directory(self, folder: str) -> Iterator[SongTranscript]:
+        return self.transcribe_files(list_audio_files(folder))
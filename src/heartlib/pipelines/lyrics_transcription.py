@@ -13,8 +13,18 @@ class HeartTranscriptorPipeline(AutomaticSpeechRecognitionPipeline):
 
     @classmethod
     def from_pretrained(
-        cls, pretrained_path: str, device: torch.device, dtype: torch.dtype
+        cls,
+        pretrained_path: str,
+        device: torch.device,
+        dtype: torch.dtype,
+        chunk_length_s: float = 30,
+        batch_size: int = 16,
     ):
+        """
+        `chunk_length_s` and `batch_size` configure the generic strided
+        chunking of __call__; see batch_transcription.BatchTranscriber for
+        silence-based chunking across many songs.
+        """
         if os.path.exists(
             hearttranscriptor_path := os.path.join(
                 pretrained_path, "HeartTranscriptor-oss"
@@ -35,6 +45,6 @@ class HeartTranscriptorPipeline(AutomaticSpeechRecognitionPipeline):
             feature_extractor=processor.feature_extractor,
             device=device,
             dtype=dtype,
-            chunk_length_s=30,
-            batch_size=16,
+            chunk_length_s=chunk_length_s,
+            batch_size=batch_size,
         )
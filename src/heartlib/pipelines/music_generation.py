@@ -1,8 +1,13 @@
 from tokenizers import Tokenizer
 from ..heartmula.modeling_heartmula import HeartMuLa
 from ..heartcodec.modeling_heartcodec import HeartCodec
+from ..cancellation import CancellationToken, GenerationCancelled, GenerationPreempted
+from ..audio_writer import AudioWriterPool, HostStaging, audio_format, write_audio
+from ..reference_audio import EmbeddingCache, ReferenceAudioEncoder
+from .prompt_encoding import PromptEncoder
+import numpy as np
 import torch
-from typing import Dict, Any, Optional, Union
+from typing import Callable, Dict, Any, List, Optional, Union
 import os
 from dataclasses import dataclass
 from tqdm import tqdm
@@ -67,6 +72,165 @@ def _resolve_devices(
     return mula_device, codec_device, lazy_load
 
 
+def _get_rng_state(device: torch.device) -> Dict[str, torch.Tensor]:
+    state = {"cpu": torch.get_rng_state()}
+    if device.type == "cuda":
+        state["cuda"] = torch.cuda.get_rng_state(device)
+    return state
+
+
+def _set_rng_state(state: Dict[str, torch.Tensor], device: torch.device):
+    torch.set_rng_state(state["cpu"])
+    if device.type == "cuda" and "cuda" in state:
+        torch.cuda.set_rng_state(state["cuda"], device)
+
+
+def frames_path(save_path: str) -> str:
+    """Where the frames of the song written to `save_path` are kept."""
+    return os.path.splitext(save_path)[0] + ".frames.npy"
+
+
+def write_frames(path: str, frames: torch.Tensor):
+    """Save frames [8, num_frames] as uint16 (audio token ids fit in 16 bits)."""
+    frames = frames.detach().cpu()
+    if frames.numel() and (frames.min() < 0 or frames.max() > 0xFFFF):
+        raise ValueError("frame token ids do not fit in uint16")
+    tmp_path = f"{path}.{os.getpid()}.part"
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, frames.numpy().astype(np.uint16))
+    os.replace(tmp_path, path)
+
+
+def read_frames(path: str) -> torch.Tensor:
+    return torch.from_numpy(np.load(path).astype(np.int64))
+
+
+# samples of 48 kHz audio per 80 ms frame
+_FRAME_SAMPLES = 3840
+
+
+def _stitch(head: np.ndarray, tail: np.ndarray, offset: int) -> np.ndarray:
+    """
+    Cross-fade `tail` ([num_samples, channels]), which starts `offset`
+    samples into `head`, onto the end of `head`.
+    """
+    if len(head) < offset:
+        raise ValueError(
+            f"existing audio has {len(head)} samples, expected at least {offset}"
+        )
+    if head.shape[1] != tail.shape[1]:
+        head = np.repeat(head.mean(axis=1, keepdims=True), tail.shape[1], axis=1)
+    fade = min(len(head) - offset, len(tail))
+    weight = np.linspace(0, 1, fade, dtype=np.float32)[:, None]
+    mixed = head[offset : offset + fade] * (1 - weight) + tail[:fade] * weight
+    return np.concatenate([head[:offset], mixed, tail[fade:]]).astype(np.float32)
+
+
+def _load_audio(path: str, sample_rate: int) -> np.ndarray:
+    """Decode `path` to float32 [num_samples, channels] at `sample_rate`."""
+    import soundfile as sf
+
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    if sr != sample_rate:
+        import torchaudio.functional as AF
+
+        audio = AF.resample(torch.from_numpy(audio.T), sr, sample_rate).numpy().T
+    return np.ascontiguousarray(audio)
+
+
+def _load_head_audio(path: str, num_frames: int) -> np.ndarray:
+    """
+    The decoded audio of `num_frames` frames, to extend. Compressed formats
+    are rejected: their encoder delay shifts the samples against the frames,
+    which would smear the cross-fade.
+    """
+    if audio_format(path) not in ("WAV", "FLAC"):
+        raise ValueError(
+            f"{path} is compressed; extend onto a .wav or .flac of the song, "
+            "or leave out audio to decode the whole song again"
+        )
+    audio = _load_audio(path, 48000)
+    expected = num_frames * _FRAME_SAMPLES
+    if not expected <= len(audio) < expected + _FRAME_SAMPLES:
+        raise ValueError(
+            f"{path} has {len(audio)} samples, but {num_frames} frames decode "
+            f"to {expected}; is it the audio of these frames?"
+        )
+    return audio
+
+
+def codebook0_log_likelihood(
+    logits: torch.Tensor, tokens: torch.Tensor
+) -> torch.Tensor:
+    """
+    Candidate score for generate_candidates: log-probability of each row's
+    sampled codebook-0 token under the (guided) logits it was sampled from.
+    """
+    log_probs = torch.log_softmax(logits.float(), dim=-1)
+    return log_probs.gather(-1, tokens.long().view(-1, 1)).squeeze(-1)
+
+
+class _PromptStaging:
+    """
+    Moves a request's prompt tensors to a CUDA device with a single
+    non_blocking copy: they are packed, byte for byte, into one reusable
+    pinned buffer and unpacked as views of the device copy.
+    """
+
+    # segment alignment in bytes, enough for any dtype
+    _ALIGN = 16
+
+    def __init__(self):
+        self._buffer: Optional[torch.Tensor] = None
+        # recorded after the last copy out of _buffer
+        self._copied: Optional[torch.cuda.Event] = None
+
+    @classmethod
+    def _layout(cls, tensors: Dict[str, torch.Tensor]):
+        layout, offset = [], 0
+        for name, tensor in tensors.items():
+            nbytes = tensor.numel() * tensor.element_size()
+            layout.append((name, offset, nbytes, tensor.dtype, tensor.shape))
+            offset += -(-nbytes // cls._ALIGN) * cls._ALIGN
+        return layout, offset
+
+    @staticmethod
+    def _view(buffer: torch.Tensor, offset: int, nbytes: int, dtype, shape):
+        return buffer[offset : offset + nbytes].view(dtype).view(shape)
+
+    def pack(
+        self, tensors: Dict[str, torch.Tensor], buffer: torch.Tensor
+    ) -> List[tuple]:
+        """Copy `tensors` into `buffer` (uint8) and return their layout."""
+        layout, _ = self._layout(tensors)
+        for name, offset, nbytes, dtype, shape in layout:
+            self._view(buffer, offset, nbytes, dtype, shape).copy_(tensors[name])
+        return layout
+
+    def unpack(self, buffer: torch.Tensor, layout) -> Dict[str, torch.Tensor]:
+        return {
+            name: self._view(buffer, offset, nbytes, dtype, shape)
+            for name, offset, nbytes, dtype, shape in layout
+        }
+
+    def to_device(
+        self, tensors: Dict[str, torch.Tensor], device: torch.device
+    ) -> Dict[str, torch.Tensor]:
+        if device.type != "cuda":
+            return {name: tensor.to(device) for name, tensor in tensors.items()}
+        _, size = self._layout(tensors)
+        if self._buffer is None or self._buffer.numel() < size:
+            self._buffer = torch.empty(size, dtype=torch.uint8, pin_memory=True)
+        elif self._copied is not None:
+            # the previous request's copy may still be reading the buffer
+            self._copied.synchronize()
+        layout = self.pack(tensors, self._buffer)
+        on_device = self._buffer[:size].to(device, non_blocking=True)
+        self._copied = torch.cuda.Event()
+        self._copied.record(torch.cuda.current_stream(device))
+        return self.unpack(on_device, layout)
+
+
 @dataclass
 class HeartMuLaGenConfig:
     text_bos_id: int = 128000
@@ -94,15 +258,28 @@ class HeartMuLaGenPipeline:
         muq_mulan: Optional[Any],
         text_tokenizer: Tokenizer,
         config: HeartMuLaGenConfig,
+        reference_cache_dir: Optional[str] = None,
     ):
 
         self.muq_mulan = muq_mulan
+        self.reference_encoder: Optional[ReferenceAudioEncoder] = None
+        if muq_mulan is not None or reference_cache_dir is not None:
+            self.reference_encoder = ReferenceAudioEncoder(
+                muq_mulan,
+                EmbeddingCache(reference_cache_dir) if reference_cache_dir else None,
+            )
         self.text_tokenizer = text_tokenizer
         self.config = config
 
         # Remain fixed here for simplicity.
         self._parallel_number = 8 + 1
         self._muq_dim = 512
+        self._prompt_encoder = PromptEncoder(
+            text_tokenizer,
+            bos_id=config.text_bos_id,
+            eos_id=config.text_eos_id,
+            parallel_number=self._parallel_number,
+        )
 
         self.mula_dtype = heartmula_dtype
         self.mula_path = heartmula_path
@@ -113,6 +290,8 @@ class HeartMuLaGenPipeline:
 
         self._mula: Optional[HeartMuLa] = None
         self._codec: Optional[HeartCodec] = None
+        self._staging = HostStaging()
+        self._prompt_staging = _PromptStaging()
         if not lazy_load:
             print(
                 f"You have set lazy_load = False. Loading HeartMuLa and HeartCodec onto device..."
@@ -122,11 +301,7 @@ class HeartMuLaGenPipeline:
                 device_map=self.mula_device,
                 dtype=self.mula_dtype,
             )
-            self._codec = HeartCodec.from_pretrained(
-                self.codec_path,
-                device_map=self.codec_device,
-                dtype=self.codec_dtype,
-            )
+            self._codec = self._load_codec()
         self.lazy_load = lazy_load
 
     @property
@@ -144,12 +319,16 @@ class HeartMuLaGenPipeline:
     def codec(self) -> HeartCodec:
         if isinstance(self._codec, HeartCodec):
             return self._codec
-        self._codec = HeartCodec.from_pretrained(
+        self._codec = self._load_codec()
+        return self._codec
+
+    def _load_codec(self) -> HeartCodec:
+        codec = HeartCodec.from_pretrained(
             self.codec_path,
             device_map=self.codec_device,
             dtype=self.codec_dtype,
         )
-        return self._codec
+        return codec.fuse_projections()
 
     def _unload(self):
         if not self.lazy_load:
@@ -187,66 +366,54 @@ class HeartMuLaGenPipeline:
             "temperature": kwargs.get("temperature", 1.0),
             "topk": kwargs.get("topk", 50),
             "cfg_scale": kwargs.get("cfg_scale", 1.5),
+            "cancel_token": kwargs.get("cancel_token", None),
+            "frame_budget": kwargs.get("frame_budget", None),
+            "checkpoint_path": kwargs.get("checkpoint_path", None),
+            "prefill_chunk_size": kwargs.get("prefill_chunk_size", None),
         }
         postprocess_kwargs = {
             "save_path": kwargs.get("save_path", "output.mp3"),
+            "decode_chunk_size": kwargs.get("decode_chunk_size", None),
+            "cancel_token": kwargs.get("cancel_token", None),
+            "checkpoint_path": kwargs.get("checkpoint_path", None),
+            "writer": kwargs.get("writer", None),
+            "on_audio": kwargs.get("on_audio", None),
+            "save_frames": kwargs.get("save_frames", False),
+            "codec_kwargs": {
+                key: kwargs[key]
+                for key in ("num_steps", "guidance_scale", "duration")
+                if key in kwargs
+            },
         }
         return preprocess_kwargs, forward_kwargs, postprocess_kwargs
 
     def preprocess(self, inputs: Dict[str, Any], cfg_scale: float):
+        return self.preprocess_batch([inputs], cfg_scale)[0]
 
-        # process tags
-        tags = inputs["tags"]
-        if os.path.isfile(tags):
-            with open(tags, encoding="utf-8") as fp:
-                tags = fp.read()
-        assert isinstance(tags, str), f"tags must be a string, but got {type(tags)}"
-
-        tags = tags.lower()
-        # encapsulate with special <tag> and </tag> tokens
-        if not tags.startswith("<tag>"):
-            tags = f"<tag>{tags}"
-        if not tags.endswith("</tag>"):
-            tags = f"{tags}</tag>"
-
-        tags_ids = self.text_tokenizer.encode(tags).ids
-        if tags_ids[0] != self.config.text_bos_id:
-            tags_ids = [self.config.text_bos_id] + tags_ids
-        if tags_ids[-1] != self.config.text_eos_id:
-            tags_ids = tags_ids + [self.config.text_eos_id]
-
+    def preprocess_batch(self, inputs: List[Dict[str, Any]], cfg_scale: float):
+        """
+        Model inputs for several requests, tokenized together. "tags" and
+        "lyrics" are text if str, or files to read if os.PathLike. The
+        optional "ref_audio" is an audio file or a (waveform, sample_rate)
+        pair whose MuQ-MuLan embedding conditions the song.
+        """
         # process reference audio
-        ref_audio = inputs.get("ref_audio", None)
-        if ref_audio is not None:
-            raise NotImplementedError("ref_audio is not supported yet.")
-        muq_embed = torch.zeros([self._muq_dim], dtype=self.mula_dtype)
-        muq_idx = len(tags_ids)
-
-        # process lyrics
-        lyrics = inputs["lyrics"]
-        if os.path.isfile(lyrics):
-            with open(lyrics, encoding="utf-8") as fp:
-                lyrics = fp.read()
-        assert isinstance(
-            lyrics, str
-        ), f"lyrics must be a string, but got {type(lyrics)}"
-        lyrics = lyrics.lower()
-
-        lyrics_ids = self.text_tokenizer.encode(lyrics).ids
-        if lyrics_ids[0] != self.config.text_bos_id:
-            lyrics_ids = [self.config.text_bos_id] + lyrics_ids
-        if lyrics_ids[-1] != self.config.text_eos_id:
-            lyrics_ids = lyrics_ids + [self.config.text_eos_id]
-
-        # cat them together. tags, ref_audio, lyrics
-        prompt_len = len(tags_ids) + 1 + len(lyrics_ids)
-
-        tokens = torch.zeros([prompt_len, self._parallel_number], dtype=torch.long)
-        tokens[: len(tags_ids), -1] = torch.tensor(tags_ids)
-        tokens[len(tags_ids) + 1 :, -1] = torch.tensor(lyrics_ids)
-
-        tokens_mask = torch.zeros_like(tokens, dtype=torch.bool)
-        tokens_mask[:, -1] = True
+        muq_embeds = []
+        for item in inputs:
+            ref_audio = item.get("ref_audio", None)
+            if ref_audio is None:
+                muq_embeds.append(torch.zeros([self._muq_dim], dtype=self.mula_dtype))
+                continue
+            if self.reference_encoder is None:
+                raise ValueError(
+                    "ref_audio needs a MuQ-MuLan embedder or an embedding cache; "
+                    "pass muq_mulan or reference_cache_dir to from_pretrained"
+                )
+            muq_embeds.append(
+                self.reference_encoder.encode(ref_audio).to(self.mula_dtype)
+            )
+
+        tokens, tokens_mask, lengths, muq_idx = self._prompt_encoder.encode(inputs)
 
         bs_size = 2 if cfg_scale != 1.0 else 1
 
@@ -256,13 +423,16 @@ class HeartMuLaGenPipeline:
                 tensor = torch.cat([tensor, tensor], dim=0)
             return tensor
 
-        return {
-            "tokens": _cfg_cat(tokens, cfg_scale),
-            "tokens_mask": _cfg_cat(tokens_mask, cfg_scale),
-            "muq_embed": _cfg_cat(muq_embed, cfg_scale),
-            "muq_idx": [muq_idx] * bs_size,
-            "pos": _cfg_cat(torch.arange(prompt_len, dtype=torch.long), cfg_scale),
-        }
+        return [
+            {
+                "tokens": _cfg_cat(tokens[i, :prompt_len], cfg_scale),
+                "tokens_mask": _cfg_cat(tokens_mask[i, :prompt_len], cfg_scale),
+                "muq_embed": _cfg_cat(muq_embeds[i], cfg_scale),
+                "muq_idx": [muq_idx[i]] * bs_size,
+                "pos": _cfg_cat(torch.arange(prompt_len, dtype=torch.long), cfg_scale),
+            }
+            for i, prompt_len in enumerate(lengths)
+        ]
 
     def _forward(
         self,
@@ -271,86 +441,556 @@ class HeartMuLaGenPipeline:
         temperature: float,
         topk: int,
         cfg_scale: float,
+        cancel_token: Optional[CancellationToken] = None,
+        frame_budget: Optional[int] = None,
+        checkpoint_path: Optional[str] = None,
+        resume_state: Optional[Dict[str, Any]] = None,
+        prefill_chunk_size: Optional[int] = None,
     ):
-        prompt_tokens = model_inputs["tokens"].to(self.mula_device)
-        prompt_tokens_mask = model_inputs["tokens_mask"].to(self.mula_device)
-        continuous_segment = model_inputs["muq_embed"].to(self.mula_device)
-        starts = model_inputs["muq_idx"]
-        prompt_pos = model_inputs["pos"].to(self.mula_device)
-        frames = []
-
-        bs_size = 2 if cfg_scale != 1.0 else 1
-        self.mula.setup_caches(bs_size)
-        with torch.autocast(device_type=self.mula_device.type, dtype=self.mula_dtype):
-            curr_token = self.mula.generate_frame(
-                tokens=prompt_tokens,
-                tokens_mask=prompt_tokens_mask,
-                input_pos=prompt_pos,
+        try:
+            frames = self._generate_frames(
+                model_inputs,
+                max_audio_length_ms=max_audio_length_ms,
                 temperature=temperature,
                 topk=topk,
                 cfg_scale=cfg_scale,
-                continuous_segments=continuous_segment,
-                starts=starts,
+                cancel_token=cancel_token,
+                frame_budget=frame_budget,
+                checkpoint_path=checkpoint_path,
+                resume_state=resume_state,
+                prefill_chunk_size=prefill_chunk_size,
             )
-        frames.append(curr_token[0:1,])
+        finally:
+            self._unload()
+        return {"frames": frames}
+
+    def _generate_frames(
+        self,
+        model_inputs: Dict[str, Any],
+        max_audio_length_ms: int,
+        temperature: float,
+        topk: int,
+        cfg_scale: float,
+        cancel_token: Optional[CancellationToken],
+        frame_budget: Optional[int],
+        checkpoint_path: Optional[str],
+        resume_state: Optional[Dict[str, Any]],
+        prefill_chunk_size: Optional[int] = None,
+    ):
+        staged = self._prompt_staging.to_device(
+            {
+                key: model_inputs[key]
+                for key in ("tokens", "tokens_mask", "muq_embed", "pos")
+            },
+            self.mula_device,
+        )
+        prompt_tokens = staged["tokens"]
+        prompt_tokens_mask = staged["tokens_mask"]
+        continuous_segment = staged["muq_embed"]
+        starts = model_inputs["muq_idx"]
+        prompt_pos = staged["pos"]
+        frames = []
+
+        bs_size = 2 if cfg_scale != 1.0 else 1
 
         def _pad_audio_token(token: torch.Tensor):
-            padded_token = (
-                torch.ones(
-                    (token.shape[0], self._parallel_number),
-                    device=token.device,
-                    dtype=torch.long,
-                )
-                * self.config.empty_id
+            padded_token = torch.full(
+                (token.shape[0], token.shape[1], self._parallel_number),
+                self.config.empty_id,
+                device=token.device,
+                dtype=torch.long,
             )
-            padded_token[:, :-1] = token
-            padded_token = padded_token.unsqueeze(1)
+            padded_token[..., :-1] = token
             padded_token_mask = torch.ones_like(
                 padded_token, device=token.device, dtype=torch.bool
             )
             padded_token_mask[..., -1] = False
             return padded_token, padded_token_mask
 
+        # The per-frame model input is allocated once and updated in place;
+        # the model reads it synchronously, so reusing it is safe.
+        frame_token, frame_token_mask = _pad_audio_token(
+            torch.zeros(
+                (bs_size, 1, self._parallel_number - 1),
+                device=self.mula_device,
+                dtype=torch.long,
+            )
+        )
+
+        self.mula.setup_caches(bs_size)
+        if resume_state is None:
+            with torch.autocast(
+                device_type=self.mula_device.type, dtype=self.mula_dtype
+            ):
+                curr_token = self.mula.generate_frame(
+                    tokens=prompt_tokens,
+                    tokens_mask=prompt_tokens_mask,
+                    input_pos=prompt_pos,
+                    temperature=temperature,
+                    topk=topk,
+                    cfg_scale=cfg_scale,
+                    continuous_segments=continuous_segment,
+                    starts=starts,
+                    audio=False,
+                )
+            frames.append(curr_token[0:1,])
+            start = 0
+        else:
+            # Rebuild the KV cache from the prompt and every frame that had
+            # already been fed back, batched into forwards of
+            # prefill_chunk_size frames, then continue from the last frame.
+            start = resume_state["next_frame"]
+            saved = resume_state["frames"].to(self.mula_device)
+            frames = list(saved.split(1))
+            with torch.autocast(
+                device_type=self.mula_device.type, dtype=self.mula_dtype
+            ):
+                self.mula.prefill_frames(
+                    saved[:start].unsqueeze(0).repeat(bs_size, 1, 1),
+                    input_pos=prompt_pos[..., -1:]
+                    + torch.arange(1, start + 1, device=self.mula_device),
+                    cfg_scale=cfg_scale,
+                    chunk_size=prefill_chunk_size,
+                    prompt_tokens=prompt_tokens,
+                    prompt_tokens_mask=prompt_tokens_mask,
+                    prompt_pos=prompt_pos,
+                    continuous_segments=continuous_segment,
+                    starts=starts,
+                )
+            curr_token = frames[-1].repeat(bs_size, 1)
+            if resume_state.get("rng_state") is not None:
+                _set_rng_state(resume_state["rng_state"], self.mula_device)
+
+        def _preempt(i: int, reason: str):
+            if checkpoint_path is not None:
+                self._save_checkpoint(
+                    checkpoint_path,
+                    frames,
+                    complete=False,
+                    next_frame=i,
+                    model_inputs=model_inputs,
+                    forward_kwargs={
+                        "max_audio_length_ms": max_audio_length_ms,
+                        "temperature": temperature,
+                        "topk": topk,
+                        "cfg_scale": cfg_scale,
+                    },
+                )
+            raise GenerationPreempted(
+                f"generation {reason} after {len(frames)} frames",
+                checkpoint_path=checkpoint_path,
+            )
+
         max_audio_frames = max_audio_length_ms // 80
 
-        for i in tqdm(range(max_audio_frames)):
-            curr_token, curr_token_mask = _pad_audio_token(curr_token)
+        for i in tqdm(range(start, max_audio_frames)):
+            if cancel_token is not None and cancel_token.cancelled:
+                if not cancel_token.preempted:
+                    raise GenerationCancelled(
+                        f"generation cancelled after {len(frames)} frames"
+                    )
+                _preempt(i, "preempted")
+            if frame_budget is not None and i - start >= frame_budget:
+                _preempt(i, f"ran out of its {frame_budget} frame budget")
+            frame_token[:, 0, :-1].copy_(curr_token)
             with torch.autocast(
                 device_type=self.mula_device.type, dtype=self.mula_dtype
             ):
                 curr_token = self.mula.generate_frame(
-                    tokens=curr_token,
-                    tokens_mask=curr_token_mask,
+                    tokens=frame_token,
+                    tokens_mask=frame_token_mask,
                     input_pos=prompt_pos[..., -1:] + i + 1,
                     temperature=temperature,
                     topk=topk,
                     cfg_scale=cfg_scale,
                     continuous_segments=None,
                     starts=None,
+                    audio=True,
                 )
             if torch.any(curr_token[0:1, :] >= self.config.audio_eos_id):
                 break
             frames.append(curr_token[0:1,])
         frames = torch.stack(frames).permute(1, 2, 0).squeeze(0)
-        self._unload()
-        return {"frames": frames}
+        return frames
 
-    def postprocess(self, model_outputs: Dict[str, Any], save_path: str):
-        frames = model_outputs["frames"].to(self.codec_device)
-        wav = self.codec.detokenize(frames)
-        self._unload()
-        # torchaudio.save(save_path, wav.to(torch.float32).cpu(), 48000)
-        import soundfile as sf
-        audio_np = wav.to(torch.float32).cpu().numpy().T
-        sf.write(save_path, audio_np, 48000)
+    def _save_checkpoint(
+        self,
+        checkpoint_path: str,
+        frames,
+        complete: bool,
+        next_frame: int = 0,
+        model_inputs: Optional[Dict[str, Any]] = None,
+        forward_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        state = {
+            "frames": torch.cat(frames).cpu(),  # [num_frames, 8]
+            "complete": complete,
+            "next_frame": next_frame,
+            "model_inputs": None,
+            "forward_kwargs": forward_kwargs,
+            "rng_state": _get_rng_state(self.mula_device),
+        }
+        if model_inputs is not None:
+            state["model_inputs"] = {
+                k: v.cpu() if isinstance(v, torch.Tensor) else v
+                for k, v in model_inputs.items()
+            }
+        tmp_path = checkpoint_path + ".tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, checkpoint_path)
+
+    def postprocess(
+        self,
+        model_outputs: Dict[str, Any],
+        save_path: str,
+        decode_chunk_size: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        checkpoint_path: Optional[str] = None,
+        generator: Optional[torch.Generator] = None,
+        writer: Optional[AudioWriterPool] = None,
+        on_audio: Optional[Callable[[np.ndarray, int], None]] = None,
+        save_frames: bool = False,
+        codec_kwargs: Optional[Dict[str, Any]] = None,
+        head_audio: Optional[np.ndarray] = None,
+        head_frames: int = 0,
+    ):
+        """
+        Decode and write the frames. Given head_audio, the already decoded
+        waveform of the first head_frames frames, only the frames from one
+        codec window overlap before head_frames on are decoded, and they are
+        cross-faded onto head_audio over that overlap. A head shorter than
+        the overlap is decoded again instead.
+        """
+        codec_kwargs = codec_kwargs or {}
+        if save_frames:
+            write_frames(frames_path(save_path), model_outputs["frames"])
+        start = 0
+        if head_audio is not None:
+            window, hop = HeartCodec.window_frames(
+                codec_kwargs.get("duration", HeartCodec.window_duration)
+            )
+            start = max(0, head_frames - (window - hop))
+        frames = model_outputs["frames"][:, start:].to(self.codec_device)
+        try:
+            wav = self.codec.detokenize(
+                frames,
+                **codec_kwargs,
+                decode_chunk_size=decode_chunk_size,
+                cancel_token=cancel_token,
+                generator=generator,
+            )
+        except GenerationPreempted as e:
+            # The frames are done, so a resume only has to redo the decoding.
+            if checkpoint_path is not None:
+                self._save_checkpoint(
+                    checkpoint_path, [model_outputs["frames"].T], complete=True
+                )
+            raise GenerationPreempted(str(e), checkpoint_path=checkpoint_path)
+        finally:
+            self._unload()
+        audio_np = self._staging.to_numpy(wav).T
+        if start > 0:
+            audio_np = _stitch(
+                head_audio[: head_frames * _FRAME_SAMPLES],
+                audio_np,
+                start * _FRAME_SAMPLES,
+            )
+        if on_audio is not None:
+            # the decoded [num_samples, channels] waveform, before encoding
+            on_audio(audio_np, 48000)
+        if writer is not None:
+            return writer.submit(save_path, audio_np, 48000)
+        return write_audio(save_path, audio_np, 48000)
 
     def __call__(self, inputs: Dict[str, Any], **kwargs):
+        """
+        Generate one song and write it to save_path, in the format given by
+        its extension. Returns the path, or a Future of it when a writer
+        (AudioWriterPool) is passed. `on_audio(audio, sample_rate)` is called
+        with the decoded waveform before it is written. With save_frames=True
+        the generated frames are kept beside the audio (see frames_path), so
+        render() can decode them again; num_steps, guidance_scale and
+        duration go to HeartCodec.detokenize.
+        """
         preprocess_kwargs, forward_kwargs, postprocess_kwargs = (
             self._sanitize_parameters(**kwargs)
         )
+        audio_format(postprocess_kwargs["save_path"])
         model_inputs = self.preprocess(inputs, **preprocess_kwargs)
         model_outputs = self._forward(model_inputs, **forward_kwargs)
-        self.postprocess(model_outputs, **postprocess_kwargs)
+        return self.postprocess(model_outputs, **postprocess_kwargs)
+
+    def resume(self, checkpoint_path: str, **kwargs):
+        """
+        Continue a generation that raised GenerationPreempted with a
+        checkpoint_path. Sampling parameters come from the checkpoint; kwargs
+        give the output options (save_path, ...) and optionally a new
+        cancel_token, frame_budget or checkpoint_path.
+        """
+        state = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+        _, forward_kwargs, postprocess_kwargs = self._sanitize_parameters(**kwargs)
+        if "checkpoint_path" not in kwargs:
+            forward_kwargs["checkpoint_path"] = checkpoint_path
+            postprocess_kwargs["checkpoint_path"] = checkpoint_path
+        if state["complete"]:
+            model_outputs = {"frames": state["frames"].T}
+        else:
+            forward_kwargs.update(state["forward_kwargs"])
+            model_outputs = self._forward(
+                state["model_inputs"], resume_state=state, **forward_kwargs
+            )
+        return self.postprocess(model_outputs, **postprocess_kwargs)
+
+    def render(self, frames_path: str, save_path: str, **kwargs):
+        """
+        Decode frames saved with save_frames=True and write them to
+        save_path, without generating anything. kwargs are the output and
+        codec options of __call__ (num_steps, guidance_scale, duration,
+        decode_chunk_size, writer, ...).
+        """
+        _, _, postprocess_kwargs = self._sanitize_parameters(
+            save_path=save_path, **kwargs
+        )
+        audio_format(save_path)
+        postprocess_kwargs["save_frames"] = False
+        return self.postprocess(
+            {"frames": read_frames(frames_path)}, **postprocess_kwargs
+        )
+
+    def extend(
+        self,
+        inputs: Dict[str, Any],
+        frames: Union[torch.Tensor, str],
+        extra_ms: int,
+        save_path: str,
+        audio: Optional[str] = None,
+        **kwargs,
+    ):
+        """
+        Continue a song by up to extra_ms. `inputs` are the song's tags and
+        lyrics and `frames` its frames ([8, num_frames], or a .frames.npy
+        file from save_frames=True). The prompt and the frames are prefilled
+        in one forward and sampling continues after the last frame.
+
+        Given `audio`, the song's existing audio file (.wav or .flac), only
+        the new frames and one codec window overlap are decoded and
+        cross-faded onto it; otherwise the whole song is decoded. The file
+        is checked against the frames before anything is generated. kwargs are as for __call__
+        (save_frames=True keeps the extended frames for another extension).
+        """
+        if not torch.is_tensor(frames):
+            frames = read_frames(frames)
+        preprocess_kwargs, forward_kwargs, postprocess_kwargs = (
+            self._sanitize_parameters(save_path=save_path, **kwargs)
+        )
+        audio_format(save_path)
+        num_frames = frames.shape[1]
+        head_audio = None
+        if audio is not None:
+            head_audio = _load_head_audio(audio, num_frames)
+        model_inputs = self.preprocess(inputs, **preprocess_kwargs)
+        # the existing last frame is fed back first, as in resume()
+        forward_kwargs["max_audio_length_ms"] = (num_frames - 1) * 80 + extra_ms
+        model_outputs = self._forward(
+            model_inputs,
+            resume_state={"frames": frames.T, "next_frame": num_frames - 1},
+            **forward_kwargs,
+        )
+        return self.postprocess(
+            model_outputs,
+            head_audio=head_audio,
+            head_frames=num_frames,
+            **postprocess_kwargs,
+        )
+
+    def generate_candidates(
+        self,
+        inputs: Dict[str, Any],
+        n: int = 4,
+        seeds: Optional[List[int]] = None,
+        score: Optional[Callable[[torch.Tensor, torch.Tensor], torch.Tensor]] = None,
+        save_paths: Optional[List[str]] = None,
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate `n` variants of one song in a single batched loop. The
+        prompt is prefilled once and its KV cache forked into n rows; row k
+        samples from its own generator seeded with seeds[k] (random seeds
+        when not given), and is decoded with a codec generator seeded the
+        same way, so a candidate and its audio can be regenerated from its
+        seed.
+
+        `score(c0_logits [n, vocab], c0_tokens [n]) -> [n]`, e.g.
+        codebook0_log_likelihood, is summed over each candidate's frames
+        while sampling. Returns [{"seed", "frames", "score", "path"}], best
+        mean score per frame first when scoring, else in seed order. When
+        `save_paths` (one per seed) are given, every candidate is decoded
+        and written; kwargs are as for __call__.
+        """
+        if seeds is None:
+            seeds = torch.randint(0, 2**31 - 1, (n,)).tolist()
+        if len(seeds) != n:
+            raise ValueError(f"expected {n} seeds, got {len(seeds)}")
+        if save_paths is not None:
+            if len(save_paths) != n:
+                raise ValueError(f"expected {n} save_paths, got {len(save_paths)}")
+            for path in save_paths:
+                audio_format(path)
+        preprocess_kwargs, forward_kwargs, postprocess_kwargs = (
+            self._sanitize_parameters(**kwargs)
+        )
+        model_inputs = self.preprocess(inputs, **preprocess_kwargs)
+        try:
+            frames, lengths, scores = self._generate_candidate_frames(
+                model_inputs,
+                seeds=seeds,
+                score=score,
+                max_audio_length_ms=forward_kwargs["max_audio_length_ms"],
+                temperature=forward_kwargs["temperature"],
+                topk=forward_kwargs["topk"],
+                cfg_scale=forward_kwargs["cfg_scale"],
+                cancel_token=forward_kwargs["cancel_token"],
+            )
+        finally:
+            self._unload()
+
+        candidates = []
+        for k, seed in enumerate(seeds):
+            candidate = {
+                "seed": seed,
+                "frames": frames[k, :, : lengths[k]].cpu(),  # [8, num_frames]
+                "score": None,
+                "path": None,
+            }
+            if scores is not None:
+                # a candidate that ended at once ranks last
+                candidate["score"] = (
+                    scores[k] / lengths[k] if lengths[k] else float("-inf")
+                )
+            if save_paths is not None:
+                postprocess_kwargs["save_path"] = save_paths[k]
+                generator = torch.Generator(device=self.codec_device)
+                candidate["path"] = self.postprocess(
+                    {"frames": candidate["frames"]},
+                    generator=generator.manual_seed(seed),
+                    **postprocess_kwargs,
+                )
+            candidates.append(candidate)
+        if scores is not None:
+            candidates.sort(key=lambda c: c["score"], reverse=True)
+        return candidates
+
+    def _generate_candidate_frames(
+        self,
+        model_inputs: Dict[str, Any],
+        seeds: List[int],
+        score: Optional[Callable[[torch.Tensor, torch.Tensor], torch.Tensor]],
+        max_audio_length_ms: int,
+        temperature: float,
+        topk: int,
+        cfg_scale: float,
+        cancel_token: Optional[CancellationToken],
+    ):
+        """
+        Frames [n, 8, max_frames], each row's length up to its first end of
+        audio token, and each row's summed score (None without `score`).
+        """
+        staged = self._prompt_staging.to_device(
+            {
+                key: model_inputs[key]
+                for key in ("tokens", "tokens_mask", "muq_embed", "pos")
+            },
+            self.mula_device,
+        )
+        prompt_tokens = staged["tokens"]
+        prompt_tokens_mask = staged["tokens_mask"]
+        prompt_pos = staged["pos"]
+        n = len(seeds)
+        bs_size = 2 if cfg_scale != 1.0 else 1
+        # conditional rows first, then their unconditional twins, as the
+        # model's CFG expects
+        fork = torch.arange(bs_size, device=self.mula_device).repeat_interleave(n)
+        generators = [
+            torch.Generator(device=self.mula_device).manual_seed(seed) for seed in seeds
+        ]
+
+        frame_token = torch.full(
+            (bs_size * n, 1, self._parallel_number),
+            self.config.empty_id,
+            device=self.mula_device,
+            dtype=torch.long,
+        )
+        frame_token_mask = torch.ones_like(frame_token, dtype=torch.bool)
+        frame_token_mask[..., -1] = False
+
+        self.mula.setup_caches(bs_size)
+        with torch.autocast(device_type=self.mula_device.type, dtype=self.mula_dtype):
+            # Prefill all but the last prompt position once, fork the cache,
+            # then sample each row's first frame from the last position.
+            self.mula.prefill(
+                tokens=prompt_tokens[:, :-1],
+                tokens_mask=prompt_tokens_mask[:, :-1],
+                input_pos=prompt_pos[:, :-1],
+                cfg_scale=cfg_scale,
+                continuous_segments=staged["muq_embed"],
+                starts=model_inputs["muq_idx"],
+                audio=False,
+            )
+            self.mula.select_cache_rows(fork)
+            last_pos = prompt_pos[:, -1:].index_select(0, fork)
+            curr_token, c0_logits = self.mula.generate_frame(
+                tokens=prompt_tokens[:, -1:].index_select(0, fork),
+                tokens_mask=prompt_tokens_mask[:, -1:].index_select(0, fork),
+                input_pos=last_pos,
+                temperature=temperature,
+                topk=topk,
+                cfg_scale=cfg_scale,
+                generators=generators,
+                return_c0_logits=True,
+                audio=False,
+            )
+
+        max_audio_frames = max_audio_length_ms // 80
+        frames = torch.zeros(
+            (n, self._parallel_number - 1, max_audio_frames + 1),
+            device=self.mula_device,
+            dtype=torch.long,
+        )
+        lengths = torch.full((n,), max_audio_frames + 1, device=self.mula_device)
+        finished = torch.zeros(n, dtype=torch.bool, device=self.mula_device)
+        scores = None if score is None else torch.zeros(n, device=self.mula_device)
+
+        for i in tqdm(range(max_audio_frames + 1)):
+            rows = curr_token[:n]
+            ended = torch.any(rows >= self.config.audio_eos_id, dim=-1) & ~finished
+            lengths = torch.where(ended, i, lengths)
+            finished |= ended
+            frames[:, :, i] = rows
+            if scores is not None:
+                scores += torch.where(finished, 0.0, score(c0_logits, rows[:, 0]))
+            if i == max_audio_frames or bool(finished.all()):
+                break
+            if cancel_token is not None and cancel_token.cancelled:
+                raise GenerationCancelled(
+                    f"candidate generation cancelled after {i + 1} frames"
+                )
+            frame_token[:, 0, :-1].copy_(curr_token)
+            with torch.autocast(
+                device_type=self.mula_device.type, dtype=self.mula_dtype
+            ):
+                curr_token, c0_logits = self.mula.generate_frame(
+                    tokens=frame_token,
+                    tokens_mask=frame_token_mask,
+                    input_pos=last_pos + i + 1,
+                    temperature=temperature,
+                    topk=topk,
+                    cfg_scale=cfg_scale,
+                    generators=generators,
+                    return_c0_logits=True,
+                    audio=True,
+                )
+        lengths = lengths.tolist()
+        return frames, lengths, None if scores is None else scores.tolist()
 
     @classmethod
     def from_pretrained(
@@ -360,7 +1000,13 @@ class HeartMuLaGenPipeline:
         dtype: Union[torch.dtype, Dict[str, torch.dtype]],
         version: str,
         lazy_load: bool = False,
+        muq_mulan: Optional[Any] = None,
+        reference_cache_dir: Optional[str] = None,
     ):
+        """
+        `muq_mulan` (e.g. reference_audio.MuQMuLanEmbedder) enables the
+        "ref_audio" input; embeddings are cached under `reference_cache_dir`.
+        """
 
         mula_path, codec_path, tokenizer_path, gen_config_path = _resolve_paths(
             pretrained_path, version
@@ -378,9 +1024,10 @@ class HeartMuLaGenPipeline:
             heartmula_device=mula_device,
             heartcodec_device=codec_device,
             lazy_load=lazy_load,
-            muq_mulan=None,
+            muq_mulan=muq_mulan,
             text_tokenizer=tokenizer,
             config=gen_config,
+            reference_cache_dir=reference_cache_dir,
             heartmula_dtype=mula_dtype,
             heartcodec_dtype=codec_dtype,
         )
@@ -0,0 +1,140 @@
+"""
+Prompt tokenization for HeartMuLa.
+
+A prompt is `<bos><tag>tags</tag><eos>`, one slot for the MuQ reference
+embedding, then `<bos>lyrics<eos>`, all in the text column (the last of the
+9 token columns). PromptEncoder tokenizes many prompts with a single
+`encode_batch` call per field, keeps the token ids of recently used tag
+strings (the GUI builds them from a fixed vocabulary, so they repeat), and
+lays a whole batch out into token/mask tensors with one scatter.
+
+Tags and lyrics are text when given as str and read from disk when given as
+an os.PathLike (e.g. pathlib.Path). A str is never treated as a path.
+"""
+
+import os
+import warnings
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import torch
+from tokenizers import Tokenizer
+
+TextOrPath = Union[str, "os.PathLike[str]"]
+
+
+def read_text(value: TextOrPath, name: str) -> str:
+    """
+    `value` itself if it is a str, or the contents of the file it names if it
+    is path-like. A str used to be read as a path when that file existed, so
+    a short one-line str naming an existing file warns that it is now taken
+    as the text itself; wrap it in pathlib.Path to read the file.
+    """
+    if isinstance(value, os.PathLike):
+        with open(value, encoding="utf-8") as fp:
+            return fp.read()
+    if not isinstance(value, str):
+        raise TypeError(
+            f"{name} must be a string or a path-like object, but got {type(value)}"
+        )
+    if len(value) < 4096 and "\n" not in value and os.path.isfile(value):
+        warnings.warn(
+            f"{name} {value!r} names a file but is a str, so it is used as the "
+            f"{name} text itself; pass pathlib.Path({value!r}) to read the file",
+            FutureWarning,
+            stacklevel=2,
+        )
+    return value
+
+
+def normalize_tags(tags: str) -> str:
+    tags = tags.lower()
+    # encapsulate with special <tag> and </tag> tokens
+    if not tags.startswith("<tag>"):
+        tags = f"<tag>{tags}"
+    if not tags.endswith("</tag>"):
+        tags = f"{tags}</tag>"
+    return tags
+
+
+class PromptEncoder:
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        bos_id: int,
+        eos_id: int,
+        parallel_number: int,
+        tag_cache_size: int = 1024,
+    ):
+        self.tokenizer = tokenizer
+        self.bos_id = bos_id
+        self.eos_id = eos_id
+        self.parallel_number = parallel_number
+        self.tag_cache_size = tag_cache_size
+        # normalized tags -> token ids, least recently used first
+        self._tag_cache: "OrderedDict[str, List[int]]" = OrderedDict()
+
+    def _wrap(self, ids: List[int]) -> List[int]:
+        if not ids or ids[0] != self.bos_id:
+            ids = [self.bos_id] + ids
+        if ids[-1] != self.eos_id:
+            ids = ids + [self.eos_id]
+        return ids
+
+    def _encode(self, texts: List[str]) -> List[List[int]]:
+        if not texts:
+            return []
+        return [self._wrap(e.ids) for e in self.tokenizer.encode_batch(texts)]
+
+    def encode_tags(self, tags: Sequence[str]) -> List[List[int]]:
+        """Token ids of already normalized tag strings, cached."""
+        cache = self._tag_cache
+        misses = list(dict.fromkeys(t for t in tags if t not in cache))
+        for text, ids in zip(misses, self._encode(misses)):
+            cache[text] = ids
+        out = []
+        for text in tags:
+            cache.move_to_end(text)
+            out.append(cache[text])
+        while len(cache) > self.tag_cache_size:
+            cache.popitem(last=False)
+        return out
+
+    def encode_lyrics(self, lyrics: Sequence[str]) -> List[List[int]]:
+        return self._encode([text.lower() for text in lyrics])
+
+    def encode(
+        self, inputs: Sequence[Dict[str, Any]]
+    ) -> Tuple[torch.Tensor, torch.Tensor, List[int], List[int]]:
+        """
+        Tokenize a batch of {"tags", "lyrics"} inputs.
+
+        Returns tokens [batch, max_len, parallel_number] and the matching
+        boolean mask, both zero-padded at the end, plus each prompt's length
+        and MuQ embedding position.
+        """
+        tags = [normalize_tags(read_text(x["tags"], "tags")) for x in inputs]
+        lyrics = [read_text(x["lyrics"], "lyrics") for x in inputs]
+        tags_ids = self.encode_tags(tags)
+        lyrics_ids = self.encode_lyrics(lyrics)
+
+        # tags, one empty slot for the MuQ embedding, lyrics
+        muq_idx = [len(t) for t in tags_ids]
+        lengths = [len(t) + 1 + len(l) for t, l in zip(tags_ids, lyrics_ids)]
+        batch, max_len = len(inputs), max(lengths, default=0)
+
+        flat_ids, rows, cols = [], [], []
+        for i, (t, l) in enumerate(zip(tags_ids, lyrics_ids)):
+            flat_ids += t + l
+            rows += [i] * (len(t) + len(l))
+            cols += range(len(t))
+            cols += range(len(t) + 1, len(t) + 1 + len(l))
+        rows = torch.tensor(rows, dtype=torch.long)
+        cols = torch.tensor(cols, dtype=torch.long)
+
+        tokens = torch.zeros([batch, max_len, self.parallel_number], dtype=torch.long)
+        tokens[rows, cols, -1] = torch.tensor(flat_ids, dtype=torch.long)
+        tokens_mask = torch.zeros_like(tokens, dtype=torch.bool)
+        # the MuQ slot is part of the prompt, so it is masked in as well
+        tokens_mask[..., -1] = torch.arange(max_len) < torch.tensor(lengths)[:, None]
+        return tokens, tokens_mask, lengths, muq_idx
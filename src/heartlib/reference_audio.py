@@ -0,0 +1,173 @@
+"""
+Reference-audio conditioning.
+
+HeartMuLa takes a 512-dim MuQ-MuLan embedding of a reference song at the
+prompt's MuQ slot. ReferenceAudioEncoder turns reference audio into that
+embedding with a pluggable extractor and keeps every embedding in a
+content-addressed cache on disk, keyed by the extractor name and the SHA-256
+of the audio, so reusing a style reference costs a hash and a file read
+instead of a pass through the audio encoder.
+
+    embedder = MuQMuLanEmbedder.from_pretrained(device=torch.device("cuda"))
+    pipe = HeartMuLaGenPipeline.from_pretrained(
+        ..., muq_mulan=embedder, reference_cache_dir="./cache/muq"
+    )
+    pipe({"tags": ..., "lyrics": ..., "ref_audio": "style.mp3"}, ...)
+
+Any object with `name`, `sample_rate` and `embed(wav [samples]) -> [dim]`
+can stand in for MuQMuLanEmbedder.
+"""
+
+import hashlib
+import os
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+# a file path, or a (waveform [channels, samples] or [samples], sample_rate) pair
+ReferenceAudio = Union[str, "os.PathLike[str]", Tuple[torch.Tensor, int]]
+
+_HASH_CHUNK = 1 << 20
+
+
+class MuQMuLanEmbedder:
+    """MuQ-MuLan audio tower. Needs the optional `muq` package."""
+
+    name = "muq-mulan-large"
+    sample_rate = 24_000
+
+    def __init__(self, model, device: torch.device):
+        self.model = model
+        self.device = device
+
+    @classmethod
+    def from_pretrained(
+        cls,
+        model_id: str = "OpenMuQ/MuQ-MuLan-large",
+        device: torch.device = torch.device("cpu"),
+    ):
+        try:
+            from muq import MuQMuLan
+        except ImportError as e:
+            raise ImportError(
+                "Reference audio needs the muq package: pip install muq"
+            ) from e
+        model = MuQMuLan.from_pretrained(model_id).to(device).eval()
+        return cls(model, device)
+
+    @torch.no_grad()
+    def embed(self, wav: torch.Tensor) -> torch.Tensor:
+        return self.model(wavs=wav.unsqueeze(0).to(self.device))[0].float().cpu()
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_waveform(wav: torch.Tensor, sample_rate: int) -> str:
+    wav = wav.detach().to("cpu", torch.float32).contiguous()
+    digest = hashlib.sha256()
+    digest.update(f"{sample_rate}:{tuple(wav.shape)}:".encode())
+    digest.update(wav.numpy().tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings stored as `<cache_dir>/<extractor>/<ab>/<sha256>.npy`. Entries
+    are written under a temporary name and moved into place, so concurrent
+    writers of the same key are harmless.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.cache_dir, namespace, key[:2], f"{key}.npy")
+
+    def get(self, namespace: str, key: str) -> Optional[torch.Tensor]:
+        try:
+            return torch.from_numpy(np.load(self.path(namespace, key)))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, namespace: str, key: str, embedding: torch.Tensor):
+        path = self.path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with open(tmp_path, "wb") as fp:
+            np.save(fp, embedding.detach().to("cpu", torch.float32).numpy())
+        os.replace(tmp_path, path)
+
+
+class ReferenceAudioEncoder:
+    """
+    Reference audio -> embedding, through `cache` when one is given. Without
+    an `embedder`, only cached references can be used.
+    """
+
+    def __init__(self, embedder=None, cache: Optional[EmbeddingCache] = None):
+        if embedder is None and cache is None:
+            raise ValueError("need an embedding extractor, a cache, or both")
+        self.embedder = embedder
+        self.cache = cache
+        # (path, size, mtime) -> content hash, so unchanged files are hashed once
+        self._file_keys: Dict[Tuple[str, int, int], str] = {}
+
+    @property
+    def namespace(self) -> str:
+        if self.embedder is not None:
+            return self.embedder.name
+        return MuQMuLanEmbedder.name
+
+    def key(self, ref_audio: ReferenceAudio) -> str:
+        """Content hash of `ref_audio`."""
+        if isinstance(ref_audio, tuple):
+            return _hash_waveform(*ref_audio)
+        path = os.fspath(ref_audio)
+        stat = os.stat(path)
+        stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self._file_keys:
+            self._file_keys[stat_key] = _hash_file(path)
+        return self._file_keys[stat_key]
+
+    def _load(self, ref_audio: ReferenceAudio) -> torch.Tensor:
+        if isinstance(ref_audio, tuple):
+            wav, sample_rate = ref_audio
+        else:
+            import soundfile as sf
+
+            audio, sample_rate = sf.read(
+                os.fspath(ref_audio), dtype="float32", always_2d=True
+            )
+            wav = torch.from_numpy(audio.T)
+        wav = wav.to(torch.float32)
+        if wav.ndim == 2:
+            wav = wav.mean(dim=0)
+        if sample_rate != self.embedder.sample_rate:
+            import torchaudio.functional as AF
+
+            wav = AF.resample(wav, sample_rate, self.embedder.sample_rate)
+        return wav
+
+    def encode(self, ref_audio: ReferenceAudio) -> torch.Tensor:
+        """The float32 embedding of `ref_audio`."""
+        key = self.key(ref_audio)
+        if self.cache is not None:
+            embedding = self.cache.get(self.namespace, key)
+            if embedding is not None:
+                return embedding
+        if self.embedder is None:
+            what = "waveform" if isinstance(ref_audio, tuple) else repr(ref_audio)
+            raise KeyError(
+                f"no cached embedding for {what} and no extractor to compute it"
+            )
+        embedding = self.embedder.embed(self._load(ref_audio)).to(torch.float32)
+        if self.cache is not None:
+            self.cache.put(self.namespace, key, embedding)
+        return embedding
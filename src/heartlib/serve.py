@@ -0,0 +1,186 @@
+"""
+Headless generation server.
+
+Keeps one HeartMuLaGenPipeline warm in this process and accepts jobs over a
+local HTTP API. Jobs use the same fields as the GUI's batch queue items:
+
+    POST   /jobs              submit a job, returns it with its id
+    GET    /jobs              list all jobs
+    GET    /jobs/<id>         poll a job
+    POST   /jobs/<id>/cancel  cancel a job (DELETE /jobs/<id> works too)
+    GET    /health            liveness and queue length
+
+Run with `python -m heartlib.serve --model_path ./ckpt`.
+"""
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from .jobs import JobRunner, DONE, FAILED, CANCELLED
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "HeartMuLaServe/0.1"
+
+    @property
+    def runner(self) -> JobRunner:
+        return self.server.runner
+
+    def _send(self, status: int, payload: Any):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path_parts(self) -> List[str]:
+        return [part for part in self.path.split("?", 1)[0].split("/") if part]
+
+    def _job_or_404(self, job: Optional[Dict[str, Any]]):
+        if job is None:
+            self._send(404, {"error": "job not found"})
+        else:
+            self._send(200, job)
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ["health"]:
+            self._send(200, {"status": "ok", "queued": self.runner.pending()})
+        elif parts == ["jobs"]:
+            self._send(200, self.runner.jobs())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            self._job_or_404(self.runner.get(parts[1]))
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts = self._path_parts()
+        if parts == ["jobs"]:
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                if length < 0:
+                    raise ValueError("invalid Content-Length")
+                item = json.loads(self.rfile.read(length) or b"{}")
+                job = self.runner.submit(item)
+            except (TypeError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            self._send(201, job)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            self._job_or_404(self.runner.cancel(parts[1]))
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) == 2 and parts[0] == "jobs":
+            self._job_or_404(self.runner.cancel(parts[1]))
+        else:
+            self._send(404, {"error": "not found"})
+
+
+def make_server(
+    runner: JobRunner, host: str = "127.0.0.1", port: int = 8765
+) -> ThreadingHTTPServer:
+    """Bind the HTTP API to `runner`. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), _JobRequestHandler)
+    server.daemon_threads = True
+    server.runner = runner
+    return server
+
+
+class JobClient:
+    """Minimal client for the server, using only the standard library."""
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8765", timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, payload: Any = None):
+        data = None
+        headers = {}
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers=headers, method=method
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            detail = json.loads(e.read() or b"{}").get("error", e.reason)
+            raise RuntimeError(f"{method} {path} failed ({e.code}): {detail}")
+
+    def submit(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return self._request("POST", "/jobs", item)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        return self._request("GET", "/jobs")
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        return self._request("POST", f"/jobs/{job_id}/cancel")
+
+    def wait(
+        self, job_id: str, poll_interval: float = 1.0, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.status(job_id)
+            if job["status"] in (DONE, FAILED, CANCELLED):
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"job {job_id} still {job['status']}")
+            time.sleep(poll_interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, default="./ckpt")
+    parser.add_argument("--version", type=str, default="3B")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--dtype", type=str, default="bfloat16")
+    parser.add_argument("--lazy_load", action="store_true")
+    parser.add_argument("--output_folder", type=str, default="./output")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max_finished", type=int, default=1000)
+    return parser.parse_args()
+
+
+def main():
+    import torch
+    from .pipelines.music_generation import HeartMuLaGenPipeline
+
+    args = parse_args()
+    pipe = HeartMuLaGenPipeline.from_pretrained(
+        args.model_path,
+        device=torch.device(args.device),
+        dtype=getattr(torch, args.dtype),
+        version=args.version,
+        lazy_load=args.lazy_load,
+    )
+    runner = JobRunner(pipe, args.output_folder, max_finished=args.max_finished)
+    runner.start()
+    server = make_server(runner, args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        runner.stop(wait=False)
+
+
+if __name__ == "__main__":
+    main()
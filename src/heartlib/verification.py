@@ -0,0 +1,208 @@
+"""
+Generate-and-verify: transcribe each generated song and score it against
+the lyrics it was generated from.
+
+The 48 kHz waveform is taken from the pipeline's postprocess (on_audio), so
+nothing is read back from disk; it is resampled to Whisper's 16 kHz once, on
+a verification thread, while the next song generates.
+
+    verifier = LyricsVerifier(HeartTranscriptorPipeline.from_pretrained(...))
+    run = GenerateAndVerify(pipe, verifier, library=GenerationLibrary())
+    entry, check = run({"tags": ..., "lyrics": ...}, save_path="song.mp3")
+    ...                                # generate the next song meanwhile
+    print(check.result()["wer"])       # also stored on the library entry
+"""
+
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .pipelines.batch_transcription import (
+    SAMPLE_RATE,
+    BatchTranscriber,
+    Segment,
+    split_on_silence,
+)
+from .pipelines.prompt_encoding import read_text
+
+# section markers such as [Verse] or [Chorus 2]
+_SECTION = re.compile(r"\[[^\]]*\]")
+# a CJK character, or a run of letters/digits/apostrophes
+_WORD = re.compile(r"[぀-ヿ㐀-鿿가-힯]|[^\W_]+(?:'[^\W_]+)*")
+
+
+def lyrics_words(text: str) -> List[str]:
+    """Lowercased words of `text`, without section markers or punctuation."""
+    return _WORD.findall(_SECTION.sub(" ", text).lower())
+
+
+def word_errors(reference: List[str], hypothesis: List[str]) -> int:
+    """Word-level edit distance (substitutions + deletions + insertions)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (ref_word != hyp_word),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    ref_words = lyrics_words(reference)
+    errors = word_errors(ref_words, lyrics_words(hypothesis))
+    return errors / max(1, len(ref_words))
+
+
+class LyricsVerifier:
+    """
+    Transcribes in-memory waveforms with a HeartTranscriptorPipeline, using
+    the silence-based segmentation of BatchTranscriber. `generate_kwargs` go
+    to the model's generate().
+    """
+
+    def __init__(self, transcriptor, batch_size: int = 8, **generate_kwargs):
+        self.transcriber = BatchTranscriber(
+            transcriptor, batch_size=batch_size, **generate_kwargs
+        )
+
+    def transcribe(self, audio: np.ndarray, sample_rate: int) -> str:
+        """Transcribe `audio` ([num_samples] or [num_samples, channels])."""
+        audio = np.asarray(audio, dtype=np.float32)
+        if audio.ndim == 2:
+            audio = audio.mean(axis=1)
+        if sample_rate != SAMPLE_RATE:
+            import torchaudio.functional as AF
+
+            audio = AF.resample(torch.from_numpy(audio), sample_rate, SAMPLE_RATE)
+            audio = audio.numpy()
+        ranges = split_on_silence(
+            audio,
+            max_segment_s=self.transcriber.max_segment_s,
+            silence_db=self.transcriber.silence_db,
+        )
+        segments = [
+            Segment(0, i, start / SAMPLE_RATE, end / SAMPLE_RATE, audio[start:end])
+            for i, (start, end) in enumerate(ranges)
+        ]
+        texts = []
+        batch_size = self.transcriber.batch_size
+        for i in range(0, len(segments), batch_size):
+            texts += self.transcriber.transcribe_segments(segments[i : i + batch_size])
+        return "\n".join(text for text in texts if text)
+
+    def verify(
+        self, audio: np.ndarray, sample_rate: int, lyrics: str
+    ) -> Dict[str, Any]:
+        transcript = self.transcribe(audio, sample_rate)
+        ref_words = lyrics_words(lyrics)
+        errors = word_errors(ref_words, lyrics_words(transcript))
+        return {
+            "wer": errors / max(1, len(ref_words)),
+            "word_errors": errors,
+            "lyrics_words": len(ref_words),
+            "transcript": transcript,
+        }
+
+
+class VerificationWorker:
+    """
+    Runs LyricsVerifier.verify on a background thread, one song at a time,
+    and stores the result on the song's library entry.
+    """
+
+    def __init__(self, verifier: LyricsVerifier, library=None):
+        self.verifier = verifier
+        self.library = library
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="lyrics-verification"
+        )
+
+    def submit(
+        self,
+        audio: np.ndarray,
+        sample_rate: int,
+        lyrics: str,
+        entry_id: Optional[int] = None,
+    ) -> Future:
+        return self._executor.submit(self._verify, audio, sample_rate, lyrics, entry_id)
+
+    def _verify(self, audio, sample_rate, lyrics, entry_id):
+        result = self.verifier.verify(audio, sample_rate, lyrics)
+        if self.library is not None and entry_id is not None:
+            self.library.update(
+                entry_id,
+                wer=round(result["wer"], 4),
+                transcript=result["transcript"],
+            )
+        return result
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+class GenerateAndVerify:
+    """
+    Generates with `pipe`, records the song in `library` (optional) and
+    queues its verification, returning without waiting for it.
+    """
+
+    def __init__(self, pipe, verifier: LyricsVerifier, library=None):
+        self.pipe = pipe
+        self.library = library
+        self.worker = VerificationWorker(verifier, library)
+
+    def __call__(
+        self,
+        inputs: Dict[str, Any],
+        save_path: str,
+        settings: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> Tuple[Any, Future]:
+        """
+        Generate one song (kwargs as for the pipeline) and return its library
+        entry (or the pipeline's result without a library) and a Future of
+        the verification result. The entry records the prompt, the sampling
+        kwargs and `settings`.
+        """
+        lyrics = read_text(inputs["lyrics"], "lyrics")
+        decoded = {}
+
+        def _keep_audio(audio: np.ndarray, sample_rate: int):
+            decoded["audio"], decoded["sample_rate"] = audio, sample_rate
+
+        result = self.pipe(inputs, save_path=save_path, on_audio=_keep_audio, **kwargs)
+        entry_id = None
+        if self.library is not None:
+            if isinstance(result, Future):
+                # the entry should point at a complete file
+                result.result()
+            recorded = {
+                "tags": read_text(inputs["tags"], "tags"),
+                "lyrics": lyrics,
+                **{
+                    key: kwargs[key]
+                    for key in ("temperature", "topk", "cfg_scale")
+                    if key in kwargs
+                },
+            }
+            if "max_audio_length_ms" in kwargs:
+                recorded["max_length_ms"] = kwargs["max_audio_length_ms"]
+            recorded.update(settings or {})
+            result = self.library.add(save_path, recorded)
+            entry_id = result["id"]
+        check = self.worker.submit(
+            decoded["audio"], decoded["sample_rate"], lyrics, entry_id
+        )
+        return result, check
+
+    def shutdown(self, wait: bool = True):
+        self.worker.shutdown(wait=wait)
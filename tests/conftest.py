@@ -0,0 +1,103 @@
+"""
+Tiny random HeartMuLa / HeartCodec models and a pipeline built from them, so
+the generation code paths run on CPU in seconds without a checkpoint.
+"""
+
+import pytest
+import torch
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+from torchtune.models import llama3_2
+
+from heartlib.heartcodec.configuration_heartcodec import HeartCodecConfig
+from heartlib.heartcodec.modeling_heartcodec import HeartCodec
+from heartlib.heartmula import modeling_heartmula
+from heartlib.heartmula.configuration_heartmula import HeartMuLaConfig
+from heartlib.heartmula.modeling_heartmula import HeartMuLa
+from heartlib.pipelines.music_generation import (
+    HeartMuLaGenConfig,
+    HeartMuLaGenPipeline,
+)
+
+# audio tokens are codec codes, so both models share the codebook size
+CODEBOOK_SIZE = 64
+TEXT_VOCAB = ["[UNK]", "<bos>", "<eos>", "<tag>", "</tag>", "piano", "happy", "la"]
+
+
+def _tiny_llama():
+    return llama3_2.llama3_2(
+        vocab_size=128,
+        num_layers=2,
+        num_heads=4,
+        num_kv_heads=2,
+        embed_dim=64,
+        max_seq_len=2048,
+        intermediate_dim=128,
+        attn_dropout=0.0,
+        norm_eps=1e-5,
+        rope_base=500_000,
+        scale_factor=32,
+    )
+
+
+modeling_heartmula.FLAVORS.setdefault("tiny", _tiny_llama)
+
+
+@pytest.fixture
+def tiny_mula() -> HeartMuLa:
+    torch.manual_seed(0)
+    model = HeartMuLa(
+        HeartMuLaConfig(
+            backbone_flavor="tiny",
+            decoder_flavor="tiny",
+            text_vocab_size=len(TEXT_VOCAB),
+            audio_vocab_size=CODEBOOK_SIZE,
+        )
+    )
+    # allocated with torch.empty and not covered by post_init
+    torch.nn.init.normal_(model.audio_head, std=0.02)
+    return model.eval()
+
+
+@pytest.fixture
+def tiny_codec() -> HeartCodec:
+    torch.manual_seed(0)
+    config = HeartCodecConfig(
+        codebook_size=CODEBOOK_SIZE,
+        num_attention_heads=2,
+        attention_head_dim=16,
+        num_layers=1,
+        num_layers_2=1,
+        init_channel=4,
+    )
+    return HeartCodec(config).eval()
+
+
+@pytest.fixture
+def tiny_pipeline(tiny_mula, tiny_codec) -> HeartMuLaGenPipeline:
+    tokenizer = Tokenizer(
+        WordLevel({word: i for i, word in enumerate(TEXT_VOCAB)}, unk_token="[UNK]")
+    )
+    tokenizer.pre_tokenizer = Whitespace()
+    cpu = torch.device("cpu")
+    pipe = HeartMuLaGenPipeline(
+        heartmula_path=None,
+        heartcodec_path=None,
+        heartmula_device=cpu,
+        heartcodec_device=cpu,
+        heartmula_dtype=torch.float32,
+        heartcodec_dtype=torch.float32,
+        lazy_load=True,
+        muq_mulan=None,
+        text_tokenizer=tokenizer,
+        # no end of audio token: every song runs to max_audio_length_ms
+        config=HeartMuLaGenConfig(
+            text_bos_id=1, text_eos_id=2, audio_eos_id=CODEBOOK_SIZE
+        ),
+    )
+    # keep the models between calls instead of reloading them from disk
+    pipe._mula = tiny_mula
+    pipe._codec = tiny_codec.fuse_projections()
+    pipe.lazy_load = False
+    return pipe
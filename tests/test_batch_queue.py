@@ -0,0 +1,56 @@
+import json
+
+from heartlib.batch_queue import PENDING, BatchQueue
+from heartlib.jobs import DONE, FAILED
+
+ITEM = {"tags": "piano,happy", "lyrics": "[Verse]\nla la la"}
+
+
+def test_torn_last_line_is_truncated_before_appending(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    queue = BatchQueue(str(path))
+    first = queue.add(dict(ITEM, filename="first"))
+    second = queue.add(dict(ITEM, filename="second"))
+    queue.close()
+
+    # a crash in the middle of writing a third record
+    with open(path, "a", encoding="utf-8") as fp:
+        fp.write('{"op": "add", "id": "torn", "item": {"tags"')
+
+    queue = BatchQueue(str(path))
+    assert [e["id"] for e in queue.items()] == [first, second]
+    third = queue.add(dict(ITEM, filename="third"))
+    queue.set_state(first, DONE, save_path="first.mp3")
+    queue.close()
+
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            json.loads(line)
+
+    queue = BatchQueue(str(path))
+    entries = queue.items()
+    assert [e["id"] for e in entries] == [first, second, third]
+    assert [e["state"] for e in entries] == [DONE, PENDING, PENDING]
+    assert entries[0]["save_path"] == "first.mp3"
+    assert entries[2]["item"]["filename"] == "third"
+    queue.close()
+
+
+def test_retry_failed_requeues_only_failed_items(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    queue = BatchQueue(str(path))
+    done, first, second = (queue.add(dict(ITEM, filename=n)) for n in "abc")
+    queue.set_state(done, DONE, save_path="a.mp3")
+    queue.set_state(first, FAILED, error="out of memory")
+    queue.set_state(second, FAILED, error="out of memory")
+
+    assert queue.retry_failed([done, first]) == 1
+    assert [e["state"] for e in queue.items()] == [DONE, PENDING, FAILED]
+    assert queue.get(first)["error"] is None
+    assert queue.retry_failed() == 1
+    queue.close()
+
+    queue = BatchQueue(str(path))
+    assert [e["state"] for e in queue.items()] == [DONE, PENDING, PENDING]
+    assert queue.retry_failed() == 0
+    queue.close()
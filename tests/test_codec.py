@@ -0,0 +1,115 @@
+import pytest
+import torch
+
+from conftest import CODEBOOK_SIZE
+
+# 100-frame windows overlapping by 20 frames
+DURATION = 8.0
+
+
+def _cat_overlap_add(windows, ovlp_samples, target_len):
+    """The torch.cat overlap-add detokenize used before it preallocated."""
+    output = windows[0].clone()
+    ov_win = torch.linspace(0, 1, ovlp_samples, dtype=output.dtype)
+    for cur in windows[1:]:
+        output[:, -ovlp_samples:] = (
+            output[:, -ovlp_samples:] * (1 - ov_win) + cur[:, :ovlp_samples] * ov_win
+        )
+        output = torch.cat([output, cur[:, ovlp_samples:]], -1)
+    return output[:, :target_len]
+
+
+def test_detokenize_overlap_add_matches_concatenation(tiny_codec, monkeypatch):
+    windows = []
+    decode = tiny_codec.scalar_model.decode
+
+    def recording_decode(x):
+        out = decode(x)
+        windows.append(out.squeeze(0).squeeze(1)[:, : int(DURATION * 48000)].clone())
+        return out
+
+    monkeypatch.setattr(tiny_codec.scalar_model, "decode", recording_decode)
+    codes = torch.randint(0, CODEBOOK_SIZE, (8, 230))
+    wav = tiny_codec.detokenize(
+        codes,
+        duration=DURATION,
+        num_steps=2,
+        disable_progress=True,
+        generator=torch.Generator().manual_seed(0),
+    )
+    target_len = int(230 / 12.5 * 48000)
+    assert len(windows) >= 3
+    assert wav.shape == (2, target_len)
+    min_samples = int(DURATION * 48000)
+    ovlp_samples = min_samples - min_samples // 93 * 80
+    expected = _cat_overlap_add(windows, ovlp_samples, target_len)
+    torch.testing.assert_close(wav, expected, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1000])
+def test_chunked_decode_matches_one_shot(tiny_codec, chunk_size):
+    torch.manual_seed(0)
+    latent = torch.randn(2, 128, 150)
+    with torch.no_grad():
+        expected = tiny_codec.scalar_model.decode(latent)
+    actual = tiny_codec.scalar_model.decode_chunked(latent, chunk_size=chunk_size)
+    torch.testing.assert_close(actual, expected, rtol=0, atol=1e-6)
+
+
+def test_fused_projections_match_unfused(tiny_codec):
+    codes = torch.randint(0, CODEBOOK_SIZE, (8, 120))
+
+    def _detokenize():
+        return tiny_codec.detokenize(
+            codes,
+            duration=DURATION,
+            num_steps=2,
+            disable_progress=True,
+            generator=torch.Generator().manual_seed(0),
+        )
+
+    unfused = _detokenize()
+    tiny_codec.fuse_projections()
+    modules = list(tiny_codec.modules())
+    assert any(getattr(m, "qkv_proj", None) is not None for m in modules)
+    assert any(getattr(m, "gate_up", None) is not None for m in modules)
+    torch.testing.assert_close(_detokenize(), unfused)
+
+
+def test_shared_window_plan_matches_fresh_plans(tiny_codec):
+    flow_matching = tiny_codec.flow_matching
+    codes = torch.randint(0, CODEBOOK_SIZE, (1, 8, 200))
+    window, hop = tiny_codec.window_frames(DURATION)
+    latent_length = int(DURATION * 25)
+
+    def _two_windows(plan):
+        latents = torch.empty(1, 0, flow_matching.latent_dim)
+        windows = []
+        for i, start in enumerate((0, hop)):
+            # latents run at twice the frame rate of the codes
+            context = latents[:, latents.shape[1] - 2 * (window - hop) :]
+            latents = flow_matching.inference_codes(
+                [codes[:, :, start : start + window]],
+                context,
+                latent_length,
+                context.shape[1],
+                guidance_scale=1.25,
+                num_steps=2,
+                scenario="other_seg",
+                plan=plan,
+                generator=torch.Generator().manual_seed(i),
+            )
+            windows.append(latents)
+        return windows
+
+    plan = flow_matching.plan_windows(
+        batch_size=1,
+        num_frames=2 * window,
+        latent_length=latent_length,
+        num_steps=2,
+        guidance_scale=1.25,
+        device=torch.device("cpu"),
+        dtype=torch.float32,
+    )
+    for shared, fresh in zip(_two_windows(plan), _two_windows(None)):
+        assert torch.equal(shared, fresh)
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from heartlib import device_pool
+from heartlib.batch_queue import BatchQueue
+from heartlib.device_pool import DevicePoolExecutor, _cpu_affinities, _parse_cpulist
+from heartlib.jobs import DONE, FAILED
+
+ITEM = {"tags": "piano", "lyrics": "la la", "max_audio_length_ms": 800}
+
+
+class FakePipeline:
+    """Writes an empty file per song, and kills its process on "crash"."""
+
+    def __call__(self, inputs, save_path, **kwargs):
+        if os.path.basename(save_path).startswith("crash"):
+            os._exit(3)
+        open(save_path, "wb").close()
+
+
+def fake_factory(device):
+    return FakePipeline()
+
+
+def test_parse_cpulist():
+    assert _parse_cpulist("0-3,8-9,12\n") == {0, 1, 2, 3, 8, 9, 12}
+    assert _parse_cpulist("\n") == set()
+
+
+def test_cpu_workers_are_spread_over_numa_nodes(monkeypatch):
+    nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+    monkeypatch.setattr(device_pool, "_numa_nodes", lambda: nodes)
+    assert _cpu_affinities(3) == [[0, 1], [4, 5, 6, 7], [2, 3]]
+    # more workers than CPUs on a node: leave placement to the OS
+    assert _cpu_affinities(9) == [None] * 9
+    monkeypatch.setattr(device_pool, "_numa_nodes", lambda: [])
+    assert _cpu_affinities(2) == [None, None]
+
+
+def test_dead_worker_fails_only_its_item(tmp_path):
+    queue = BatchQueue(str(tmp_path / "queue.jsonl"))
+    # longest first: the crash is handed out first and takes its worker down
+    crash = queue.add(dict(ITEM, filename="crash", max_audio_length_ms=1600))
+    songs = [queue.add(dict(ITEM, filename=f"song{i}")) for i in range(4)]
+    executor = DevicePoolExecutor(["cpu", "cpu"], fake_factory, str(tmp_path))
+    try:
+        stats = executor.run(queue)
+    finally:
+        executor.shutdown()
+    assert (stats[DONE], stats[FAILED]) == (4, 1)
+    assert queue.get(crash)["state"] == FAILED
+    assert "exited (3)" in queue.get(crash)["error"]
+    assert all(queue.get(song)["state"] == DONE for song in songs)
+    queue.close()
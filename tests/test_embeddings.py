@@ -0,0 +1,58 @@
+import inspect
+
+import pytest
+import torch
+
+from conftest import CODEBOOK_SIZE, TEXT_VOCAB
+
+
+def _embed_tokens(model, tokens, tokens_mask, cfg_scale):
+    """The dense embedding the split paths replaced: every column of
+    [B, S, 9] tokens is looked up, then the masked columns are summed."""
+    B = tokens.size(0)
+    text_embeds = model.text_embeddings(tokens[:, :, -1])
+    if cfg_scale > 1.0 and B > 1:
+        uncond_mask = torch.arange(B) >= B // 2
+        uncond_text_embed = model.unconditional_text_embedding(
+            torch.zeros(1, dtype=torch.long)
+        )
+        text_embeds = torch.where(
+            uncond_mask.view(B, 1, 1).expand_as(text_embeds),
+            uncond_text_embed,
+            text_embeds,
+        )
+    audio_tokens = tokens[:, :, :-1] + CODEBOOK_SIZE * torch.arange(
+        model.config.audio_num_codebooks
+    )
+    embeds = torch.cat(
+        [model.audio_embeddings(audio_tokens), text_embeds.unsqueeze(-2)], dim=-2
+    )
+    return (embeds * tokens_mask.unsqueeze(-1)).sum(dim=2, dtype=embeds.dtype)
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16, torch.float16])
+@pytest.mark.parametrize("cfg_scale", [1.0, 1.5])
+@pytest.mark.parametrize("audio", [False, True], ids=["prompt", "frames"])
+def test_embed_matches_dense_embedding(tiny_mula, dtype, cfg_scale, audio):
+    model = tiny_mula.to(dtype)
+    generator = torch.Generator().manual_seed(0)
+    tokens = torch.randint(0, CODEBOOK_SIZE, (4, 12, 9), generator=generator)
+    tokens[..., -1] %= len(TEXT_VOCAB)
+    # prompt positions carry text only, frame positions codebooks only
+    tokens_mask = torch.zeros_like(tokens, dtype=torch.bool)
+    if audio:
+        tokens_mask[..., :-1] = True
+    else:
+        tokens_mask[..., -1] = True
+    with torch.no_grad():
+        expected = _embed_tokens(model, tokens, tokens_mask, cfg_scale)
+        actual = model._embed(tokens, tokens_mask, cfg_scale, audio)
+    assert actual.dtype == expected.dtype
+    assert torch.equal(actual, expected)
+
+
+@pytest.mark.parametrize("method", ["prefill", "generate_frame"])
+def test_audio_is_a_required_keyword(tiny_mula, method):
+    audio = inspect.signature(getattr(tiny_mula, method)).parameters["audio"]
+    assert audio.kind is inspect.Parameter.KEYWORD_ONLY
+    assert audio.default is inspect.Parameter.empty
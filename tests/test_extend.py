@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+
+ITEM = {"tags": "piano", "lyrics": "la la"}
+
+
+@pytest.fixture
+def no_forward(tiny_pipeline, monkeypatch):
+    def _forward(*args, **kwargs):
+        raise AssertionError("generation ran before the head audio was checked")
+
+    monkeypatch.setattr(tiny_pipeline, "_forward", _forward)
+    return tiny_pipeline
+
+
+def test_compressed_head_is_rejected(no_forward, tmp_path):
+    frames = torch.zeros(8, 10, dtype=torch.long)
+    head = str(tmp_path / "head.mp3")
+    sf.write(head, np.zeros((10 * 3840, 2), dtype=np.float32), 48000)
+    with pytest.raises(ValueError, match="compressed"):
+        no_forward.extend(ITEM, frames, 800, str(tmp_path / "out.wav"), audio=head)
+
+
+@pytest.mark.parametrize("num_samples", [9 * 3840, 12 * 3840])
+def test_mismatched_head_is_rejected(no_forward, tmp_path, num_samples):
+    frames = torch.zeros(8, 10, dtype=torch.long)
+    head = str(tmp_path / "head.wav")
+    sf.write(head, np.zeros((num_samples, 2), dtype=np.float32), 48000)
+    with pytest.raises(ValueError, match="samples"):
+        no_forward.extend(ITEM, frames, 800, str(tmp_path / "out.wav"), audio=head)
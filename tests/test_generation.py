@@ -0,0 +1,61 @@
+import pytest
+import torch
+
+from heartlib.cancellation import GenerationPreempted
+from heartlib.pipelines.music_generation import frames_path, read_frames
+
+ITEM = {"tags": "piano,happy", "lyrics": "[Verse]\nla la la"}
+# 12 frames of 80 ms
+LENGTH_MS = 960
+
+
+def _frames_of(pipe, save_path, **kwargs):
+    torch.manual_seed(0)
+    pipe(
+        ITEM,
+        max_audio_length_ms=LENGTH_MS,
+        save_path=save_path,
+        save_frames=True,
+        **kwargs,
+    )
+    return read_frames(frames_path(save_path))
+
+
+@pytest.mark.parametrize("prefill_chunk_size", [None, 3])
+def test_resumed_generation_matches_uninterrupted(
+    tiny_pipeline, tmp_path, prefill_chunk_size
+):
+    expected = _frames_of(tiny_pipeline, str(tmp_path / "whole.wav"))
+
+    checkpoint = str(tmp_path / "song.ckpt")
+    with pytest.raises(GenerationPreempted):
+        _frames_of(
+            tiny_pipeline,
+            str(tmp_path / "part.wav"),
+            frame_budget=5,
+            checkpoint_path=checkpoint,
+        )
+    # the RNG state comes from the checkpoint, not from the caller
+    torch.manual_seed(1)
+    resumed = str(tmp_path / "resumed.wav")
+    tiny_pipeline.resume(
+        checkpoint,
+        save_path=resumed,
+        save_frames=True,
+        prefill_chunk_size=prefill_chunk_size,
+    )
+    # preempted half-way, not after the last frame
+    assert expected.shape[1] > 2 * 5
+    assert torch.equal(read_frames(frames_path(resumed)), expected)
+
+
+def test_candidate_is_reproducible_from_its_seed(tiny_pipeline):
+    candidates = tiny_pipeline.generate_candidates(
+        ITEM, n=3, seeds=[5, 6, 7], max_audio_length_ms=LENGTH_MS
+    )
+    (alone,) = tiny_pipeline.generate_candidates(
+        ITEM, n=1, seeds=[6], max_audio_length_ms=LENGTH_MS
+    )
+    assert [c["seed"] for c in candidates] == [5, 6, 7]
+    assert torch.equal(candidates[1]["frames"], alone["frames"])
+    assert not torch.equal(candidates[0]["frames"], candidates[1]["frames"])
@@ -0,0 +1,39 @@
+"""
+Import-time budgets: the GUI and the queue/library modules must start
+without pulling in the model stack. Uses the parser and runner of
+examples/benchmark_import_time.py, which prints the full report.
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "examples",
+    "benchmark_import_time.py",
+)
+_spec = importlib.util.spec_from_file_location("benchmark_import_time", _SCRIPT)
+benchmark_import_time = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(benchmark_import_time)
+
+FORBID = ("torch", "torchtune", "transformers")
+BUDGETS_MS = {"gui_app": 1500, "heartlib.library": 150, "heartlib.batch_queue": 400}
+
+
+@pytest.fixture(scope="module")
+def startup():
+    return {row[0] for row in benchmark_import_time.run_importtime("pass")}
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS_MS))
+def test_import_budget(module, startup):
+    total_ms, _, imported = benchmark_import_time.measure(module, startup, repeat=3)
+    pulled_in = [
+        name
+        for name in FORBID
+        if any(m == name or m.startswith(name + ".") for m in imported)
+    ]
+    assert not pulled_in, f"import {module} pulls in {pulled_in}"
+    assert total_ms < BUDGETS_MS[module], f"import {module} took {total_ms:.1f} ms"
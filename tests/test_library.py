@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from heartlib.library import GenerationLibrary
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = GenerationLibrary(str(tmp_path / "library.db"), legacy_json=None)
+    yield library
+    library.close()
+
+
+def _add(library, name, duration_s, **settings):
+    settings = {
+        "tags": "piano",
+        "topk": 50,
+        "temperature": 1.0,
+        "cfg_scale": 1.5,
+        **settings,
+    }
+    entry = library.add(f"/songs/{name}.mp3", settings)
+    library.update(entry["id"], duration_s=duration_s)
+    return entry["id"]
+
+
+def test_duration_and_setting_filters(library):
+    short = _add(library, "short", 30.0)
+    long = _add(library, "long", 120.0, topk=20, temperature=0.8)
+    unknown = _add(library, "unknown", None, cfg_scale=3.0)
+
+    def ids(**filters):
+        assert library.count(**filters) == len(library.page(**filters))
+        return {entry["id"] for entry in library.page(**filters)}
+
+    assert ids() == {short, long, unknown}
+    assert ids(min_duration=60) == {long}
+    assert ids(max_duration=60) == {short}
+    assert ids(min_duration=30, max_duration=120) == {short, long}
+    assert ids(topk=50) == {short, unknown}
+    assert ids(temperature=0.8) == {long}
+    assert ids(cfg_scale=3.0) == {unknown}
+    assert ids(cfg_scale=1.5, max_duration=60) == {short}
+    with pytest.raises(TypeError):
+        library.count(duration=60)
+
+
+def test_migrate_json_accepts_null_settings(library, tmp_path):
+    legacy = tmp_path / "generation_history.json"
+    legacy.write_text(
+        json.dumps(
+            [
+                {"file_path": "/songs/b.mp3", "settings": None},
+                {"file_path": "/songs/a.mp3", "settings": {"seed": 7}},
+            ]
+        )
+    )
+    assert library.migrate_json(str(legacy)) == 2
+    newest, oldest = library.page()
+    assert newest["settings"] == {}
+    assert oldest["settings"] == {"seed": 7}
+    assert library.count(seed=7) == 1
@@ -0,0 +1,27 @@
+import warnings
+
+import pytest
+
+from heartlib.pipelines.prompt_encoding import read_text
+
+
+def test_path_is_read_and_str_is_text(tmp_path):
+    lyrics = tmp_path / "lyrics.txt"
+    lyrics.write_text("[Verse]\nla la", encoding="utf-8")
+    assert read_text(lyrics, "lyrics") == "[Verse]\nla la"
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert read_text("[Verse]\nla la", "lyrics") == "[Verse]\nla la"
+        assert read_text("piano,happy", "tags") == "piano,happy"
+
+
+def test_str_naming_a_file_warns(tmp_path):
+    tags = tmp_path / "tags.txt"
+    tags.write_text("piano,happy", encoding="utf-8")
+    with pytest.warns(FutureWarning, match="pathlib.Path"):
+        assert read_text(str(tags), "tags") == str(tags)
+
+
+def test_other_types_are_rejected():
+    with pytest.raises(TypeError, match="lyrics"):
+        read_text(None, "lyrics")
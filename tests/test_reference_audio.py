@@ -0,0 +1,121 @@
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+
+from heartlib.reference_audio import (
+    EmbeddingCache,
+    MuQMuLanEmbedder,
+    ReferenceAudioEncoder,
+)
+
+
+class CountingEmbedder:
+    """Stands in for MuQMuLanEmbedder and counts its forward passes."""
+
+    # the cache-only encoder reads MuQ-MuLan's cache namespace
+    name = MuQMuLanEmbedder.name
+    sample_rate = 24_000
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, wav: torch.Tensor) -> torch.Tensor:
+        self.calls += 1
+        return torch.full((512,), float(wav.abs().mean()) + self.calls)
+
+
+def _write_song(path, seed):
+    rng = np.random.default_rng(seed)
+    sf.write(str(path), rng.uniform(-0.5, 0.5, (24_000, 2)).astype(np.float32), 24_000)
+    return str(path)
+
+
+@pytest.fixture
+def embedder():
+    return CountingEmbedder()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "cache"))
+
+
+def test_cache_hit_skips_the_extractor(embedder, cache, tmp_path):
+    song = _write_song(tmp_path / "song.wav", 0)
+    first = ReferenceAudioEncoder(embedder, cache).encode(song)
+    # a new encoder, so only the on-disk cache can answer
+    again = ReferenceAudioEncoder(embedder, cache).encode(song)
+    assert embedder.calls == 1
+    assert torch.equal(first, again)
+
+
+def test_key_depends_only_on_content(embedder, cache, tmp_path):
+    encoder = ReferenceAudioEncoder(embedder, cache)
+    song = _write_song(tmp_path / "song.wav", 0)
+    embedding = encoder.encode(song)
+
+    renamed = shutil.copy(song, tmp_path / "renamed.wav")
+    assert torch.equal(encoder.encode(renamed), embedding)
+    assert embedder.calls == 1
+
+    _write_song(song, 1)
+    assert not torch.equal(encoder.encode(song), embedding)
+    assert embedder.calls == 2
+
+
+def test_cache_only_mode_raises_key_error(embedder, cache, tmp_path):
+    cached = _write_song(tmp_path / "cached.wav", 0)
+    ReferenceAudioEncoder(embedder, cache).encode(cached)
+
+    cache_only = ReferenceAudioEncoder(None, cache)
+    assert torch.equal(
+        cache_only.encode(cached), ReferenceAudioEncoder(embedder, cache).encode(cached)
+    )
+    with pytest.raises(KeyError):
+        cache_only.encode(_write_song(tmp_path / "new.wav", 1))
+
+
+def test_embedding_goes_to_the_muq_slot_of_the_conditioned_row(
+    tiny_pipeline, embedder, cache, tmp_path
+):
+    tiny_pipeline.reference_encoder = ReferenceAudioEncoder(embedder, cache)
+    song = _write_song(tmp_path / "song.wav", 0)
+    inputs = {"tags": "piano", "lyrics": "la la", "ref_audio": song}
+    model_inputs = tiny_pipeline.preprocess(inputs, cfg_scale=1.5)
+    embedding = tiny_pipeline.reference_encoder.encode(song)
+    idx = model_inputs["muq_idx"][0]
+    assert model_inputs["muq_idx"] == [idx, idx]
+    assert torch.equal(model_inputs["muq_embed"][0], embedding)
+    # the slot is part of the prompt but holds no text token
+    assert model_inputs["tokens_mask"][0, idx, -1]
+    assert model_inputs["tokens"][0, idx, -1] == 0
+
+    model = tiny_pipeline.mula
+    captured = {}
+    hook = model.backbone.register_forward_pre_hook(
+        lambda module, args, kwargs: captured.update(h=args[0].clone()),
+        with_kwargs=True,
+    )
+    try:
+        model.setup_caches(2)
+        with torch.no_grad():
+            model.prefill(
+                model_inputs["tokens"],
+                model_inputs["tokens_mask"],
+                model_inputs["pos"],
+                cfg_scale=1.5,
+                continuous_segments=model_inputs["muq_embed"],
+                starts=model_inputs["muq_idx"],
+                audio=False,
+            )
+    finally:
+        hook.remove()
+    h = captured["h"]
+    with torch.no_grad():
+        conditioned = model.muq_linear(embedding)
+        unconditional = model.unconditional_text_embedding.weight[0]
+    assert torch.allclose(h[0, idx], conditioned)
+    assert torch.equal(h[1, idx], unconditional)
@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+import pytest
+import soundfile as sf
+
+from heartlib.jobs import CANCELLED, DONE, RUNNING, JobRunner
+from heartlib.serve import JobClient, make_server
+
+ITEM = {"tags": "piano,happy", "lyrics": "[Verse]\nla la la", "seed": 0}
+
+
+@pytest.fixture
+def client(tiny_pipeline, tmp_path):
+    runner = JobRunner(tiny_pipeline, str(tmp_path))
+    runner.start()
+    server = make_server(runner, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield JobClient(f"http://127.0.0.1:{server.server_address[1]}")
+    server.shutdown()
+    server.server_close()
+    runner.stop()
+
+
+def _wait_for_status(client, job_id, status, timeout=30):
+    deadline = time.monotonic() + timeout
+    while client.status(job_id)["status"] != status:
+        assert time.monotonic() < deadline, f"job {job_id} never became {status}"
+        time.sleep(0.01)
+
+
+def test_submit_poll_and_fetch(client):
+    job = client.submit(dict(ITEM, filename="short", max_audio_length_ms=800))
+    done = client.wait(job["id"], poll_interval=0.05, timeout=60)
+    assert done["status"] == DONE
+    assert done["seed"] == 0
+    assert os.path.exists(done["save_path"])
+    assert sf.info(done["save_path"]).samplerate == 48000
+    assert [j["id"] for j in client.jobs()] == [job["id"]]
+
+
+def test_cancel_running_and_queued(client):
+    running = client.submit(dict(ITEM, filename="long", max_audio_length_ms=600_000))
+    queued = client.submit(dict(ITEM, filename="queued"))
+    _wait_for_status(client, running["id"], RUNNING)
+
+    assert client.cancel(queued["id"])["status"] == CANCELLED
+    client.cancel(running["id"])
+    stopped = client.wait(running["id"], poll_interval=0.05, timeout=30)
+    assert stopped["status"] == CANCELLED
+    assert not os.path.exists(stopped["save_path"])
+    assert client.status(queued["id"])["started_at"] is None
+
+
+@pytest.mark.parametrize(
+    "job", [dict(ITEM, topk=None), dict(ITEM, seed=[1]), ["not", "a", "job"]]
+)
+def test_malformed_job_is_rejected(client, job):
+    with pytest.raises(RuntimeError, match=r"\(400\)"):
+        client.submit(job)